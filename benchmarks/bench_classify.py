@@ -0,0 +1,63 @@
+"""Extension classification speed on synthetic filenames.
+
+Usage: python benchmarks/bench_classify.py [--count 1000000]
+
+Compares the old chain of `in list` checks used by organize and rename with
+the precomputed fileExtensions.classify lookup.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import fileExtensions
+
+
+def old_doc_type(name):
+    # The if/elif chain bulk_rename used for {doc_type}
+    suffix_lower = Path(name).suffix.lower()
+    if suffix_lower in fileExtensions.document_extensions:
+        return 'document'
+    elif suffix_lower in fileExtensions.image_extensions:
+        return 'image'
+    elif suffix_lower in fileExtensions.video_extensions:
+        return 'video'
+    elif suffix_lower in fileExtensions.audio_extensions:
+        return 'audio'
+    elif suffix_lower in fileExtensions.archive_extensions:
+        return 'archive'
+    elif suffix_lower in fileExtensions.code_extensions:
+        return 'code'
+    elif suffix_lower in fileExtensions.web_extensions:
+        return 'web'
+    elif suffix_lower in fileExtensions.font_extensions:
+        return 'font'
+    elif suffix_lower in fileExtensions.executable_extensions:
+        return 'executable'
+    elif suffix_lower in fileExtensions.database_extensions:
+        return 'database'
+    return 'other'
+
+
+def main():
+    parser = ArgumentParser(description='Extension classification benchmark')
+    parser.add_argument('--count', type=int, default=1_000_000, help='Number of synthetic filenames (default: 1000000)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    suffixes = list(fileExtensions.CATEGORY_BY_SUFFIX) + ['.xyz', '.unknown', '']
+    names = [f'file_{i}{rng.choice(suffixes).upper() if i % 7 == 0 else rng.choice(suffixes)}' for i in range(args.count)]
+
+    for label, func in [('if/elif list chain (old)', old_doc_type), ('fileExtensions.classify', fileExtensions.classify)]:
+        start = time.perf_counter()
+        for name in names:
+            func(name)
+        elapsed = time.perf_counter() - start
+        print(f'{label:<28} {elapsed:6.2f} s  {args.count / elapsed / 1e6:6.2f} M names/s')
+
+
+if __name__ == '__main__':
+    main()
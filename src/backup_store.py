@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import stat
+from pathlib import Path
+
+import fastcopy
+
+
+class BackupStore:
+    """Content-addressed store for files removed by delete operations.
+
+    Each distinct content is kept once, as objects/<digest[:2]>/<digest>, no
+    matter how many deleted paths had it. Every operation gets a manifest,
+    manifests/<op_id>.jsonl, with one line per path: its blob, mode and mtime.
+    Restoring is a lookup in the manifest, nothing is hashed again.
+
+    Only the manifests of the last `keep` operations are kept; blobs no
+    remaining manifest refers to are removed with them.
+
+    hash_file(path) names the blobs of files added without a digest, except
+    those that become hardlinks: they are named after their inode, which the
+    blob itself keeps from being reused, so they are never read at all.
+    """
+
+    def __init__(self, root: Path, keep: int = 20, hash_file=None):
+        self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.manifests = self.root / 'manifests'
+        self.keep = keep
+        self.hash_file = hash_file
+
+    def add(self, op_id: int, path: Path, digest: str = None, link: bool = False) -> str:
+        """Store path under op_id and return how: 'linked', 'copied', 'stored' (already there) or 'dir'.
+
+        link=True is for a path that is about to be unlinked: if it is its
+        inode's only name, the blob becomes a hardlink to it instead of a copy.
+        """
+        st = path.stat()
+        entry = {"path": str(path), "blob": digest, "mode": st.st_mode, "mtime_ns": st.st_mtime_ns}
+        how = 'dir'
+
+        if stat.S_ISDIR(st.st_mode):
+            entry["blob"] = None
+        else:
+            entry["blob"], how = self._store_blob(path, digest, st, link)
+
+        self.manifests.mkdir(parents=True, exist_ok=True)
+        with open(self.manifests / f'{op_id}.jsonl', 'a') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+        return how
+
+    def manifest(self, op_id: int):
+        # Manifest of one operation as {original path: entry}, or None if it has none
+        manifest_path = self.manifests / f'{op_id}.jsonl'
+        if not manifest_path.exists():
+            return None
+
+        with open(manifest_path, 'r') as f:
+            return {entry["path"]: entry for entry in map(json.loads, f)}
+
+    def restore(self, entry: dict):
+        path = Path(entry["path"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if entry["blob"] is None:
+            path.mkdir(exist_ok=True)
+        else:
+            # A copy, not a link: the blob may belong to other operations and must not change
+            fastcopy.copy_file(self._blob_path(entry["blob"]), path)
+
+        os.chmod(path, stat.S_IMODE(entry["mode"]))
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def unshare(self, op_id: int):
+        """Give every blob of op_id still sharing its inode with a live path its own copy.
+
+        A blob linked to a path that then was not deleted would change with
+        that file; copying it keeps the backup what it was when taken.
+        """
+        manifest = self.manifest(op_id) or {}
+
+        for entry in manifest.values():
+            if entry["blob"] is None:
+                continue
+
+            blob = self._blob_path(entry["blob"])
+            try:
+                if not os.path.samefile(entry["path"], blob):
+                    continue
+            except OSError:
+                continue
+
+            tmp = blob.with_name(f'{entry["blob"]}.tmp')
+            fastcopy.copy_file(blob, tmp, fsync=True)
+            os.replace(tmp, blob)
+
+    def drop(self, op_id: int):
+        (self.manifests / f'{op_id}.jsonl').unlink(missing_ok=True)
+
+    def mark(self, op_id: int) -> int:
+        # Where the manifest of op_id ends now, for truncate to return to
+        try:
+            return (self.manifests / f'{op_id}.jsonl').stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def truncate(self, op_id: int, mark: int):
+        """Forget the entries added to op_id since mark, keeping the ones before it."""
+        if not mark:
+            self.drop(op_id)
+            return
+
+        with open(self.manifests / f'{op_id}.jsonl', 'r+b') as f:
+            f.truncate(mark)
+
+    def prune(self):
+        if not self.manifests.exists():
+            return
+
+        manifests = sorted(self.manifests.glob('*.jsonl'), key=lambda p: int(p.stem))
+        for old in manifests[:-self.keep] if len(manifests) > self.keep else []:
+            old.unlink()
+
+        referenced = set()
+        for manifest_path in self.manifests.glob('*.jsonl'):
+            with open(manifest_path, 'r') as f:
+                referenced.update(entry["blob"] for entry in map(json.loads, f))
+
+        removed = 0
+        if self.objects.exists():
+            for blob in self.objects.glob('*/*'):
+                if blob.name not in referenced:
+                    blob.unlink()
+                    removed += 1
+
+        if removed:
+            logging.info(f'Backup store pruned {removed} unreferenced blobs')
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    def _store_blob(self, path: Path, digest: str, st: os.stat_result, link: bool) -> tuple[str, str]:
+        # (blob name, how it was stored)
+        self.objects.mkdir(parents=True, exist_ok=True)
+
+        # On the store's filesystem a hardlink keeps the data once the original is unlinked,
+        # without copying a byte. Only the inode's last name may be linked: with another name
+        # left, an edit through it would change the backup. Anything else is copied by the kernel.
+        linkable = link and st.st_nlink == 1 and st.st_dev == self.objects.stat().st_dev
+
+        if digest is None and linkable:
+            # Named after the inode, which the blob keeps from being reused: nothing is read
+            name = f'{st.st_ino:x}-{st.st_dev:x}'
+            blob = self._blob_path(name)
+            try:
+                blob.parent.mkdir(exist_ok=True)
+                os.link(path, blob)
+                return name, 'linked'
+            except FileExistsError:
+                # The same file only while the blob still is a link to it, unshare may have copied it since
+                if os.path.samefile(path, blob):
+                    return name, 'stored'
+            except OSError as e:
+                logging.debug(f'Could not hardlink {path}, copying instead: {e}')
+                linkable = False
+
+        if digest is None:
+            digest = self.hash_file(path)
+
+        blob = self._blob_path(digest)
+        if blob.exists():
+            return digest, 'stored'
+
+        blob.parent.mkdir(exist_ok=True)
+
+        if linkable:
+            try:
+                os.link(path, blob)
+                return digest, 'linked'
+            except FileExistsError:
+                return digest, 'stored'
+            except OSError as e:
+                logging.debug(f'Could not hardlink {path}, copying instead: {e}')
+
+        tmp = blob.with_name(f'{digest}.tmp')
+        fastcopy.copy_file(path, tmp, fsync=True)
+        os.replace(tmp, blob)
+        return digest, 'copied'
@@ -0,0 +1,112 @@
+import errno
+import logging
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# copy_file_range and sendfile refuse some file pairs (other filesystem, special files, old kernels)
+_FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# _IOW(0x94, 9, int) from <linux/fs.h>
+FICLONE = 0x40049409
+
+
+def copy_file(src, dest, fsync=False) -> int:
+    """Copy src to dest, data and metadata, letting the kernel move the bytes.
+
+    Tries os.copy_file_range (which can reflink or copy server side), then
+    os.sendfile, then a plain userspace copy, resuming from wherever the
+    previous method stopped. With fsync=True the data is durable on return.
+    Returns the number of bytes copied.
+    """
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = _copy_file_range(fsrc.fileno(), fdst.fileno(), size)
+
+        if copied < size:
+            copied = _sendfile(fsrc.fileno(), fdst.fileno(), copied, size)
+
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst)
+
+        if fsync:
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+    shutil.copystat(src, dest)
+    return size
+
+
+def fsync_path(path):
+    # Flush a file, or a directory's entries, that was written without fsync
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def clone_file(src, dest):
+    """Create dest as a copy-on-write clone of src, sharing all its blocks (btrfs, XFS, ...).
+
+    Raises OSError when the filesystem or platform cannot clone; dest is
+    removed again in that case.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported on this platform', str(src))
+
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            os.unlink(dest)
+            raise
+
+    shutil.copystat(src, dest)
+
+
+def _copy_file_range(src_fd, dest_fd, size):
+    if not hasattr(os, 'copy_file_range'):
+        return 0
+
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src_fd, dest_fd, min(CHUNK_SIZE, size - copied), copied, copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRORS:
+            raise
+        logging.debug(f'copy_file_range unavailable, falling back: {e}')
+
+    return copied
+
+
+def _sendfile(src_fd, dest_fd, copied, size):
+    if not hasattr(os, 'sendfile'):
+        return copied
+
+    # sendfile writes at the destination's file position, copy_file_range left it at 0
+    os.lseek(dest_fd, copied, os.SEEK_SET)
+    try:
+        while copied < size:
+            n = os.sendfile(dest_fd, src_fd, copied, min(CHUNK_SIZE, size - copied))
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRORS:
+            raise
+        logging.debug(f'sendfile unavailable, falling back: {e}')
+
+    return copied
@@ -1,3 +1,5 @@
+import os
+
 image_extensions = [
     '.jpg',
     '.jpeg',
@@ -318,4 +320,41 @@ web_extensions = [
     '.atom',
     '.wasm',
     '.map',  # Source map
-]
\ No newline at end of file
+]
+
+# Lookup tables generated once from the lists above.
+#
+# Some extensions appear in more than one list (.ts is code and video, .epub is a
+# document and an ebook, .dmg an archive and an executable, ...). The first
+# category in CATEGORY_PRIORITY that lists an extension wins. The order is the
+# one organize and rename have always checked in, so existing results do not move.
+CATEGORY_PRIORITY = [
+    ('document', document_extensions),
+    ('image', image_extensions),
+    ('video', video_extensions),
+    ('audio', audio_extensions),
+    ('archive', archive_extensions),
+    ('code', code_extensions),
+    ('web', web_extensions),
+    ('font', font_extensions),
+    ('executable', executable_extensions),
+    ('database', database_extensions),
+    ('model_3d', model_3d_extensions),
+    ('cad', cad_extensions),
+    ('ebook', ebook_extensions),
+    ('system', system_extensions),
+]
+
+OTHER = 'other'
+
+CATEGORY_EXTENSIONS = {category: frozenset(extensions) for category, extensions in CATEGORY_PRIORITY}
+
+CATEGORY_BY_SUFFIX = {}
+for _category, _extensions in reversed(CATEGORY_PRIORITY):
+    CATEGORY_BY_SUFFIX.update(dict.fromkeys(_extensions, _category))
+del _category, _extensions
+
+
+def classify(path) -> str:
+    """Return the category of a file from its extension, or 'other'."""
+    return CATEGORY_BY_SUFFIX.get(os.path.splitext(os.fspath(path))[1].lower(), OTHER)
@@ -0,0 +1,77 @@
+import fnmatch
+import operator
+import os
+import re
+
+RULES = ('GLOB', 'glob:GLOB', 'ext:EXT[,EXT...]', 'regex:PATTERN', 'size:<SIZE', 'size:>SIZE')
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
+
+_SIZE_RULE = re.compile(r'(<=|>=|<|>)\s*([0-9]*\.?[0-9]+)\s*([A-Za-z]*)')
+_COMPARE = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class FileFilter:
+    """Selects files with --include / --exclude rules.
+
+    A file is kept when it matches at least one include rule (or there are
+    none) and no exclude rule:
+      GLOB, glob:GLOB   shell pattern on the file name (*.jpg, IMG_????.*)
+      ext:EXT,...       extensions, any case (ext:jpg,jpeg,heic)
+      regex:PATTERN     searched in the full path
+      size:<SIZE        size comparison, also <=, > and >= (size:>10MB)
+    Rules are compiled once; needs_stat tells whether the entries handed to
+    matches() must carry their size.
+    """
+
+    def __init__(self, include: list[str] = (), exclude: list[str] = ()):
+        self.include = [_compile(rule) for rule in include or ()]
+        self.exclude = [_compile(rule) for rule in exclude or ()]
+        self.needs_stat = any(rule.startswith('size:') for rule in (*(include or ()), *(exclude or ())))
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def matches(self, entry) -> bool:
+        # entry is a walker.Entry
+        if self.include and not any(test(entry) for test in self.include):
+            return False
+        return not any(test(entry) for test in self.exclude)
+
+
+def parse_size(text: str) -> int:
+    """'10MB', '1.5 GB' or a plain number of bytes, in bytes."""
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+)\s*([A-Za-z]*)\s*', text)
+    unit = (match.group(2).upper() or 'B') if match else None
+
+    if unit not in SIZE_UNITS:
+        raise ValueError(f'invalid size {text!r}, use a number and one of: {", ".join(SIZE_UNITS)}')
+    return int(float(match.group(1)) * SIZE_UNITS[unit])
+
+
+def _compile(rule: str):
+    name, sep, value = rule.partition(':')
+
+    if name == 'ext' and sep and value:
+        suffixes = {f'.{ext.strip().lstrip(".").lower()}' for ext in value.split(',') if ext.strip()}
+        return lambda entry: os.path.splitext(entry.name)[1].lower() in suffixes
+
+    if name == 'regex' and sep and value:
+        try:
+            pattern = re.compile(value)
+        except re.error as e:
+            raise ValueError(f'invalid regex in filter {rule!r}: {e}') from e
+        return lambda entry: pattern.search(entry.path) is not None
+
+    if name == 'size' and sep:
+        match = _SIZE_RULE.fullmatch(value.strip())
+        if not match:
+            raise ValueError(f'invalid size filter {rule!r}, expected e.g. size:>10MB or size:<=500KB')
+        compare, limit = _COMPARE[match.group(1)], parse_size(match.group(2) + match.group(3))
+        return lambda entry: compare(entry.size, limit)
+
+    # Anything else is a glob, with or without the glob: prefix
+    glob = value if name == 'glob' and sep else rule
+    if not glob or (sep and name in ('ext', 'regex')):
+        raise ValueError(f'invalid filter {rule!r}, expected one of: {", ".join(RULES)}')
+    return lambda entry: fnmatch.fnmatchcase(entry.name, glob)
@@ -1,33 +1,100 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, BooleanOptionalAction
 from pathlib import Path
 import shutil
-import re
-import hashlib
+import stat
+import errno
 from datetime import datetime as dt, timedelta
 import time
 from collections import defaultdict
 import logging
+import logging.handlers
+import sys
+from itertools import islice
 import fileExtensions
+import heapq
 import json
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'
-)
+import os
+import sqlite3
+import threading
+import fastcopy
+import hashing
+import walker
+from hash_cache import HashCache
+from journal import OperationJournal
+from backup_store import BackupStore
+from fs_index import FileIndex
+from rename_plan import plan_renames
+from file_filter import FileFilter, RULES as FILTER_RULES
+from rename_template import RenameTemplate, PLACEHOLDERS as RENAME_PLACEHOLDERS, has_separator
+from policy import KeepPolicy, RULES as KEEP_RULES
+from progress import Progress
+from inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_ISDIR
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'
+
+# Per-file messages ("Organizing x.pdf"): printed in the default output mode, and written to --log-file if given
+file_log = logging.getLogger('file_organizer.files')
+file_log.propagate = False
+
+# Folder each category is moved into by organize; every other category goes to Others
+ORGANIZE_FOLDERS = {
+    'document': 'Documents',
+    'image': 'Images',
+    'video': 'Videos',
+    'audio': 'Audios',
+    'archive': 'Archives',
+}
+CREATED_FOLDERS = [*ORGANIZE_FOLDERS.values(), 'Others']
+
+# Directories duplicate (without --all) and recursive organize never descend into
+EXCLUDED_DIRS = frozenset({
+    # Virtual environments
+    '.venv', 'venv', 'env', 'virtualenv',
+    # Package managers
+    'node_modules', 'site-packages', 'dist-packages',
+    # Caches
+    '__pycache__', '.cache',
+    # Version control
+    '.git', '.svn', '.hg',
+    # Build artifacts
+    'dist', 'build', 'Debug', 'Release', 'obj', 'bin',
+    # System directories
+    'Library', 'AppData', 'ProgramData',
+    # .NET
+    '.dotnet', '.nuget',
+})
+
+# Files moved to another filesystem are made durable, and their sources removed, in batches this big
+MOVE_BATCH_FILES = 64
+MOVE_BATCH_BYTES = 256 * 1024**2
+# Entries bulk_rename reads (and hashes, for {hash8}) at a time
+RENAME_BATCH = 256
+# Moves between two flushes of the journal; resume restarts from the last such checkpoint
+CHECKPOINT_FILES = 1000
+# Fewest pairs compared at once by duplicate verification, which waits on the disk, whatever --workers says
+VERIFY_WORKERS = 4
 
 class FileOrganizer:
 
     def __init__(self, base_dir=None):
         self.BASE_DIR = Path(base_dir).expanduser().resolve() if base_dir else Path(__file__).expanduser().parent
-        self.operation_log = self.BASE_DIR/'operations.json'
-        self.deleted_file_mapping = defaultdict(list)
-
-        if self.operation_log.exists():
-            with open(self.operation_log, 'r') as f:
-                self.operations = json.load(f)
-        else:
-            self.operations = {"operations" : []}
+        self.journal = OperationJournal(self.BASE_DIR)
+        self.backup_store = BackupStore(self.BASE_DIR/'.backups', hash_file=self._get_file_hash)
+        self.stop_watching = threading.Event()
+        self.file_index = None
+        self.keep_policy = None
+        self.verify = True
+        self.output = 'normal'
+        self.hash_cache_path = self.BASE_DIR/'hash_cache.db'
+        self.use_hash_cache = True
+        self.hash_cache = None
+        self.workers = 1
+        self.worker_mode = 'thread'
+        self.hash_algorithm = hashing.DEFAULT_ALGORITHM
+        self.buffer_size = hashing.DEFAULT_BUFFER_SIZE
+
+        # Operations used to be kept in one operations.json, rewritten after every command
+        self.journal.migrate_legacy(self.BASE_DIR/'operations.json')
 
     def organize_dir(self, args):
         logging.info(f'Starting file organization: {args.directory}')
@@ -43,91 +110,44 @@ class FileOrganizer:
             print(f'{directory} is a file not a directory')
             return
 
-        doc_count = 0
-        img_count = 0
-        vid_count = 0
-        aud_count = 0
-        arc_count = 0
-        other_count = 0
-
+        recursive = getattr(args, 'recursive', False)
         start_time = time.perf_counter()
 
-        moved_file_log = {
-            "action": "organize directory",
-            "timestamp" : dt.now().isoformat(timespec="seconds"),
-            "paths" : [
-
-            ]
-        }
-        for item in list(directory.iterdir()):
-
-            if not item.is_file():
-                continue
-
-            suffix_lower = item.suffix.lower()
-
-            if suffix_lower in fileExtensions.document_extensions:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Documents')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "documents"})
-                doc_count += 1
-
-
-            elif suffix_lower in fileExtensions.image_extensions:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Images')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "images"})
-                img_count += 1
-
-            elif suffix_lower in fileExtensions.video_extensions:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Videos')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "videos"})
-                vid_count += 1
+        plan = self._plan_organize(directory, recursive)
 
-            elif suffix_lower in fileExtensions.audio_extensions:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Audios')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "audios"})
-                aud_count += 1
-
-            elif suffix_lower in fileExtensions.archive_extensions:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Archives')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "archives"})
-                arc_count += 1
-
-            else:
-                print(f"Organizing {item.name}")
-                new_loc = self._safe_move(item, directory/'Others')
-                moved_file_log["paths"].insert(0,{"from" : str(item), "to" : str(new_loc), "type" : "others"})
-                other_count += 1
-
-        self.operations["operations"].insert(0, moved_file_log)
-        self._save()
+        if getattr(args, 'dry_run', False):
+            self._print_plan({"action": "move", "from": str(src), "to": str(dest), "type": folder.lower()}
+                             for src, dest, folder in plan)
+            return
 
-        created_folders = {'Documents', 'Images', 'Videos', 'Audios', 'Archives', 'Others'}
-        for item in directory.iterdir():
-            if item.is_dir() and item.name not in created_folders:
+        self._configure_workers(args)
+        op_id = self.journal.begin("organize directory", directory=str(directory), recursive=recursive)
+        counts = self._apply_organize_plan(plan, op_id)
+        self.journal.commit(op_id)
+        self._finish_organize(directory, {src.parent for src, _, _ in plan}, counts, start_time)
+
+    def _finish_organize(self, directory: Path, sources: set, counts: dict, start_time: float):
+        # Only folders files were moved out of are removed, once empty, and then their parents up to
+        # directory as they empty too. Folders that were already empty, or that the walk skipped, stay.
+        for folder in sorted(sources, key=lambda path: len(path.parts), reverse=True):
+            while folder != directory and directory in folder.parents:
                 try:
-                    item.rmdir()
+                    os.rmdir(folder)
                 except OSError as e:
-                    logging.warning(f'Could not remove folder {item.name}: {e}')
-                    pass
+                    if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                        logging.warning(f'Could not remove folder {folder}: {e}')
+                    break
+                folder = folder.parent
 
         end_time = time.perf_counter()
         elapsed_time = end_time - start_time
 
-        total_files = doc_count + img_count + vid_count + aud_count + arc_count + other_count
+        total_files = sum(counts.values())
         logging.info(f'Organization complete. Organized {total_files} files in {elapsed_time:.1f} seconds')
         
         print('Created folders')
-        print(f"\tDocuments ({doc_count}) files)")
-        print(f"\tImages ({img_count}) files)")
-        print(f"\tVideos ({vid_count}) files)")
-        print(f"\tAudios ({aud_count}) files)")
-        print(f"\tArchives ({arc_count}) files)")
-        print(f"\tOthers ({other_count}) files)")
+        for folder, count in counts.items():
+            print(f"\t{folder} ({count}) files)")
         print(f'Organized {total_files} files in {elapsed_time:.1f} seconds.')
 
     def manage_duplicates(self, args):
@@ -144,14 +164,6 @@ class FileOrganizer:
             print(f'{directory} is a file not a directory')
             return
 
-        deleted_file_log = {
-            "action" : "delete paths",
-            "timestamp" : dt.now().isoformat(timespec="seconds"),
-            "paths" : [
-
-            ]
-        }
-
         min_size = args.min_size
         result = self._convert_to_bytes(min_size)
 
@@ -159,68 +171,77 @@ class FileOrganizer:
             return
 
         min_size = result[0]
-        files = defaultdict(list)
-
-        exclusive_dirs = {
-            # Virtual environments
-            '.venv', 'venv', 'env', 'virtualenv',
-            # Package managers
-            'node_modules', 'site-packages', 'dist-packages',
-            # Caches
-            '__pycache__', '.cache',
-            # Version control
-            '.git', '.svn', '.hg',
-            # Build artifacts
-            'dist', 'build', 'Debug', 'Release', 'obj', 'bin',
-            # System directories
-            'Library', 'AppData', 'ProgramData',
-            # .NET
-            '.dotnet', '.nuget',
-        }
+        if not self._configure_hashing(args):
+            return
 
-        for item in directory.rglob('*'):
-            if not item.is_file():
-                continue
+        if not self._configure_policy(args):
+            return
 
-            if any(part.startswith('.') for part in item.parts) or item.stat().st_size < min_size:
-                continue
+        self._configure_hash_cache(args)
+        self._configure_workers(args)
+        self.verify = getattr(args, 'verify', True)
 
-            # Check if any ancestor directory is in excluded list
-            if not args.all:  # If --all is NOT specified, use exclusions
-                if any(parent.name in exclusive_dirs for parent in item.parents):
-                    continue
+        # Hidden and (without --all) excluded directories are pruned before they are opened
+        exclude = frozenset() if args.all else EXCLUDED_DIRS
+        index = self._get_file_index(args, directory)
 
-            file_hash = self._get_file_hash(item)
-            files[file_hash].append(item)
+        known = {}
+        if index:
+            files, known = self._indexed_duplicate_candidates(index, directory, min_size, exclude)
+        else:
+            files = [(Path(entry.path), entry.size, entry.mtime, entry.dev, entry.ino)
+                     for entry in walker.walk(directory, exclude=exclude, skip_hidden=True)
+                     if entry.size >= min_size]
+
+        # Paths sharing an inode are one file on disk: only the first is hashed and counted,
+        # the others are remembered as its aliases. Sizes and mtimes from the scan are all
+        # later steps need, nothing is stat'ed twice.
+        candidates = []
+        mtimes = {}
+        aliases = defaultdict(list)
+        inodes = {}
+
+        for path, size, mtime, dev, ino in files:
+            first = inodes.setdefault((dev, ino), path)
+            if first is not path:
+                aliases[first].append(path)
+                continue
+            candidates.append((path, size))
+            mtimes[path] = mtime
 
-        duplicates_found = any(len(duplicates) > 1 for duplicates in files.values())
+        print(f'Checking {len(candidates)} files for duplicates:')
+        duplicates_list = self._find_duplicate_groups(candidates, known)
 
-        if not duplicates_found:
+        if not duplicates_list:
             logging.info('No duplicate files found')
             print('You have no duplicate files.')
             return
 
         logging.info('Duplicate files detected')
-        total_space_wasted = 0
-
-        for duplicates in files.values():
-            if len(duplicates) > 1:
-                wasted_space = sum(Path(file).stat().st_size for file in duplicates[:-1])
-                total_space_wasted += wasted_space
+        sizes = dict(candidates)
+        total_space_wasted = sum(sizes[duplicates[0]] * (len(duplicates) - 1) for duplicates in duplicates_list)
 
         size, unit = self._find_unit(total_space_wasted)
-        duplicate_count = sum(len(duplicates[:-1]) for duplicates in files.values() if len(duplicates) > 1)
+        duplicate_count = sum(len(duplicates) - 1 for duplicates in duplicates_list)
         print(f'Found {duplicate_count} duplicate files, wasting {size} {unit}')
 
-        duplicates_list = [duplicates for duplicates in files.values() if len(duplicates) > 1]
+        action = getattr(args, 'action', None) or 'delete'
+
+        if action != 'delete':
+            self._link_duplicates(duplicates_list, sizes, mtimes, aliases, action, getattr(args, 'dry_run', False))
+            return
+
+        if self.keep_policy:
+            self._apply_keep_policy(duplicates_list, sizes, mtimes, getattr(args, 'dry_run', False), digests=known)
+            return
 
         for group_idx, duplicates in enumerate(duplicates_list, 1):
-            print(f"\nDuplicate group {group_idx} ({len(duplicates)} files):")
+            self._report(f"\nDuplicate group {group_idx} ({len(duplicates)} files):")
 
             for i, file in enumerate(duplicates, 1):
                 assert directory in file.parents
                 relative = file.relative_to(directory)
-                print(f"  {i}. {relative}")
+                self._report(f"  {i}. {relative}")
 
         print("\n⚠️  WARNING")
         print("Deleted files will be permanently removed and cannot only be recovered by using the undo option immediately after.\n")
@@ -241,32 +262,40 @@ class FileOrganizer:
         print('TO EXIT OPERATION, PRESS "Ctrl + C" AT ANY POINT')
 
         if delete_options == '1':
-
-            for duplicates in duplicates_list:
-                sorted_duplicated = sorted(duplicates, key=lambda f: f.stat().st_mtime, reverse=True)
-
-                if not self._backup_deleted_files(sorted_duplicated[1:]):
-                    confirm = input("Backup failed. All duplicates will be permanently deleted. Type DELETE to confirm, or anything else to cancel: ")
-                    if confirm != "DELETE":
-                        print("Operation cancelled. No files were deleted.")
+            op_id = self.journal.begin("delete paths", backup="store")
+
+            newest = KeepPolicy(['newest'])
+            keeps = [newest.choose(duplicates, mtimes) for duplicates in duplicates_list]
+            verified = {f for f, _ in self._verify_duplicates(
+                [(f, keep) for duplicates, keep in zip(duplicates_list, keeps) for f in duplicates if f != keep],
+                sizes, mtimes)}
+
+            for duplicates, keep in zip(duplicates_list, keeps):
+                sorted_duplicated = [keep] + [f for f in duplicates if f != keep and f in verified]
+
+                if not self._backup_deleted_files(sorted_duplicated[1:], op_id, link=True, digests=known):
+                    if not self._confirm_delete_without_backup('duplicates'):
+                        print("Operation cancelled. No further files were deleted.")
+                        # Groups handled before the failure were already deleted and stay undoable
+                        self.journal.commit(op_id)
                         return
 
                 for f in sorted_duplicated[1:]:
                     try:
                         f.unlink()
-                        deleted_file_log['paths'].insert(0, {"path": str(f)})
+                        self.journal.record(op_id, {"path": str(f)})
                     except OSError as e:
                             logging.error(f'Failed to delete {f}: {e}')
                             print(f'{f} could not be deleted.')
 
+            self.backup_store.unshare(op_id)
             print(f'All duplicates deleted. Saved {size} {unit} of space.')
-            self.operations['operations'].insert(0, deleted_file_log)
-            self._save()
+            self.journal.commit(op_id)
 
         elif delete_options == '2':
             freed_space = 0
             total_deleted = 0
-            files_to_delete = []
+            pairs = []
 
             for duplicates in duplicates_list:
                 print(f'{len(duplicates)} identical files in:')
@@ -276,7 +305,7 @@ class FileOrganizer:
                     relative = file.relative_to(directory)
                     print(f'\t{i}. {relative}')
 
-                extra_size = sum(Path(file).stat().st_size for file in duplicates[:-1])
+                extra_size = sizes[duplicates[0]] * (len(duplicates) - 1)
                 size, unit = self._find_unit(extra_size)
                 print(f'There are {size} {unit} of wasted space.')
 
@@ -298,23 +327,25 @@ class FileOrganizer:
                     for f in duplicates:
                         if f == file_to_keep:
                             continue
-                        files_to_delete.append(f)
+                        pairs.append((f, file_to_keep))
                 else:
                     print()
                     continue
 
-            if not self._backup_deleted_files(files_to_delete):
-                confirm = input(
-                    "Backup failed. All duplicates will be permanently deleted. Type DELETE to confirm, or anything else to cancel: ")
-                if confirm != "DELETE":
+            files_to_delete = [f for f, _ in self._verify_duplicates(pairs, sizes, mtimes)]
+            op_id = self.journal.begin("delete paths", backup="store")
+
+            if not self._backup_deleted_files(files_to_delete, op_id, link=True, digests=known):
+                if not self._confirm_delete_without_backup('duplicates'):
                     print("Operation cancelled. No files were deleted.")
+                    self.journal.abort(op_id)
                     return
 
             for f in files_to_delete:
                 try:
                     freed_space += f.stat().st_size
                     f.unlink()
-                    deleted_file_log["paths"].insert(0, {"path": str(f)})
+                    self.journal.record(op_id, {"path": str(f)})
                     total_deleted += 1
                     print()
 
@@ -322,8 +353,8 @@ class FileOrganizer:
                     print(f'Error deleting {f}: {e}')
                     pass
 
-            self.operations["operations"].insert(0, deleted_file_log)
-            self._save()
+            self.backup_store.unshare(op_id)
+            self.journal.commit(op_id)
 
             size, unit = self._find_unit(freed_space)
             logging.info(f'Deleted {total_deleted} duplicate files, freed {size} {unit}')
@@ -368,120 +399,94 @@ class FileOrganizer:
             )
             return
 
-        valid_placeholders = {'{count}', '{name}', '{last_modified}', '{doc_type}'}
-
-        all_files = [item for item in directory.iterdir() if item.is_file()]
-
-        renamed_files_log = {
-            "action" : "rename paths",
-            "timestamp" : dt.now().isoformat(timespec="seconds"),
-            "paths" : [
-
-            ]
-        }
+        try:
+            file_filter = FileFilter(getattr(args, 'include', None), getattr(args, 'exclude', None))
+        except ValueError as e:
+            logging.error(f'Invalid filter: {e}')
+            print(f'Invalid filter: {e}')
+            return
 
         if pattern:
             logging.info(f'Applying pattern: {pattern}')
-            found_placeholders = set(re.findall(r'(\{[^}]+\})', pattern))
-            invalid_placeholders = found_placeholders - valid_placeholders
 
-            if invalid_placeholders:
-                logging.error(f'Invalid placeholders found: {invalid_placeholders}')
-                print(f'Invalid placeholders: {invalid_placeholders}')
-                print(f'Please select a valid placeholder in your pattern: {valid_placeholders}')
+            try:
+                template = RenameTemplate(pattern)
+            except ValueError as e:
+                logging.error(f'Invalid pattern: {e}')
+                print(f'Invalid pattern: {e}')
                 return
 
-            count = 1
-
-            for file in all_files:
-                ext = file.suffix
-                new_name = pattern
-
-                if '{name}' in found_placeholders:
-                    new_name = new_name.replace('{name}', file.stem)
-
-                if '{count}' in found_placeholders:
-                    new_name = new_name.replace('{count}', str(count))
-
-                if '{doc_type}' in found_placeholders:
-                    suffix_lower = file.suffix.lower()
-                    if suffix_lower in fileExtensions.document_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Document')
-                    elif suffix_lower in fileExtensions.image_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Image')
-                    elif suffix_lower in fileExtensions.video_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Video')
-                    elif suffix_lower in fileExtensions.audio_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Audio')
-                    elif suffix_lower in fileExtensions.archive_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Archive')
-                    elif suffix_lower in fileExtensions.code_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Code')
-                    elif suffix_lower in fileExtensions.web_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Web')
-                    elif suffix_lower in fileExtensions.font_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Font')
-                    elif suffix_lower in fileExtensions.executable_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Binary')
-                    elif suffix_lower in fileExtensions.database_extensions:
-                        new_name = new_name.replace('{doc_type}', 'Database')
-                    else:
-                        new_name = new_name.replace('{doc_type}', 'Other')
-
-                if '{last_modified}' in found_placeholders:
-                    last_modified = dt.fromtimestamp(file.stat().st_mtime)
-                    readable_date = last_modified.strftime('%Y-%m-%d')
-                    new_name = new_name.replace('{last_modified}', readable_date)
+            namer, needs_stat, needs_hash, label = template.render, template.needs_stat, template.needs_hash, 'pattern'
 
-                if Path(new_name).suffix:
-                    new_path = file.parent/f'{new_name}'
-                else:
-                    new_path = file.parent / f'{new_name}{ext}'
+        elif any((suffix, prefix, date)):
+            def namer(entry, count, digest):
+                new_name = os.path.splitext(entry.name)[0]
+                if prefix:
+                    new_name = f'{prefix}_{new_name}'
+                if date:
+                    new_name = f'{new_name}_{date}'
+                if suffix:
+                    new_name = f'{new_name}_{suffix}'
+                return new_name
 
-                if new_path.exists():
-                    logging.warning(f'Cannot rename {file.stem}: target path already exists {new_path}')
-                    print(f'{file.stem} cannot be renamed, {new_path}, because this file path already exists')
-                    continue
+            needs_stat, needs_hash, label = False, False, 'prefix/suffix/date'
 
-                file.rename(new_path)
-                renamed_files_log["paths"].insert(0, {"from" : str(file), "to" : str(new_path)})
-                count += 1
+        else:
+            return
 
-            logging.info(f'Completed pattern rename: {count} files')
-            self.operations["operations"].insert(0, renamed_files_log)
-            self._save()
+        listing = []
+        plan = self._plan_bulk_rename(directory, namer, getattr(args, 'recursive', False), file_filter,
+                                      needs_stat, needs_hash, listing)
+        preview = getattr(args, 'preview', None)
 
-        if any((suffix, prefix, date)):
-            renamed_count = 0
+        if preview is not None:
+            # Only as much of the tree is read as the first renames need, and nothing is renamed
+            for src, dst in islice(plan, preview):
+                print(f'{os.path.relpath(src, directory)} -> {os.path.relpath(dst, directory)}')
+            return
 
-            for file in all_files:
-                ext = file.suffix
-                new_name = file.stem
+        renamed_count = self._run_renames(list(plan), self._listing_names(listing))
+        logging.info(f'Completed {label} rename: {renamed_count} files')
 
-                if prefix:
-                    new_name = f'{prefix}_{file.stem}'
-                if date:
-                    new_name = f'{new_name}_{date}'
-                if suffix:
-                    new_name = f'{new_name}_{suffix}'
+    def _plan_bulk_rename(self, directory: Path, namer, recursive: bool = False, file_filter: FileFilter = None,
+                          needs_stat: bool = False, needs_hash: bool = False, listing: list = None):
+        """Yield the (source, target) renames of bulk_rename lazily, in listing order.
 
-                if Path(new_name).suffix:
-                    new_path = file.parent/f'{new_name}'
-                else:
-                    new_path = file.parent / f'{new_name}{ext}'
+        namer(entry, count, digest) gives each matching file its new name; an
+        extension is kept unless the new name has its own. The tree is read
+        RENAME_BATCH entries at a time, so taking the first N renames costs
+        about N files, not the whole tree. Every entry read, matching or not,
+        is appended to listing for the rename planner.
+        """
+        stat = needs_stat or (file_filter is not None and file_filter.needs_stat)
+        entries = iter(walker.walk(directory, recursive=recursive, dirs=True, other=True, stat=stat))
+        count = 0
+
+        for chunk in iter(lambda: list(islice(entries, RENAME_BATCH)), []):
+            if listing is not None:
+                listing.extend(chunk)
+
+            files = [entry for entry in chunk if entry.is_file and (not file_filter or file_filter.matches(entry))]
+            digests = self._hash_paths([(Path(entry.path), entry.size) for entry in files]) if needs_hash and files else {}
 
-                if new_path.exists():
-                    logging.warning(f'Cannot rename {file.stem}: target path already exists {new_path}')
-                    print(f'{file.stem} cannot be renamed, {new_path}, because this file path already exists')
+            for entry in files:
+                count += 1
+                new_name = namer(entry, count, digests.get(Path(entry.path)))
+                parent = os.path.dirname(entry.path)
+
+                if has_separator(new_name):
+                    # Reported and left out, a new name never moves a file to another folder
+                    logging.warning(f'Cannot rename {entry.path} to {new_name}: the name contains a path separator')
+                    print(f'{entry.name} cannot be renamed to {new_name}: the name contains a path separator')
                     continue
 
-                file.rename(new_path)
-                renamed_files_log["paths"].insert(0, {"from" : str(file), "to" : str(new_path)})
-                renamed_count += 1
+                if Path(new_name).suffix:
+                    new_path = os.path.join(parent, new_name)
+                else:
+                    new_path = os.path.join(parent, new_name + os.path.splitext(entry.name)[1])
 
-            logging.info(f'Completed prefix/suffix/date rename: {renamed_count} files')
-            self.operations["operations"].insert(0, renamed_files_log)
-            self._save()
+                if new_path != entry.path:
+                    yield entry.path, new_path
 
     def find_large_files(self, args):
         logging.info(f'Searching for large files: {args.directory}')
@@ -507,25 +512,74 @@ class FileOrganizer:
 
         min_size, num_part, unit = result
 
-        if args.recursive:
-            large_files = [(item, item.stat().st_size) for item in directory.rglob('*') if item.is_file() and item.stat().st_size >= min_size]
+        if getattr(args, 'by_directory', False):
+            self._find_large_directories(directory, min_size, num_part, unit, args)
+            return
+
+        index = self._get_file_index(args, directory)
+
+        if index:
+            large_files = ((Path(path), size) for path, size, _ in index.files(directory, args.recursive, min_size))
         else:
-            large_files = [(item, item.stat().st_size) for item in directory.iterdir() if item.is_file() and item.stat().st_size >= min_size]
+            large_files = ((Path(entry.path), entry.size)
+                           for entry in walker.walk(directory, recursive=args.recursive)
+                           if entry.size >= min_size)
+
+        top = getattr(args, 'top', None)
+
+        if getattr(args, 'stream', False):
+            # Print matches as the walk finds them, in no particular order
+            count = total_size = 0
+            for file in large_files:
+                f_size, f_unit = self._find_unit(file[1])
+                print(f'\t{file[0]}: {f_size} {f_unit}', flush=True)
+                count += 1
+                total_size += file[1]
+
+            logging.info(f'Found {count} files larger than {num_part} {unit}')
+            print(f'{count} files larger than {num_part} {unit}')
+        else:
+            if top:
+                # Bounded heap: only the top N matches are ever held in memory
+                sorted_files = heapq.nlargest(top, large_files, key=lambda file : file[1])
+            else:
+                sorted_files = sorted(large_files, key=lambda file : file[1])
 
-        sorted_files = sorted(large_files, key=lambda file : file[1])
-        total_size = sum(file[1] for file in sorted_files)
+            count = len(sorted_files)
+            total_size = sum(file[1] for file in sorted_files)
 
-        logging.info(f'Found {len(sorted_files)} files larger than {num_part} {unit}')
-        print(f'{len(sorted_files)} files larger than {num_part} {unit}')
+            logging.info(f'Found {count} files larger than {num_part} {unit}')
+            print(f'{"Largest " if top else ""}{count} files larger than {num_part} {unit}')
 
-        for file in sorted_files:
-            f_size, f_unit = self._find_unit(file[1])
-            print(f'\t{file[0]}: {f_size} {f_unit}')
+            for file in sorted_files:
+                f_size, f_unit = self._find_unit(file[1])
+                print(f'\t{file[0]}: {f_size} {f_unit}')
 
         t_size, t_unit = self._find_unit(total_size)
         logging.info(f'Total size of large files: {t_size} {t_unit}')
         print(f'Total size: {t_size} {t_unit}.')
 
+    def _find_large_directories(self, directory: Path, min_size: float, num_part, unit, args):
+        # du-style: cumulative on-disk size of every subtree down to --depth, always recursive
+        depth = getattr(args, 'depth', None)
+        depth = 1 if depth is None else depth
+        top = getattr(args, 'top', None)
+
+        subtrees = ((Path(path), size) for path, level, size in walker.disk_usage(directory, max_depth=depth)
+                    if size >= min_size)
+
+        if top:
+            large_dirs = heapq.nlargest(top, subtrees, key=lambda subtree : subtree[1])
+        else:
+            large_dirs = sorted(subtrees, key=lambda subtree : subtree[1])
+
+        logging.info(f'Found {len(large_dirs)} directories larger than {num_part} {unit}')
+        print(f'{"Largest " if top else ""}{len(large_dirs)} directories larger than {num_part} {unit} (depth {depth})')
+
+        for path, size in large_dirs:
+            d_size, d_unit = self._find_unit(size)
+            print(f'\t{path}: {d_size} {d_unit}')
+
     def clean_up(self, args):
         logging.info(f'Starting cleanup: {args.directory}')
         directory = Path(args.directory).expanduser().resolve()
@@ -553,31 +607,30 @@ class FileOrganizer:
             print('You can only select one attribute at a time.')
             return
 
-        files_to_check = directory.rglob('*') if args.recursive else directory.iterdir()
-
-        deleted_files_log = {
-            "action" : "delete paths",
-            "timestamp" : dt.now().isoformat(timespec="seconds"),
-            "paths" : [
-
-            ]
-        }
-
         if older_than:
             logging.info(f'Searching for files older than {older_than} days')
             today = dt.today()
             cutoff = today - timedelta(days=older_than)
             old_files = []
 
-            for item in files_to_check:
-                if not item.is_file():
-                    continue
+            index = self._get_file_index(args, directory)
 
-                last_modified = dt.fromtimestamp(item.stat().st_mtime)
+            if index:
+                # The index can be behind (an in-place edit does not show up in an incremental scan),
+                # so every candidate is stat'ed again before it is allowed anywhere near a delete
+                for path, _, _ in index.files(directory, args.recursive, older_than=cutoff.timestamp()).fetchall():
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if st.st_mtime < cutoff.timestamp():
+                        old_files.append((Path(path), st.st_size))
+            else:
+                for entry in walker.walk(directory, recursive=args.recursive):
+                    last_modified = dt.fromtimestamp(entry.mtime)
 
-                if last_modified < cutoff:
-                    deleted_files_log["paths"].insert(0, {"path" : str(item)})
-                    old_files.append((item, item.stat().st_size))
+                    if last_modified < cutoff:
+                        old_files.append((Path(entry.path), entry.size))
 
             if not old_files:
                 logging.info(f'No files older than {older_than} days found')
@@ -591,48 +644,46 @@ class FileOrganizer:
             print(f'You have {size} {unit} of old files.')
             old_paths = [p[0] for p in old_files]
 
-            if not self._backup_deleted_files(old_paths):
-                confirm = input(
-                    "Backup failed. All duplicates will be permanently deleted. Type DELETE to confirm, or anything else to cancel: ")
-                if confirm != "DELETE":
-                    print("Operation cancelled. No files were deleted.")
-                    return
+            if getattr(args, 'dry_run', False):
+                self._print_plan({"action": "delete", "path": str(p), "size": s} for p, s in old_files)
+                return
 
-            self._delete_path(old_paths, 'files')
-            self.operations["operations"].insert(0, deleted_files_log)
-            self._save()
+            op_id = self.journal.begin("delete paths", backup="store")
 
-        if empty:
-            logging.info('Searching for empty folders')
-            empty_folders = []
+            def back_up(chosen):
+                # Asked first, so only the files about to go are backed up, as hardlinks where they can be
+                if not chosen or self._backup_deleted_files(chosen, op_id, link=True):
+                    return True
+                if self._confirm_delete_without_backup('old files', assume_yes=getattr(args, 'yes', False)):
+                    return True
+                print("Operation cancelled. No files were deleted.")
+                return False
 
-            for item in files_to_check:
+            deleted = self._delete_path(old_paths, 'files', assume_yes=getattr(args, 'yes', False), before_delete=back_up)
+            self._journal_deleted(op_id, deleted)
 
-                if not item.is_dir():
-                    continue
+        if empty:
+            logging.info('Searching for empty folders')
 
-                if not any(item.iterdir()):
-                    empty_folders.append(item)
-                    deleted_files_log["paths"].insert(0, {"path" : str(item)})
+            # Children come before their parents, so folders left empty by the removal go in the same pass
+            empty_folders = [Path(path) for path in walker.empty_dirs(directory, recursive=args.recursive)]
 
             if not empty_folders:
                 logging.info('No empty folders found')
                 print('No folders are empty in this directory')
                 return
 
-            if not self._backup_deleted_files(empty_folders):
-                confirm = input(
-                    "Backup failed. All duplicates will be permanently deleted. Type DELETE to confirm, or anything else to cancel: ")
-                if confirm != "DELETE":
-                    print("Operation cancelled. No files were deleted.")
-                    return
-
             logging.warning(f'Found {len(empty_folders)} empty folders')
             print(f'{len(empty_folders)} empty folders found')
 
-            self._delete_path(empty_folders, 'folders')
-            self.operations["operations"].insert(0, deleted_files_log)
-            self._save()
+            if getattr(args, 'dry_run', False):
+                self._print_plan({"action": "rmdir", "path": str(p)} for p in empty_folders)
+                return
+
+            # Nothing to back up in an empty folder, undo just creates it again
+            op_id = self.journal.begin("delete folders")
+            deleted = self._delete_path(empty_folders, 'folders', assume_yes=getattr(args, 'yes', False))
+            self._journal_deleted(op_id, deleted)
 
     def walk_tree(self, args):
         logging.info(f'Displaying directory tree: {args.directory}')
@@ -650,92 +701,735 @@ class FileOrganizer:
 
         depth = getattr(args, 'depth', None)
 
-        self._tree(directory, depth)
+        # Written a few thousand lines at a time rather than one print per line
+        lines = self._tree(directory, depth)
+        while chunk := list(islice(lines, 4096)):
+            sys.stdout.write('\n'.join(chunk) + '\n')
+
+    def scan_dir(self, args):
+        logging.info(f'Indexing directory: {args.directory}')
+        directory = Path(args.directory).expanduser().resolve()
+
+        if not directory.exists():
+            logging.error(f'Directory does not exist: {directory}')
+            print('This directory does not exist.')
+            return
+
+        if not directory.is_dir():
+            logging.error(f'Path is not a directory: {directory}')
+            print(f'{directory} is a file not a directory')
+            return
+
+        start_time = time.perf_counter()
+        index = self._get_file_index()
+        stats = index.refresh(directory, full=getattr(args, 'full', False))
+
+        print(f"Indexed {stats['files']} files: {stats['listed']} directories read, "
+              f"{stats['skipped']} unchanged, {stats['removed']} files removed.")
+
+        if getattr(args, 'hash', False):
+            self._configure_workers(args)
+            candidates = [(Path(path), size) for path, size, *_ in index.duplicate_candidates(directory)]
+            digests = self._hash_paths(candidates)
+            index.set_hashes(digests.items(), self.hash_algorithm)
+            print(f'Hashed {len(digests)} files that share their size with another file.')
+
+        elapsed_time = time.perf_counter() - start_time
+        logging.info(f'Index refresh complete in {elapsed_time:.1f} seconds: {stats}')
+        print(f'Done in {elapsed_time:.1f} seconds.')
+
+    def watch_dir(self, args):
+        logging.info(f'Watching directory: {args.directory}')
+        directory = Path(args.directory).expanduser().resolve()
+
+        if not directory.exists():
+            logging.error(f'Directory does not exist: {directory}')
+            print('This directory does not exist.')
+            return
+
+        if not directory.is_dir():
+            logging.error(f'Path is not a directory: {directory}')
+            print(f'{directory} is a file not a directory')
+            return
+
+        debounce = getattr(args, 'debounce', None) or 0.2
+        max_delay = max(debounce, 0.5)
+
+        try:
+            watcher = Inotify()
+        except OSError as e:
+            logging.error(f'Cannot watch {directory}: {e}')
+            print(f'Watch mode needs Linux inotify: {e}')
+            return
+
+        total_files = 0
+
+        with watcher:
+            watcher.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF)
+            print(f'Watching {directory} for new files. Press Ctrl + C to stop.')
+
+            # Names whose writer has closed them, waiting for the batch to settle
+            pending = {}
+            self.stop_watching.clear()
+
+            try:
+                while not self.stop_watching.is_set():
+                    # Block for long stretches while idle, only wake often while a batch is waiting
+                    events = watcher.read(debounce if pending else 1.0)
+                    now = time.monotonic()
+
+                    for _, mask, name in events:
+                        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                            logging.warning(f'Watched directory went away: {directory}')
+                            self.stop_watching.set()
+                        elif mask & IN_Q_OVERFLOW:
+                            # Events were dropped, fall back to whatever is in the directory now
+                            logging.warning('inotify queue overflowed, rescanning directory')
+                            for entry in walker.walk(directory, recursive=False, stat=False):
+                                pending.setdefault(entry.name, now)
+                        elif name and not mask & IN_ISDIR:
+                            pending.setdefault(name, now)
+
+                    if pending and (not events or now - min(pending.values()) >= max_delay):
+                        total_files += self._organize_batch(directory, list(pending))
+                        pending.clear()
+
+            except KeyboardInterrupt:
+                print()
+
+            if pending:
+                total_files += self._organize_batch(directory, list(pending))
+
+        logging.info(f'Stopped watching {directory}, organized {total_files} files')
+        print(f'Stopped watching. Organized {total_files} files.')
+
+    def _organize_batch(self, directory: Path, names: list) -> int:
+        # Each micro-batch is its own operation, so undo reverts the latest batch
+        op_id = self.journal.begin("organize directory")
+        moved = 0
+
+        for name in names:
+            item = directory / name
+            if not item.is_file():
+                continue
+
+            try:
+                folder = self._organize_file(item, directory, op_id)
+            except OSError as e:
+                logging.error(f'Could not organize {item}: {e}')
+                continue
+
+            logging.info(f'Organized {name} into {folder}')
+            moved += 1
+
+        if moved:
+            self.journal.commit(op_id)
+        else:
+            self.journal.abort(op_id)
+        return moved
 
     def undo(self, args=None):
-        last_operation = self.operations["operations"][0]
-        entries = last_operation["paths"]
-        operation_type = last_operation["action"]
+        op_id = getattr(args, 'id', None)
+        steps = getattr(args, 'steps', None) or 1
+
+        if op_id is not None:
+            operation = self.journal.get(op_id)
+
+            if operation is None:
+                print(f'There is no operation {op_id}.')
+                return False
+            # An interrupted operation can be undone as far as its journal says it got
+            if operation["status"] not in ("committed", "open"):
+                print(f'Operation {op_id} cannot be undone, it is {operation["status"]}.')
+                return False
+
+            # Later operations that moved the same paths again have to be rolled back first
+            operations = self._dependent_operations(operation)[::-1] + [operation]
+            if len(operations) > 1:
+                print(f'Operations {", ".join(str(op["id"]) for op in operations[:-1])} changed the same paths '
+                      f'after operation {op_id}, undoing them first.')
+        else:
+            operations = self.journal.latest(steps)
+
+        if not operations:
+            print('There is no operation to undo.')
+            return False
+
+        for operation in operations:
+            logging.info(f'Undoing operation {operation["id"]} ({operation["action"]})')
+            if not self._undo_operation(operation):
+                return False
+        return True
+
+    def resume(self, args=None):
+        op_id = getattr(args, 'id', None)
+        operation = self.journal.last("open") if op_id is None else self.journal.get(op_id)
+
+        if operation is None or operation["status"] != "open":
+            print('There is no interrupted operation to resume.' if op_id is None
+                  else f'Operation {op_id} is not an interrupted operation.')
+            return False
+
+        op_id = operation["id"]
+        action = operation["action"]
+        if action not in ("organize directory", "rename paths"):
+            print(f'Operation {op_id} ({action}) cannot be resumed, undo it instead.')
+            return False
+
+        logging.info(f'Resuming operation {op_id} ({action})')
+        start_time = time.perf_counter()
+        # Renames run in an order where each may free the name of the next, organize moves do not depend on each other
+        todo = self._pending_moves(op_id, ordered=action == "rename paths")
+
+        if action == "rename paths":
+            renamed = self._execute_renames([(entry["from"], entry["to"]) for entry in todo], op_id,
+                                            {entry["from"] for entry in todo})
+            self.journal.commit(op_id)
+            logging.info(f'Resumed rename: {renamed} renames')
+            print(f'Resumed operation {op_id}: {renamed} renames done.')
+            return True
+
+        self._configure_workers(args)
+        plan = [(Path(entry["from"]), Path(entry["to"]), Path(entry["to"]).parent.name) for entry in todo]
+        counts = self._apply_organize_plan(plan, op_id, write_ahead=False)
+        self.journal.commit(op_id)
+
+        header = self.journal.header(op_id)
+        if "directory" in header:
+            # Moves done before the interruption may have emptied folders too
+            sources = {Path(entry["from"]).parent for entry in self.journal.entries(op_id)}
+            self._finish_organize(Path(header["directory"]), sources, counts, start_time)
+        return True
+
+    def _pending_moves(self, op_id: int, ordered: bool) -> list[dict]:
+        """Sort out the planned moves of an interrupted operation that were never recorded as done.
+
+        The journal alone says what is left, nothing is walked. Moves that
+        did happen, just too late to be recorded, are recorded now: their
+        source is gone and their destination is there. With ordered moves
+        that only holds before the first one still to do. Returns the moves
+        still to make; moves whose source is gone, or whose destination is
+        taken, are reported and left out. Each folder is listed once.
+        """
+        names = {}
+        todo = []
+
+        for entry in self.journal.pending(op_id):
+            src_dir, src_name = os.path.split(entry["from"])
+            dest_dir, dest_name = os.path.split(entry["to"])
+            src_names = _cached_listing(names, src_dir)
+            dest_names = _cached_listing(names, dest_dir)
+            has_src = src_names is not None and src_name in src_names
+            has_dest = dest_names is not None and dest_name in dest_names
+
+            if has_src and not has_dest:
+                todo.append(entry)
+                # Later moves see the names as they will be once this one is made
+                src_names.discard(src_name)
+                if dest_names is None:
+                    dest_names = names[dest_dir] = set()
+                dest_names.add(dest_name)
+
+            elif has_dest and not has_src and not (ordered and todo):
+                self.journal.record(op_id, entry)
+
+            else:
+                reason = 'destination already exists' if has_src else 'source no longer exists'
+                logging.warning(f'Resume skipped {entry["from"]} -> {entry["to"]}: {reason}')
+                print(f'Resume skipped: {reason}: {entry["from"]}')
+
+        self.journal.flush()
+        return todo
+
+    def show_history(self, args=None):
+        operations = self.journal.operations()
+        limit = getattr(args, 'limit', None)
+
+        if not operations:
+            print('No operations have been recorded yet.')
+            return
+
+        if limit:
+            operations = operations[-limit:]
+
+        print(f'{"ID":>6}  {"Date":<19}  {"Status":<9}  {"Paths":>8}  Action')
+        for operation in reversed(operations):
+            print(f'{operation["id"]:>6}  {operation["timestamp"]:<19}  {operation["status"]:<9}  '
+                  f'{operation.get("count", 0):>8}  {operation["action"]}')
+
+    def _dependent_operations(self, operation: dict) -> list[dict]:
+        """Committed operations after operation that touched its paths, directly or through one another.
+
+        Oldest first. An operation that renamed a file organize had moved
+        depends on the organize, and so does a later one renaming it again.
+        """
+        touched = _operation_paths(self.journal.entries(operation["id"]))
+        dependents = []
+
+        for later in self.journal.operations():
+            if later["id"] <= operation["id"] or later["status"] != "committed":
+                continue
+
+            paths = _operation_paths(self.journal.entries(later["id"]))
+            if not paths.isdisjoint(touched):
+                dependents.append(later)
+                touched |= paths
+
+        return dependents
+
+    def _undo_operation(self, operation: dict):
+        # Paths are undone in reverse order of how they were recorded
+        entries = list(self.journal.entries(operation["id"]))[::-1]
+        operation_type = operation["action"]
         f_total = len(entries)
 
         if operation_type == "organize directory":
+            f_total = self._replay_moves([(entry["to"], entry["from"]) for entry in entries])
+
+            print(f'Undo successful, {f_total} files moved back to their previous location.')
+            self.journal.mark_undone(operation["id"])
+            return True
+
+        elif operation_type == "rename paths":
+            f_total = self._replay_moves([(entry["to"], entry["from"]) for entry in entries])
+
+            print(f'Undo successful, {f_total} files renamed.')
+            self.journal.mark_undone(operation["id"])
+            return True
+
+        elif operation_type == "delete paths":
+            manifest = self.backup_store.manifest(operation["id"])
+
+            if manifest is None:
+                # The store keeps the last few operations only; older ones predate it
+                if self.journal.header(operation["id"]).get("backup") == "store":
+                    logging.error(f'Backup of operation {operation["id"]} has expired')
+                    print(f'Undo cancelled, the backup of operation {operation["id"]} has expired.')
+                    return False
+                return self._undo_legacy_delete(operation)
+
+            f_total = 0
             for entry in entries:
-                src = Path(entry["to"])
-                dest = Path(entry["from"])
+                backup = manifest.get(entry["path"])
 
-                if not src.exists():
-                    print(f'Undo skipped: source no longer exists: {src}')
+                if backup is None:
+                    print(f'Undo skipped: no backup of {entry["path"]}')
                     continue
 
-                if dest.exists():
-                    print(f'Undo skipped: file could not be moved — destination already exists: {dest}')
+                if Path(entry["path"]).exists():
+                    print(f'Undo skipped: path already exists: {entry["path"]}')
                     continue
 
-                shutil.move(src, dest)
+                try:
+                    self.backup_store.restore(backup)
+                    f_total += 1
+                except OSError as e:
+                    print(f'{entry["path"]} could not be recovered: {e}')
 
-            print(f'Undo successful, {f_total} files moved back to their previous location.')
-            self.operations["operations"].pop(0)
-            self._save()
+            print(f'Undo successful, {f_total} files recovered.')
+            self.journal.mark_undone(operation["id"])
             return True
 
-        elif operation_type == "rename paths":
-            f_total = len(entries)
+        elif operation_type == "delete folders":
+            # Entries were recorded children first, reversed they recreate parents first
             for entry in entries:
-                old_name = Path(entry["from"])
-                curr_name = Path(entry["to"])
+                Path(entry["path"]).mkdir(parents=True, exist_ok=True)
 
-                if not curr_name.exists():
-                    print(f'Undo skipped: source no longer exists: {curr_name}')
-                    continue
+            print(f'Undo successful, {f_total} folders recreated.')
+            self.journal.mark_undone(operation["id"])
+            return True
 
-                if old_name.exists():
-                    print(f'Undo skipped: file could not be renamed — A file with that name already exists: {old_name}')
+        elif operation_type == "link duplicates":
+            f_total = 0
+            for entry in entries:
+                path = Path(entry["path"])
+
+                if not path.exists():
+                    print(f'Undo skipped: path no longer exists: {path}')
                     continue
 
-                curr_name.rename(old_name)
+                try:
+                    if entry["how"] == "hardlink":
+                        # A private copy of the shared inode gives the path its own data back
+                        tmp = path.with_name(f'.{path.name}.undo.tmp')
+                        fastcopy.copy_file(path, tmp)
+                        os.replace(tmp, path)
+
+                    # A reflink already has its own inode, it only needs its metadata back
+                    os.chmod(path, stat.S_IMODE(entry["mode"]))
+                    os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                    f_total += 1
+                except OSError as e:
+                    print(f'{path} could not be split from {entry["target"]}: {e}')
 
-            print(f'Undo successful, {f_total} files renamed.')
-            self.operations["operations"].pop(0)
-            self._save()
+            print(f'Undo successful, {f_total} links split.')
+            self.journal.mark_undone(operation["id"])
             return True
 
-        elif operation_type == "delete paths":
-            deleted_file_folder = self.BASE_DIR / '.last_deleted'
-            deleted_file_names = deleted_file_folder / 'deleted files mapping.json'
-            f_total = 0
+    def _replay_moves(self, moves: list) -> int:
+        """Move each (current, original) pair back, in the order given, and return how many moved.
+
+        Each directory involved is listed once rather than probing both paths
+        of every move with exists(), and the listings are kept current as the
+        moves happen. A move is a single os.rename; only files that organize
+        copied onto another filesystem fall back to shutil.move.
+        """
+        names = {}
+        moved = 0
+        progress = self._progress('Undoing', total=len(moves))
+
+        for src, dest in moves:
+            src_dir, src_name = os.path.split(src)
+            dest_dir, dest_name = os.path.split(dest)
+            src_names = _cached_listing(names, src_dir)
+
+            if not src_names or src_name not in src_names:
+                print(f'Undo skipped: source no longer exists: {src}')
+                continue
 
-            if not deleted_file_names.exists() or not deleted_file_folder.exists():
-                print('Undo cancelled, deleted files cannot be recovered')
-                return False
+            dest_names = _cached_listing(names, dest_dir)
+            if dest_names is not None and dest_name in dest_names:
+                print(f'Undo skipped: destination already exists: {dest}')
+                continue
 
-            with open(deleted_file_names, 'r') as f:
-                self.deleted_file_mapping = json.load(f)
+            try:
+                if dest_names is None:
+                    # A recursive organize removes the subfolders it emptied
+                    os.makedirs(dest_dir, exist_ok=True)
+                    dest_names = names[dest_dir] = set()
+                    parent, name = os.path.split(dest_dir)
+                    if names.get(parent) is not None:
+                        names[parent].add(name)
+
+                try:
+                    os.rename(src, dest)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(src, dest)
+            except OSError as e:
+                logging.error(f'Failed to move {src} back to {dest}: {e}')
+                print(f'{src} could not be moved back: {e}')
+                continue
 
-            for file in deleted_file_folder.iterdir():
-                if file.name != 'deleted files mapping.json':
-                    file_hash = self._get_file_hash(file)
+            src_names.discard(src_name)
+            dest_names.add(dest_name)
+            moved += 1
+            progress.update()
 
-                    file_match = self.deleted_file_mapping.get(file_hash, [])
+        progress.close()
+        return moved
 
-                    if not file_match:
-                        continue
+    def _undo_legacy_delete(self, operation: dict):
+        # Deletions made before the backup store only kept the last operation, matched by hash
+        deleted_file_folder = self.BASE_DIR / '.last_deleted'
+        deleted_file_names = deleted_file_folder / 'deleted files mapping.json'
+        f_total = 0
 
-                    for f in file_match:
-                        try:
-                            shutil.copy2(file, f)
-                            f_total += 1
+        if not deleted_file_names.exists() or not deleted_file_folder.exists():
+            print('Undo cancelled, deleted files cannot be recovered')
+            return False
 
-                        except OSError as e:
-                            print(f'{f} could not be recovered: {e}')
+        with open(deleted_file_names, 'r') as f:
+            deleted_file_mapping = json.load(f)
 
-            print(f'Undo successful, {f_total} files recovered.')
-            self.operations["operations"].pop(0)
-            self._save()
-            return True
+        for file in deleted_file_folder.iterdir():
+            if file.name != 'deleted files mapping.json':
+                file_hash = self._get_file_hash(file, algorithm='md5')
+
+                file_match = deleted_file_mapping.get(file_hash, [])
+
+                if not file_match:
+                    continue
+
+                for f in file_match:
+                    try:
+                        shutil.copy2(file, f)
+                        f_total += 1
+
+                    except OSError as e:
+                        print(f'{f} could not be recovered: {e}')
+
+        print(f'Undo successful, {f_total} files recovered.')
+        self.journal.mark_undone(operation["id"])
+        return True
+
+    def _organize_file(self, item: Path, directory: Path, op_id: int) -> str:
+        folder = ORGANIZE_FOLDERS.get(fileExtensions.classify(item.name), 'Others')
+        new_loc = self._safe_move(item, directory/folder)
+        self.journal.record(op_id, {"from" : str(item), "to" : str(new_loc), "type" : folder.lower()})
+        return folder
+
+    def _run_renames(self, renames: list, listdir=os.listdir) -> int:
+        """Plan (source, target) renames as a whole, journal the plan, then carry it out.
+
+        Swaps and chains are ordered by plan_renames, so their outcome does
+        not depend on the order the files were listed in. Every step is on
+        disk in the journal as planned before the first rename, and recorded
+        again once done, which lets undo roll back, and resume finish, a run
+        that was interrupted part way. listdir is handed on to plan_renames,
+        so a caller that already listed the directories can spare it listing
+        them again.
+        """
+        steps, conflicts = plan_renames(renames, listdir)
+
+        for src, dst, reason in conflicts:
+            logging.warning(f'Cannot rename {src} to {dst}: {reason}')
+            print(f'{Path(src).name} cannot be renamed to {Path(dst).name}: {reason}')
+
+        if not steps:
+            return 0
+
+        op_id = self.journal.begin("rename paths")
+        for src, dst in steps:
+            self.journal.plan(op_id, {"from" : src, "to" : dst})
+        self.journal.flush()
+
+        renamed = self._execute_renames(steps, op_id, {src for src, _ in renames})
+        self.journal.commit(op_id)
+        return renamed
+
+    def _execute_renames(self, steps: list, op_id: int, sources: set) -> int:
+        # A name whose rename failed is still taken, so nothing may be renamed onto it
+        stuck = set()
+        # Where each file renamed so far started from
+        origin = {}
+        renamed = 0
+        progress = self._progress('Renaming', total=len(steps))
+
+        for src, dst in steps:
+            if dst in stuck:
+                stuck.add(src)
+                continue
+
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                logging.error(f'Failed to rename {src} to {dst}: {e}')
+                print(f'{Path(src).name} could not be renamed: {e}')
+                stuck.add(src)
+                continue
+
+            self.journal.record(op_id, {"from" : src, "to" : dst})
+            origin[dst] = origin.pop(src, src)
+            # A file parked under a temporary name is counted once, when it leaves its old name
+            if src in sources:
+                renamed += 1
+            progress.update()
+
+        progress.close()
+
+        # Only a file parked to open a cycle moves twice, so a stuck path that was moved
+        # to is one whose way out failed: it goes back to its old name if that is free
+        for tmp in stuck & origin.keys():
+            try:
+                _rename_no_replace(tmp, origin[tmp])
+            except OSError as e:
+                logging.error(f'Could not move {tmp} back to {origin[tmp]}: {e}')
+                print(f'{Path(origin[tmp]).name} was left as {tmp}: {e}')
+                continue
+
+            self.journal.record(op_id, {"from" : tmp, "to" : origin[tmp]})
+            if origin[tmp] in sources:
+                renamed -= 1
+            print(f'{Path(origin[tmp]).name} was moved back to its old name.')
+
+        return renamed
+
+    @staticmethod
+    def _listing_names(listing):
+        # A listdir for plan_renames answered from walker entries already in hand
+        names = defaultdict(set)
+        for entry in listing:
+            names[os.path.dirname(entry.path)].add(entry.name)
+        return lambda directory: names[directory] if directory in names else os.listdir(directory)
+
+    def _plan_organize(self, directory: Path, recursive: bool = False) -> list[tuple[Path, Path, str]]:
+        """List (source, destination, folder) for every file to organize, collisions already resolved.
+
+        Each target folder is listed once; names are then claimed in a set as
+        the plan grows, so no destination is probed with exists(). Files
+        already in a category folder are left where they are. A recursive
+        walk skips hidden and excluded directories and this tool's own.
+        """
+        taken = {}
+        plan = []
+        own = str(self.BASE_DIR) + os.sep if recursive and directory in self.BASE_DIR.parents else None
+        entries = walker.walk(directory, recursive=recursive, stat=False,
+                              exclude=EXCLUDED_DIRS if recursive else frozenset(), skip_hidden=recursive)
+
+        for entry in entries:
+            if own and entry.path.startswith(own):
+                continue
+
+            src = Path(entry.path)
+            parts = src.relative_to(directory).parts
+            if len(parts) > 1 and parts[0] in CREATED_FOLDERS:
+                continue
+
+            folder = ORGANIZE_FOLDERS.get(fileExtensions.classify(entry.name), 'Others')
+            names = taken.get(folder)
+            if names is None:
+                try:
+                    names = taken[folder] = set(os.listdir(directory / folder))
+                except FileNotFoundError:
+                    names = taken[folder] = set()
+
+            name = src.name
+            counter = 2
+            while name in names:
+                name = f"{src.stem}_{counter}{src.suffix}"
+                counter += 1
+
+            names.add(name)
+            plan.append((src, directory / folder / name, folder))
+
+        return plan
+
+    def _apply_organize_plan(self, plan: list, op_id: int, write_ahead: bool = True) -> dict:
+        """Carry out (src, dest, folder) moves and count them per folder.
+
+        The whole plan is on disk in the journal before the first move, and
+        the moves done are flushed every CHECKPOINT_FILES moves, so a run that
+        is interrupted leaves at most one checkpoint of moves in doubt for
+        resume. write_ahead=False runs moves that are already planned in the
+        journal.
+        """
+        counts = dict.fromkeys(CREATED_FOLDERS, 0)
+        target_devs = {}
+        source_devs = {}
+        progress = self._progress('Organizing', total=len(plan))
+
+        if write_ahead:
+            for src, dest, folder in plan:
+                self.journal.plan(op_id, {"from" : str(src), "to" : str(dest), "type" : folder.lower()})
+            self.journal.flush()
+
+        for start in range(0, len(plan), CHECKPOINT_FILES):
+            self._apply_organize_chunk(plan[start:start + CHECKPOINT_FILES], op_id, counts, target_devs, source_devs, progress)
+            self.journal.flush()
+
+        progress.close()
+        return counts
+
+    def _apply_organize_chunk(self, chunk: list, op_id: int, counts: dict, target_devs: dict, source_devs: dict, progress):
+        crossing = []
+
+        for src, dest, folder in chunk:
+            if folder not in target_devs:
+                dest.parent.mkdir(exist_ok=True)
+                target_devs[folder] = os.stat(dest.parent).st_dev
+
+            # A file lives on its folder's device, so one stat per source folder is enough
+            if src.parent not in source_devs:
+                source_devs[src.parent] = os.stat(src.parent).st_dev
+
+            self._report(f"Organizing {src.name}")
+
+            if source_devs[src.parent] != target_devs[folder]:
+                crossing.append((src, dest, folder))
+                continue
+
+            try:
+                # A file created at dest since the plan was made is never replaced
+                _rename_no_replace(src, dest)
+            except OSError as e:
+                # Bind mounts share st_dev but still refuse renames between them
+                if e.errno == errno.EXDEV:
+                    crossing.append((src, dest, folder))
+                    continue
+                logging.error(f'Could not move {src} to {dest}: {e}')
+                print(f'{src} could not be moved: {e}')
+                continue
+
+            self.journal.record(op_id, {"from" : str(src), "to" : str(dest), "type" : folder.lower()})
+            counts[folder] += 1
+            progress.update()
+
+        for folder, size in self._move_across_devices(crossing, op_id):
+            counts[folder] += 1
+            progress.update(nbytes=size)
+
+    def _move_across_devices(self, moves: list, op_id: int) -> list:
+        """Copy (src, dest, folder) moves to another filesystem on the worker pool.
+
+        Each file is copied by the kernel to a hidden .part name next to its
+        destination. Completed copies are committed in batches: fsynced,
+        renamed into place, their folders fsynced, and only then are the
+        sources unlinked and the moves journaled. A crash at any point leaves
+        at worst a stray .part file, never a lost one. Returns (folder, size)
+        for every file moved.
+        """
+        if not moves:
+            return []
+
+        def copy(src, dest):
+            tmp = dest.with_name(f'.{dest.name}.part')
+            try:
+                return tmp, fastcopy.copy_file(src, tmp), None
+            except OSError as e:
+                tmp.unlink(missing_ok=True)
+                return tmp, 0, e
+
+        logging.info(f'Copying {len(moves)} files to another filesystem on {self.workers} workers')
+        results = hashing.map_bounded(copy, ((src, dest) for src, dest, _ in moves), workers=self.workers)
+        moved = []
+        batch = []
+        batch_bytes = 0
+
+        for (src, dest, folder), (tmp, size, error) in zip(moves, results):
+            if error:
+                logging.error(f'Could not copy {src} to {dest}: {error}')
+                print(f'{src} could not be moved: {error}')
+                continue
+
+            batch.append((src, dest, folder, tmp, size))
+            batch_bytes += size
+
+            if len(batch) >= MOVE_BATCH_FILES or batch_bytes >= MOVE_BATCH_BYTES:
+                moved += self._commit_moves(batch, op_id)
+                logging.info(f'Moved {len(moved)} of {len(moves)} files across filesystems')
+                batch = []
+                batch_bytes = 0
+
+        moved += self._commit_moves(batch, op_id)
+        logging.info(f'Moved {len(moved)} of {len(moves)} files across filesystems')
+        return moved
+
+    def _commit_moves(self, batch: list, op_id: int) -> list:
+        # The sources go only once their copies are durable under their final names
+        for _, _, _, tmp, _ in batch:
+            fastcopy.fsync_path(tmp)
 
-    def _save(self):
-        with open(self.operation_log, 'w') as f:
-            json.dump(self.operations, f, indent=2)
+        placed = []
+        for item in batch:
+            src, dest, _, tmp, _ = item
+            try:
+                # A file created at dest since the plan was made is never replaced
+                _rename_no_replace(tmp, dest)
+            except OSError as e:
+                tmp.unlink(missing_ok=True)
+                logging.error(f'Could not move {src} to {dest}: {e}')
+                print(f'{src} could not be moved: {e}')
+                continue
+            placed.append(item)
+
+        for folder_path in {item[1].parent for item in placed}:
+            fastcopy.fsync_path(folder_path)
+
+        moved = []
+        for src, dest, folder, _, size in placed:
+            try:
+                src.unlink()
+            except OSError as e:
+                logging.error(f'Copied {src} to {dest} but could not remove it: {e}')
+                print(f'{src} was copied to {dest} but could not be removed: {e}')
+                continue
+
+            self.journal.record(op_id, {"from" : str(src), "to" : str(dest), "type" : folder.lower()})
+            moved.append((folder, size))
+
+        return moved
 
     def _safe_move(self, src: Path, dest_dir: Path):
         dest_dir.mkdir(exist_ok=True, parents=True)
@@ -749,67 +1443,429 @@ class FileOrganizer:
         shutil.move(src, dest)
         return dest
 
-    def _get_file_hash(self, filepath: Path):
-        try:
-            hasher = hashlib.md5()
+    def _get_file_hash(self, filepath: Path, algorithm: str = None):
+        return self._hash_paths([(filepath, None)], algorithm=algorithm)[filepath]
 
-            with open(filepath, 'rb') as f:
-                while True:
-                    chunk = f.read(4096)
-                    if not chunk:
-                        break
-                    hasher.update(chunk)
+    def _get_sample_hash(self, filepath: Path, file_size: int):
+        return self._hash_paths([(filepath, file_size)], kind='sample')[filepath]
 
-            file_hash = hasher.hexdigest()
-            return file_hash
+    def _hash_paths(self, items: list, kind: str = 'full', algorithm: str = None, known: dict = None) -> dict[Path, str]:
+        """Hash (path, size) items, answering from known digests or the hash cache where possible.
+
+        Cache misses are hashed on the configured worker pool; the cache itself
+        is only touched from this thread.
+        """
+        algorithm = algorithm or self.hash_algorithm
+        cache = self._get_hash_cache()
+        digests = {}
+        misses = []
+
+        for path, file_size in items:
+            if known and path in known:
+                digests[path] = known[path]
+                continue
+
+            st = path.stat() if cache else None
+            cached = cache.get(st, algorithm, kind) if cache else None
+
+            if cached:
+                digests[path] = cached
+            else:
+                misses.append((path, file_size, st))
+
+        job = hashing.sample_digest if kind == 'sample' else hashing.file_digest
+        jobs = ((path, file_size, algorithm, self.buffer_size) for path, file_size, _ in misses)
+        results = hashing.map_bounded(job, jobs, workers=self.workers, mode=self.worker_mode)
+        done = 0
+        progress = self._progress(f'Hashing ({kind})', total=len(misses))
+
+        try:
+            for (path, file_size, st), digest in zip(misses, results):
+                digests[path] = digest
+                done += 1
+                if cache:
+                    cache.put(st, algorithm, digest, kind)
+                progress.update(nbytes=min(file_size, 2 * hashing.SAMPLE_SIZE) if kind == 'sample' else (file_size or 0))
         except OSError as e:
-            logging.error(f'Error computing hash for {filepath}: {e}')
+            # Results arrive in order, so the first one missing is the one that failed
+            logging.error(f'Error computing hash for {misses[done][0]}: {e}')
             raise
+        finally:
+            progress.close()
 
-    def _backup_deleted_files(self, file_list: list):
-        dest_dir = self.BASE_DIR / '.last_deleted'
-        dest_dir.mkdir(exist_ok=True, parents=True)
-        deleted_file_names = dest_dir/'deleted files mapping.json'
+        return digests
 
-        old_backups = list(dest_dir.iterdir())
-        backed_up_files = []
+    def _configure_workers(self, args):
+        self.workers = max(1, getattr(args, 'workers', None) or 1)
+        self.worker_mode = getattr(args, 'worker_mode', None) or 'thread'
 
-        for file in file_list:
-            hash_file = self._get_file_hash(file)
-            self.deleted_file_mapping[hash_file].append(str(file))
+    def _configure_hashing(self, args):
+        self.hash_algorithm = getattr(args, 'hash', None) or hashing.DEFAULT_ALGORITHM
+        buffer_size = getattr(args, 'buffer_size', None)
 
-            dest = dest_dir / file.name
-            counter = 2
+        if buffer_size:
+            result = self._convert_to_bytes(buffer_size)
+            if result is None:
+                return False
+            self.buffer_size = max(4096, int(result[0]))
 
+        return True
+
+    def _configure_policy(self, args):
+        keep = getattr(args, 'keep', None)
+        policy_file = getattr(args, 'policy_file', None)
+        self.keep_policy = None
+
+        try:
+            if keep:
+                self.keep_policy = KeepPolicy(keep)
+            elif policy_file:
+                self.keep_policy = KeepPolicy.from_file(Path(policy_file).expanduser())
+        except (OSError, ValueError) as e:
+            logging.error(f'Invalid keep policy: {e}')
+            print(f'Invalid keep policy: {e}')
+            return False
+
+        return True
+
+    def _configure_hash_cache(self, args):
+        self.use_hash_cache = not getattr(args, 'no_cache', False)
+
+        if self.use_hash_cache and getattr(args, 'rebuild_cache', False):
+            self._get_hash_cache().clear()
+
+    def _get_hash_cache(self):
+        if not self.use_hash_cache:
+            return None
+
+        if self.hash_cache is None:
             try:
-                while dest.exists():
-                    dest = dest_dir / f'{file.stem}_{counter}{file.suffix}'
-                    counter += 1
+                self.hash_cache = HashCache(self.hash_cache_path)
+            except sqlite3.Error as e:
+                logging.warning(f'Hash cache unavailable, hashing without it: {e}')
+                self.use_hash_cache = False
+                return None
 
-                shutil.copy2(file, dest)
-                backed_up_files.append(dest)
+        return self.hash_cache
 
-            except OSError as e:
-                print(f'Error copying file: {e}. Backup cancelled.')
-                for f in backed_up_files:
-                    try:
-                        f.unlink()
-                    except OSError:
-                        pass
+    def _get_file_index(self, args=None, directory: Path = None):
+        """Return the metadata index, or None when args do not ask for it (--index).
+
+        With a directory, also returns None (and says so) when no scan covers it,
+        in which case the caller walks the tree as usual.
+        """
+        if args is not None and not getattr(args, 'index', False):
+            return None
+
+        if self.file_index is None:
+            self.file_index = FileIndex(self.BASE_DIR/'index.db')
+
+        if directory is not None:
+            scanned_at = self.file_index.scanned_at(directory)
+            if scanned_at is None:
+                logging.warning(f'No index covers {directory}, walking the directory instead')
+                print(f'{directory} has not been indexed yet (run "scan" first), walking it instead.')
                 return None
+            print(f'Answering from the index of {dt.fromtimestamp(scanned_at).isoformat(timespec="seconds")}.')
 
-        with open(deleted_file_names, 'w') as jf:
-            json.dump(self.deleted_file_mapping, jf, indent=2)
+        return self.file_index
 
-        for file in old_backups:
-            if file.name != 'deleted files mapping.json':
-                try :
-                    file.unlink()
-                except OSError as e:
-                    print(e)
+    def _indexed_duplicate_candidates(self, index, directory: Path, min_size: float, exclude) -> tuple[list, dict]:
+        """Candidates from the index, with the same filters as the walk, and the full hashes scan --hash stored.
+
+        Every file is stat'ed: gone files are dropped, and a stored hash is
+        only used while the file's size and mtime are still the indexed ones.
+        """
+        candidates = []
+        known = {}
+        for path, size, mtime, dev, ino, digest, algorithm in index.duplicate_candidates(directory, min_size):
+            parts = Path(path).relative_to(directory).parts
+            if any(part.startswith('.') for part in parts) or any(part in exclude for part in parts[:-1]):
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            if st.st_size < min_size:
+                continue
+            candidates.append((Path(path), st.st_size, st.st_mtime, st.st_dev, st.st_ino))
+            if digest and algorithm == self.hash_algorithm and (st.st_size, st.st_mtime) == (size, mtime):
+                known[Path(path)] = digest
+        return candidates, known
+
+    def close(self):
+        if self.file_index is not None:
+            self.file_index.close()
+            self.file_index = None
+
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+            self.hash_cache = None
+
+    def _find_duplicate_groups(self, candidates: list, known: dict = None) -> list[list[Path]]:
+        """Group (path, size) candidates into sets of identical files.
+
+        Runs in three stages, each only looking at what the previous one left:
+        size, head/tail sample hash, full hash. Files no larger than two samples
+        were read entirely by the sample stage, so they skip the full hash.
+        known holds full hashes already at hand (from the index): a size group
+        they all cover skips straight to the last stage, and no file of it is read.
+        Every full hash found on the way is added to it, for the backup to reuse.
+        """
+        known = {} if known is None else known
+        by_size = defaultdict(list)
+        for path, file_size in candidates:
+            by_size[file_size].append(path)
+
+        size_groups = []
+        known_groups = []
+        for file_size, paths in by_size.items():
+            if len(paths) > 1:
+                (known_groups if all(path in known for path in paths) else size_groups).append((file_size, paths))
+
+        remaining = sum(len(paths) for _, paths in size_groups) + sum(len(paths) for _, paths in known_groups)
+        self._report_stage('size', len(candidates), remaining)
+
+        sample_hashes = self._hash_paths([(path, file_size) for file_size, paths in size_groups for path in paths],
+                                         kind='sample')
+        sample_groups = []
+        for file_size, paths in size_groups:
+            by_sample = defaultdict(list)
+            for path in paths:
+                by_sample[sample_hashes[path]].append(path)
+            sample_groups.extend((file_size, group) for group in by_sample.values() if len(group) > 1)
+
+        before = remaining
+        remaining = sum(len(paths) for _, paths in sample_groups) + sum(len(paths) for _, paths in known_groups)
+        self._report_stage('sample hash', before, remaining)
+
+        # Files no larger than two samples were read in full by the sample stage
+        to_hash = [(path, file_size) for file_size, paths in sample_groups
+                   if file_size > 2 * hashing.SAMPLE_SIZE for path in paths]
+        full_hashes = self._hash_paths(to_hash, known=known)
+        known.update(full_hashes)
+        # The sample of a file no larger than two samples covers all of it: it is the full hash
+        known.update((path, sample_hashes[path]) for file_size, paths in sample_groups
+                     if file_size <= 2 * hashing.SAMPLE_SIZE for path in paths)
+
+        duplicates_list = []
+        for file_size, paths in sample_groups + known_groups:
+            by_hash = defaultdict(list)
+            for path in paths:
+                by_hash[known[path]].append(path)
+            duplicates_list.extend(group for group in by_hash.values() if len(group) > 1)
+
+        before = remaining
+        remaining = sum(len(group) for group in duplicates_list)
+        self._report_stage('full hash', before, remaining)
+        logging.info(f'Full hash needed for {len(to_hash)} of {len(candidates)} candidates')
+
+        return duplicates_list
+
+    def _report_stage(self, stage: str, before: int, after: int):
+        logging.info(f'Duplicate stage "{stage}": {before} candidates in, removed {before - after}, {after} left')
+        print(f'  {stage:<12} removed {before - after} of {before} candidates')
+
+    def _apply_keep_policy(self, duplicates_list: list, sizes: dict, mtimes: dict, dry_run: bool = False, digests: dict = None):
+        # Non-interactive: one file per group survives, chosen by the policy, no per-file prompts or output
+        plan = []
+        for duplicates in duplicates_list:
+            keep = self.keep_policy.choose(duplicates, mtimes)
+            plan.extend((f, keep) for f in duplicates if f != keep)
+
+        if dry_run:
+            self._print_plan({"action": "delete", "path": str(f), "keep": str(keep), "size": sizes[f]}
+                             for f, keep in plan)
+            return
+
+        to_delete = [f for f, _ in self._verify_duplicates(plan, sizes, mtimes)]
+        op_id = self.journal.begin("delete paths", backup="store", policy=self.keep_policy.rules)
+
+        if not self._backup_deleted_files(to_delete, op_id, link=True, digests=digests):
+            # Nobody to ask for confirmation here, so nothing is deleted without a backup
+            print('Backup failed. No files were deleted.')
+            self.journal.abort(op_id)
+            return
+
+        deleted = []
+        progress = self._progress('Deleting', total=len(to_delete))
+        for f in to_delete:
+            try:
+                f.unlink()
+                deleted.append(f)
+                progress.update(nbytes=sizes[f])
+            except OSError as e:
+                logging.error(f'Failed to delete {f}: {e}')
+                print(f'{f} could not be deleted.')
+
+        progress.close()
+        self._journal_deleted(op_id, deleted)
+
+        size, unit = self._find_unit(sum(sizes[f] for f in deleted))
+        logging.info(f'Keep policy {self.keep_policy.rules} deleted {len(deleted)} duplicates')
+        print(f'{len(deleted)} duplicates deleted (keep: {", ".join(self.keep_policy.rules)}). Saved {size} {unit} of space.')
+
+    def _link_duplicates(self, duplicates_list: list, sizes: dict, mtimes: dict, aliases: dict, how: str, dry_run: bool = False):
+        # Every path survives: the copies become hardlinks or reflinks of the file each group keeps
+        policy = self.keep_policy or KeepPolicy(['newest'])
+        plan = []
+
+        for duplicates in duplicates_list:
+            keep = policy.choose(duplicates, mtimes)
+            plan.extend((f, keep) for f in duplicates if f != keep)
+
+        if not dry_run:
+            plan = self._verify_duplicates(plan, sizes, mtimes)
+
+        # Other names of the same inode must follow, or its blocks stay allocated
+        plan = [(p, keep) for f, keep in plan for p in [f, *aliases.get(f, [])]]
+
+        if dry_run:
+            self._print_plan({"action": how, "path": str(f), "keep": str(keep), "size": sizes.get(f, 0)}
+                             for f, keep in plan)
+            return
+
+        op_id = self.journal.begin("link duplicates", how=how)
+        linked = 0
+        freed_space = 0
+        progress = self._progress(f'Replacing with {how}s', total=len(plan))
+
+        for f, keep in plan:
+            try:
+                st = f.stat()
+                self._replace_with_link(keep, f, how)
+            except OSError as e:
+                logging.error(f'Failed to {how} {f} to {keep}: {e}')
+                print(f'{f} could not be replaced by a {how}: {e.strerror or e}')
+                continue
 
+            self.journal.record(op_id, {"path": str(f), "target": str(keep), "how": how,
+                                        "mode": st.st_mode, "mtime_ns": st.st_mtime_ns})
+            linked += 1
+            freed_space += sizes.get(f, 0)
+            progress.update(nbytes=sizes.get(f, 0))
+
+        progress.close()
+        if linked:
+            self.journal.commit(op_id)
+        else:
+            self.journal.abort(op_id)
+
+        size, unit = self._find_unit(freed_space)
+        logging.info(f'Replaced {linked} duplicates with {how}s, {freed_space} bytes reclaimed')
+        print(f'{linked} duplicates replaced with {how}s. Saved {size} {unit} of space.')
+
+    def _replace_with_link(self, keep: Path, path: Path, how: str):
+        # Built next to the target and renamed over it, so path is never missing or half written
+        tmp = path.with_name(f'.{path.name}.{how}.tmp')
+
+        if how == 'hardlink':
+            os.link(keep, tmp)
+        else:
+            fastcopy.clone_file(keep, tmp)
+
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _verify_duplicates(self, pairs: list, sizes: dict, mtimes: dict) -> list:
+        """Return the (path, keep) pairs that are still identical, checked right before acting on them.
+
+        Both files must still have the size and mtime the scan saw, which
+        catches files modified since they were hashed; the survivors are then
+        compared byte for byte on the worker pool, at least VERIFY_WORKERS
+        pairs at once. Off with --no-verify.
+        """
+        if not self.verify or not pairs:
+            return pairs
+
+        unchanged = {}
+
+        def is_unchanged(path):
+            if path not in unchanged:
+                try:
+                    st = path.stat()
+                    unchanged[path] = st.st_size == sizes[path] and st.st_mtime == mtimes[path]
+                except OSError:
+                    unchanged[path] = False
+            return unchanged[path]
+
+        checked = []
+        for path, keep in pairs:
+            if is_unchanged(path) and is_unchanged(keep):
+                checked.append((path, keep))
+            else:
+                logging.warning(f'Skipping {path}: it or {keep} changed since the scan')
+                print(f'{path} skipped: it or {keep} changed since the scan.')
+
+        jobs = ((path, keep, self.buffer_size) for path, keep in checked)
+        results = hashing.map_bounded(hashing.files_equal, jobs, workers=max(self.workers, VERIFY_WORKERS),
+                                      mode=self.worker_mode)
+        verified = []
+
+        for (path, keep), equal in zip(checked, results):
+            if equal:
+                verified.append((path, keep))
+            else:
+                logging.warning(f'Skipping {path}: its content differs from {keep} despite equal hashes')
+                print(f'{path} skipped: its content differs from {keep}.')
+
+        logging.info(f'Verified {len(verified)} of {len(pairs)} duplicates byte for byte')
+        return verified
+
+    def set_output(self, quiet: bool = False, progress: bool = False):
+        # normal: every file is printed; quiet: summaries only; progress: summaries and a live status line
+        self.output = 'progress' if progress else 'quiet' if quiet else 'normal'
+
+    def _report(self, message: str):
+        # Per-file output, which --quiet and --progress keep off the terminal
+        if self.output == 'normal':
+            print(message)
+        file_log.info(message)
+
+    def _progress(self, label: str, total: int = None) -> Progress:
+        return Progress(label, total=total, enabled=self.output == 'progress')
+
+    def _print_plan(self, actions):
+        # --dry-run: one JSON object per planned action, ready for jq or a later review
+        for action in actions:
+            print(json.dumps(action, separators=(',', ':')))
+
+    def _backup_deleted_files(self, file_list: list, op_id: int, link: bool = False, digests: dict = None):
+        # link=True only once the files are certain to be deleted next, see BackupStore.add.
+        # digests are full hashes already at hand; the store hashes the rest only if it has to copy them
+        self.backup_store.prune()
+        counts = defaultdict(int)
+        digests = digests or {}
+        # Earlier calls for the same operation may already have backed up files that are deleted by now
+        mark = self.backup_store.mark(op_id)
+
+        for file in file_list:
+            try:
+                counts[self.backup_store.add(op_id, file, digests.get(file), link=link)] += 1
+
+            except OSError as e:
+                print(f'Error backing up file: {e}. Backup cancelled.')
+                self.backup_store.unshare(op_id)
+                self.backup_store.truncate(op_id, mark)
+                return None
+
+        logging.info(f'Backed up {len(file_list)} paths: ' + ', '.join(f'{n} {how}' for how, n in counts.items()))
         return True
 
+    def _confirm_delete_without_backup(self, what: str, assume_yes: bool = False) -> bool:
+        # --yes means nobody is there to ask, and it never covers deleting without a backup
+        if assume_yes:
+            logging.error(f'Backup failed, not deleting {what} without one')
+            print('Backup failed.')
+            return False
+
+        confirm = input(f"Backup failed. All {what} will be permanently deleted. Type DELETE to confirm, or anything else to cancel: ")
+        return confirm == "DELETE"
+
     def _find_unit(self, size:float) -> tuple[float, str]:
         for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
             if size < 1024:
@@ -861,12 +1917,17 @@ class FileOrganizer:
 
         return min_size, num_part, unit_part
 
-    def _delete_path(self, paths:list, p_type:str):
-        delete_option = input("Would you like to:\n"
-                           f"A. Delete all old {p_type}\n"
-                           f"B. Delete selected {p_type} only\n"
-                           "C. Continue without deleting\n"
-                           "Select an option (A, B or C): ").upper()
+    def _delete_path(self, paths:list, p_type:str, assume_yes:bool = False, before_delete=None):
+        # before_delete(chosen) runs once the user has picked what goes and before anything does;
+        # when it returns False nothing is deleted
+        if assume_yes:
+            delete_option = 'A'
+        else:
+            delete_option = input("Would you like to:\n"
+                               f"A. Delete all old {p_type}\n"
+                               f"B. Delete selected {p_type} only\n"
+                               "C. Continue without deleting\n"
+                               "Select an option (A, B or C): ").upper()
 
         while delete_option not in ['A', 'B', 'C']:
             delete_option =  input("Invalid choice. Please select a valid option (A, B, or C):\n"
@@ -874,148 +1935,288 @@ class FileOrganizer:
                            f"B. Delete selected {p_type} only\n"
                            "C. Continue without deleting").upper()
 
-        if delete_option == 'A':
+        if delete_option == 'C':
+            print(f'{p_type.capitalize()} found but not deleted:')
             for p in paths:
-                if p.is_file():
-                    try:
-                        p.unlink()
-                    except OSError as e:
-                        logging.error(f'Failed to delete file {p}: {e}')
-                        print(f'{p} could not be deleted.')
+                print(p)
+            return []
 
-                elif p.is_dir():
-                    try:
-                        p.rmdir()
-                    except OSError as e:
-                        logging.error(f'Failed to delete directory {p}: {e}')
-                        print(f'{p} could not be deleted.')
+        if delete_option == 'A':
+            chosen = list(paths)
+        else:
+            chosen = [p for p in paths if input(f'Would you like to delete {p}?[y/N]: ') == 'y']
+
+        if before_delete is not None and not before_delete(chosen):
+            return []
+
+        deleted = []
+        freed_space = 0
 
+        for p in chosen:
+            if p.is_file():
+                try:
+                    size = p.stat().st_size
+                    p.unlink()
+                    deleted.append(p)
+                    freed_space += size
+                except OSError as e:
+                    logging.error(f'Failed to delete file {p}: {e}')
+                    print(f'{p} could not be deleted.')
+
+            elif p.is_dir():
+                try:
+                    p.rmdir()
+                    deleted.append(p)
+                except OSError as e:
+                    logging.error(f'Failed to delete directory {p}: {e}')
+                    print(f'{p} could not be deleted.')
+
+        if delete_option == 'A':
             logging.info(f'Deleted {len(paths)} {p_type}')
             print(f'{len(paths)} {p_type} deleted!')
 
-        elif delete_option == 'B':
-            paths_deleted = 0
-            freed_space = 0
+        elif p_type == 'files':
+            size, unit = self._find_unit(freed_space)
+            logging.info(f'Deleted {len(deleted)} files, freed {size} {unit}')
+            print(f'{len(deleted)} files deleted ({size} {unit})')
 
-            for p in paths:
-                delete_p = input(f'Would you like to delete {p}?[y/N]: ')
+        elif p_type == 'folders':
+            logging.info(f'Deleted {len(deleted)} folders')
+            print(f'{len(deleted)} folders deleted.')
 
-                if delete_p != 'y':
-                    continue
-                else:
-                    if p.is_file():
-                        try:
-                            freed_space += p.stat().st_size
-                            p.unlink()
-                            paths_deleted += 1
-                        except OSError as e:
-                            logging.error(f'Failed to delete file {p}: {e}')
-                            print(f'{p} could not be deleted.')
-
-                    elif p.is_dir():
-                        try:
-                            p.rmdir()
-                            paths_deleted += 1
-                        except OSError as e:
-                            logging.error(f'Failed to delete directory {p}: {e}')
-                            print(f'{p} could not be deleted.')
+        return deleted
 
-            if p_type == 'files':
-                size, unit = self._find_unit(freed_space)
-                logging.info(f'Deleted {paths_deleted} files, freed {size} {unit}')
-                print(f'{paths_deleted} files deleted ({size} {unit})')
+    def _journal_deleted(self, op_id: int, paths: list):
+        # Files that were backed up but not deleted must not keep a blob linked to them
+        self.backup_store.unshare(op_id)
 
-            elif p_type == 'folders':
-                logging.info(f'Deleted {paths_deleted} folders')
-                print(f'{paths_deleted} folders deleted.')
+        if not paths:
+            self.journal.abort(op_id)
+            self.backup_store.drop(op_id)
+            return
 
-        else:
-            print(f'{p_type.capitalize()} found but not deleted:')
-            for p in paths:
-                print(p)
+        for p in paths:
+            self.journal.record(op_id, {"path": str(p)})
+        self.journal.commit(op_id)
 
     # Implemented by AI, I was not familiar with the tree display algorithm
     def _tree(self, path: Path, depth, prefix=""):
+        # Yields the lines of the tree below path
         if depth is not None and depth < 0:
             return
 
         try:
-            children = sorted(path.iterdir(), key=lambda p: (p.is_file(), p.name))
+            children = sorted(walker.list_dir(path), key=lambda e: (e.is_file, e.name))
         except PermissionError:
-            print(prefix + "└── [permission denied]")
+            yield prefix + "└── [permission denied]"
             return
 
         for index, item in enumerate(children):
             is_last = index == len(children) - 1
             connector = "└── " if is_last else "├── "
 
-            print(prefix + connector + item.name)
+            yield prefix + connector + item.name
 
-            if item.is_dir() and not item.is_symlink():
+            # is_dir is False for symlinks, so they are never followed
+            if item.is_dir:
                 new_prefix = prefix + ("    " if is_last else "│   ")
                 next_depth = None if depth is None else depth - 1
-                self._tree(item, next_depth, new_prefix)
+                yield from self._tree(Path(item.path), next_depth, new_prefix)
+
+def _rename_no_replace(src, dest):
+    """os.rename that raises FileExistsError instead of replacing an existing dest.
+
+    The new name is made a hardlink first, which fails if it is taken, and
+    only then is the old name removed. On filesystems without hardlinks it
+    falls back to a rename after a last check of dest.
+    """
+    try:
+        os.link(src, dest, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK):
+            raise
+        if os.path.lexists(dest):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(dest)) from e
+        os.rename(src, dest)
+        return
 
-def main():
-    logging.info('File Organizer started')
+    try:
+        os.unlink(src)
+    except OSError:
+        os.unlink(dest)
+        raise
+
+
+def _cached_listing(names: dict, directory: str):
+    # The names in directory, listed once and kept in names (None if it does not exist)
+    if directory not in names:
+        try:
+            names[directory] = set(os.listdir(directory))
+        except FileNotFoundError:
+            names[directory] = None
+    return names[directory]
+
+
+def _operation_paths(entries) -> set:
+    # Every path a journaled operation read or changed
+    paths = set()
+    for entry in entries:
+        paths.update(entry[key] for key in ("from", "to", "path", "target") if key in entry)
+    return paths
+
+
+def configure_logging(quiet: bool = False, log_file: str = None):
+    """Log to stderr (warnings and errors only when quiet) and, with log_file, to a buffered file.
 
+    The file also receives the per-file messages. Its records are written
+    a thousand at a time, or straight away from an error on.
+    """
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING if quiet else logging.INFO)
+    handlers = [console]
+
+    if log_file:
+        target = logging.FileHandler(log_file)
+        target.setFormatter(logging.Formatter(LOG_FORMAT))
+        buffered = logging.handlers.MemoryHandler(1000, flushLevel=logging.ERROR, target=target)
+        handlers.append(buffered)
+        file_log.addHandler(buffered)
+
+    file_log.setLevel(logging.INFO)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, handlers=handlers, force=True)
+
+
+def main():
     organizer = FileOrganizer()
 
     parser = ArgumentParser(description='File Organizer and Duplicate Finder')
     subparsers = parser.add_subparsers(dest='commands', help='Available commands')
 
+    # Output options, accepted by every command
+    output = ArgumentParser(add_help=False)
+    output.add_argument('--quiet', '-q', action='store_true', help='Only print summaries and errors, not every file')
+    output.add_argument('--progress', action='store_true', help='Like --quiet, plus one live status line (files/s, MB/s, ETA)')
+    output.add_argument('--log-file', type=str, help='Also write the log and every per-file message to this file')
+
     # ==================== ORGANIZER ====================
-    organize_subparser = subparsers.add_parser('organize', help='organize directory')
+    organize_subparser = subparsers.add_parser('organize', parents=[output], help='organize directory')
     organize_subparser.add_argument('directory', type=str, help='Directory name')
+    organize_subparser.add_argument('--recursive', action='store_true', help='Also organize files in subfolders, removing the folders this empties')
+    organize_subparser.add_argument('--dry-run', action='store_true', help='Print the planned moves as JSON lines and change nothing')
+    organize_subparser.add_argument('--workers', type=int, default=4, help='Files copied in parallel when the target is on another filesystem (default: 4)')
     organize_subparser.set_defaults(func=organizer.organize_dir)
 
     # ==================== DUPLICATES ====================
-    duplicate_subparser = subparsers.add_parser('duplicate', help='manage duplicate files')
+    duplicate_subparser = subparsers.add_parser('duplicate', parents=[output], help='manage duplicate files')
     duplicate_subparser.add_argument('directory', type=str, help='Directory name')
     duplicate_subparser.add_argument('--min-size', default='1KB', help='Minimum file size to check (default: 1KB)')
     duplicate_subparser.add_argument('--all', action='store_true', help='Include system directories and virtual environments (not recommended)')
+    duplicate_subparser.add_argument('--no-cache', action='store_true', help='Hash every file from scratch without reading or updating the hash cache')
+    duplicate_subparser.add_argument('--rebuild-cache', action='store_true', help='Clear the hash cache before scanning')
+    duplicate_subparser.add_argument('--hash', choices=hashing.ALGORITHMS, default=hashing.DEFAULT_ALGORITHM, help='Hash algorithm used to compare files (default: md5)')
+    duplicate_subparser.add_argument('--buffer-size', type=str, help='Read buffer used while hashing (e.g. 4MB, default: 1MB)')
+    duplicate_subparser.add_argument('--workers', type=int, default=1, help='Number of files to hash in parallel (default: 1)')
+    duplicate_subparser.add_argument('--worker-mode', choices=['thread', 'process'], default='thread', help='Hash on threads (NVMe, network mounts) or processes (default: thread)')
+    duplicate_subparser.add_argument('--action', choices=['delete', 'hardlink', 'reflink'], default='delete', help='What to do with duplicates: delete them (default), or replace them with hardlinks or copy-on-write reflinks of the kept file, without asking')
+    duplicate_subparser.add_argument('--verify', action=BooleanOptionalAction, default=True, help='Compare each duplicate byte for byte with the kept file, and re-check its size and mtime, right before acting on it (default: on)')
+    duplicate_subparser.add_argument('--keep', action='append', metavar='RULE', help=f'Delete without asking, keeping one file per group picked by RULE; repeat to break ties ({", ".join(KEEP_RULES)})')
+    duplicate_subparser.add_argument('--policy-file', type=str, help='JSON file with the keep rules, e.g. {"keep": ["prefix:~/Photos", "newest"]}')
+    duplicate_subparser.add_argument('--dry-run', action='store_true', help='With --keep or --action, print the planned changes as JSON lines and change nothing')
+    duplicate_subparser.add_argument('--index', action='store_true', help='Take candidates from the index built by "scan" instead of walking the tree')
     duplicate_subparser.set_defaults(func=organizer.manage_duplicates)
 
     # ====================== RENAME ======================
-    rename_subparser = subparsers.add_parser('rename', help='rename files inside of directory')
+    rename_subparser = subparsers.add_parser('rename', parents=[output], help='rename files inside of directory')
     rename_subparser.add_argument('directory', type=str, help='Directory name')
-    rename_subparser.add_argument('--pattern', type=str, help='Pattern with placeholders: {name}, {count}, {doc_type}, {last_modified}')
+    rename_subparser.add_argument('--pattern', type=str, help='Pattern with placeholders: ' + ', '.join(f'{{{name}}}' for name in RENAME_PLACEHOLDERS) + '. Placeholders take format specs, e.g. {count:04}, {size:,} or {ctime:%%Y%%m%%d}')
     rename_subparser.add_argument('--add-prefix', type=str,  help='prefix to add to the file')
     rename_subparser.add_argument('--add-suffix', type=str,  help='suffix to add to the file')
     rename_subparser.add_argument('--add-date', type=str,  help='add a date (YYYY-MM-DD)')
+    rename_subparser.add_argument('--recursive', action='store_true', help='Also rename files in subfolders')
+    rename_subparser.add_argument('--include', action='append', metavar='RULE', help='Only rename files matching RULE; repeat to allow several (' + ', '.join(FILTER_RULES) + ')')
+    rename_subparser.add_argument('--exclude', action='append', metavar='RULE', help='Leave files matching RULE alone; repeatable, same rules as --include')
+    rename_subparser.add_argument('--preview', type=int, metavar='N', help='Print the first N planned renames and exit without renaming anything')
     rename_subparser.set_defaults(func=organizer.bulk_rename)
 
    # ==================== FIND LARGE ====================
-    find_large_subparser = subparsers.add_parser('find-large', help='find files over specified size')
+    find_large_subparser = subparsers.add_parser('find-large', parents=[output], help='find files over specified size')
     find_large_subparser.add_argument('directory', type=str, help='Directory')
     find_large_subparser.add_argument('--min-size', type=str, required=True, help='minimum size of files to find (e.g. 100 MB)')
     find_large_subparser.add_argument('--recursive', action='store_true', help='look through the entire directory tree')
+    find_large_output = find_large_subparser.add_mutually_exclusive_group()
+    find_large_output.add_argument('--top', type=int, metavar='N', help='only list the N largest files, largest first')
+    find_large_output.add_argument('--stream', action='store_true', help='print files as they are found instead of sorted at the end')
+    find_large_subparser.add_argument('--by-directory', action='store_true', help='report directories by the disk space of their whole subtree, like du')
+    find_large_subparser.add_argument('--depth', type=int, default=1, help='with --by-directory, how many levels below the directory to report (default: 1)')
+    find_large_subparser.add_argument('--index', action='store_true', help='Answer from the index built by "scan" instead of walking the tree')
     find_large_subparser.set_defaults(func=organizer.find_large_files)
 
    # ===================== CLEANUP ======================
-    cleanup_subparser = subparsers.add_parser('clean-up', help='delete old files or empty folders')
+    cleanup_subparser = subparsers.add_parser('clean-up', parents=[output], help='delete old files or empty folders')
     cleanup_subparser.add_argument('directory', type=str, help='Directory name')
     cleanup_subparser.add_argument('--older-than', type=int, help='Files older the x days')
     cleanup_subparser.add_argument('--empty-folder', action='store_true',  help='Finds all empty folders')
     cleanup_subparser.add_argument('--recursive', action='store_true',  help='Finds all empty folders')
+    cleanup_subparser.add_argument('--yes', action='store_true', help='Delete everything found without asking')
+    cleanup_subparser.add_argument('--dry-run', action='store_true', help='Print what would be deleted as JSON lines and change nothing')
+    cleanup_subparser.add_argument('--index', action='store_true', help='Find old files in the index built by "scan" instead of walking the tree')
     cleanup_subparser.set_defaults(func=organizer.clean_up)
 
     # ====================== TREE =======================
-    rename_subparser = subparsers.add_parser('tree', help='show directory in tree structure')
+    rename_subparser = subparsers.add_parser('tree', parents=[output], help='show directory in tree structure')
     rename_subparser.add_argument('directory', type=str, help='Directory name')
     rename_subparser.add_argument('--depth', type=int, help='Depth of the directory tree')
     rename_subparser.set_defaults(func=organizer.walk_tree)
 
+    # ====================== SCAN =======================
+    scan_subparser = subparsers.add_parser('scan', parents=[output], help='build or refresh the file metadata index used by --index')
+    scan_subparser.add_argument('directory', type=str, help='Directory name')
+    scan_subparser.add_argument('--full', action='store_true', help='Re-read every directory, not only those whose contents changed')
+    scan_subparser.add_argument('--hash', action='store_true', help='Also store hashes of files that share their size with another file')
+    scan_subparser.add_argument('--workers', type=int, default=1, help='Number of files to hash in parallel (default: 1)')
+    scan_subparser.set_defaults(func=organizer.scan_dir)
+
+    # ====================== WATCH ======================
+    watch_subparser = subparsers.add_parser('watch', parents=[output], help='keep organizing new files as they arrive (Linux only)')
+    watch_subparser.add_argument('directory', type=str, help='Directory name')
+    watch_subparser.add_argument('--debounce', type=float, default=0.2, help='Seconds to wait for more files before moving a batch (default: 0.2)')
+    watch_subparser.set_defaults(func=organizer.watch_dir)
+
     # ====================== UNDO =======================
-    undo_subparser = subparsers.add_parser('undo', help='undo previous operation')
+    undo_subparser = subparsers.add_parser('undo', parents=[output], help='undo previous operation')
+    undo_target = undo_subparser.add_mutually_exclusive_group()
+    undo_target.add_argument('--id', type=int, help='Undo this operation (see history), after any later operations that changed the same paths')
+    undo_target.add_argument('--steps', type=int, default=1, help='Undo the last N operations, newest first (default: 1)')
     undo_subparser.set_defaults(func=organizer.undo)
 
+    # ===================== RESUME ======================
+    resume_subparser = subparsers.add_parser('resume', parents=[output], help='finish an organize or rename that was interrupted')
+    resume_subparser.add_argument('--id', type=int, help='Operation to resume (default: the most recent interrupted one)')
+    resume_subparser.add_argument('--workers', type=int, default=4, help='Files copied in parallel when the target is on another filesystem (default: 4)')
+    resume_subparser.set_defaults(func=organizer.resume)
+
+    # ===================== HISTORY =====================
+    history_subparser = subparsers.add_parser('history', parents=[output], help='list recorded operations')
+    history_subparser.add_argument('--limit', type=int, default=20, help='Show only the N most recent operations, 0 for all (default: 20)')
+    history_subparser.set_defaults(func=organizer.show_history)
+
     args = parser.parse_args()
 
     if hasattr(args, 'func'):
-        args.func(args)
+        configure_logging(args.quiet or args.progress, args.log_file)
+        organizer.set_output(args.quiet, args.progress)
+        logging.info('File Organizer started')
+
+        try:
+            args.func(args)
+        finally:
+            organizer.close()
     else:
         parser.print_help()
 
+    logging.shutdown()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
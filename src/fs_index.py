@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import fileExtensions
+import walker
+
+
+class FileIndex:
+    """SQLite index of file metadata under one or more scanned roots.
+
+    A refresh only lists directories whose mtime changed since the last scan
+    (a file was added, removed or renamed in them); unchanged directories are
+    just stat'ed on the way down. Editing a file in place does not touch its
+    directory's mtime, so use a full refresh to pick up size or mtime changes
+    of existing files.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY,'
+            ' parent TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime REAL NOT NULL,'
+            ' ino INTEGER NOT NULL,'
+            ' dev INTEGER NOT NULL,'
+            ' category TEXT NOT NULL,'
+            ' hash TEXT,'
+            ' hash_algorithm TEXT);'
+            'CREATE INDEX IF NOT EXISTS files_parent ON files (parent);'
+            'CREATE INDEX IF NOT EXISTS files_size ON files (size);'
+            'CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);'
+            'CREATE TABLE IF NOT EXISTS dirs ('
+            ' path TEXT PRIMARY KEY,'
+            ' parent TEXT,'
+            ' mtime REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);'
+            'CREATE TABLE IF NOT EXISTS roots ('
+            ' path TEXT PRIMARY KEY,'
+            ' scanned_at REAL NOT NULL);'
+        )
+
+    # ---------- scanning ----------
+
+    def refresh(self, root: Path, full: bool = False) -> dict:
+        root = str(root)
+        stats = {'listed': 0, 'skipped': 0, 'files': 0, 'removed': 0}
+        known = dict(self.conn.execute(
+            'SELECT path, mtime FROM dirs WHERE path = ? OR (path > ? AND path < ?)', (root, *_subtree(root))
+        ))
+        seen_dirs = set()
+        stack = [(root, os.stat(root).st_mtime)]
+
+        while stack:
+            directory, mtime = stack.pop()
+            seen_dirs.add(directory)
+
+            if not full and known.get(directory) == mtime:
+                # Nothing was added or removed here, only walk down into the known subdirectories
+                stats['skipped'] += 1
+                for (child,) in self.conn.execute('SELECT path FROM dirs WHERE parent = ?', (directory,)).fetchall():
+                    try:
+                        stack.append((child, os.stat(child).st_mtime))
+                    except OSError:
+                        pass
+                continue
+
+            stats['listed'] += 1
+            files, removed = self._index_directory(directory, mtime, stack)
+            stats['files'] += files
+            stats['removed'] += removed
+
+            if stats['listed'] % self.COMMIT_EVERY == 0:
+                self.conn.commit()
+
+        # Directories that disappeared take their files with them
+        for gone in set(known) - seen_dirs:
+            stats['removed'] += self.conn.execute('DELETE FROM files WHERE parent = ?', (gone,)).rowcount
+            self.conn.execute('DELETE FROM dirs WHERE path = ?', (gone,))
+
+        self.conn.execute('INSERT OR REPLACE INTO roots VALUES (?, ?)', (root, time.time()))
+        self.conn.commit()
+        return stats
+
+    def _index_directory(self, directory: str, mtime: float, stack: list) -> tuple[int, int]:
+        rows = []
+        for entry in walker.walk(directory, recursive=False, files=True, dirs=True):
+            if entry.is_dir:
+                stack.append((entry.path, entry.mtime))
+            else:
+                rows.append((entry.path, directory, entry.size, entry.mtime, entry.ino, entry.dev,
+                             fileExtensions.classify(entry.name)))
+
+        listed = {row[0] for row in rows}
+        gone = [(path,) for (path,) in self.conn.execute('SELECT path FROM files WHERE parent = ?', (directory,))
+                if path not in listed]
+        self.conn.executemany('DELETE FROM files WHERE path = ?', gone)
+
+        # Stored hashes survive as long as the file's size and mtime did not change
+        self.conn.executemany(
+            'INSERT INTO files (path, parent, size, mtime, ino, dev, category) VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET size=excluded.size, mtime=excluded.mtime, ino=excluded.ino, '
+            ' dev=excluded.dev, category=excluded.category, '
+            ' hash=CASE WHEN files.size=excluded.size AND files.mtime=excluded.mtime THEN files.hash END',
+            rows
+        )
+        self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)', (directory, os.path.dirname(directory), mtime))
+        return len(rows), len(gone)
+
+    def set_hashes(self, rows: list, algorithm: str):
+        self.conn.executemany('UPDATE files SET hash = ?, hash_algorithm = ? WHERE path = ?',
+                              ((digest, algorithm, str(path)) for path, digest in rows))
+        self.conn.commit()
+
+    # ---------- queries ----------
+
+    def scanned_at(self, directory: Path):
+        """When the index root covering directory was last scanned, or None if none covers it."""
+        directory = str(directory)
+        for root, scanned_at in self.conn.execute('SELECT path, scanned_at FROM roots'):
+            if directory == root or directory.startswith(root.rstrip('/') + '/'):
+                return scanned_at
+        return None
+
+    def files(self, directory: Path, recursive: bool = True, min_size: float = 0, older_than: float = None):
+        # (path, size, mtime) rows under directory
+        where, params = self._scope(directory, recursive)
+        query = f'SELECT path, size, mtime FROM files WHERE {where} AND size >= ?'
+        params.append(min_size)
+
+        if older_than is not None:
+            query += ' AND mtime < ?'
+            params.append(older_than)
+
+        return self.conn.execute(query, params)
+
+    def duplicate_candidates(self, directory: Path, min_size: float = 0):
+        # (path, size, mtime, dev, ino, hash, hash_algorithm) rows whose size is shared with at least one
+        # other file under directory; hash is the full hash scan --hash stored, or None
+        where, params = self._scope(directory, True)
+        return self.conn.execute(
+            f'SELECT path, size, mtime, dev, ino, hash, hash_algorithm FROM files WHERE {where} AND size >= ? AND size IN '
+            f'(SELECT size FROM files WHERE {where} AND size >= ? GROUP BY size HAVING COUNT(*) > 1)',
+            [*params, min_size, *params, min_size]
+        )
+
+    def close(self):
+        self.conn.close()
+
+    def _scope(self, directory: Path, recursive: bool):
+        directory = str(directory)
+        if recursive:
+            return '(path > ? AND path < ?)', list(_subtree(directory))
+        return 'parent = ?', [directory]
+
+
+def _subtree(directory: str):
+    # Bounds of every path strictly below directory: '/' sorts right before '0'
+    prefix = directory.rstrip('/') + '/'
+    return prefix, prefix[:-1] + '0'
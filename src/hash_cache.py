@@ -0,0 +1,99 @@
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+
+class HashCache:
+    """On-disk cache of file digests, stored in a SQLite table.
+
+    Entries are keyed by (device, inode) and are only reused while the file's
+    size and mtime_ns are unchanged, so a rescan of an untouched tree only costs
+    a stat per file. Stale entries are dropped by age, then by least recent use.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, db_path: Path, max_age_days: int = 90, max_entries: int = 5_000_000):
+        self.db_path = Path(db_path)
+        self.max_age = max_age_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            ' dev INTEGER NOT NULL,'
+            ' ino INTEGER NOT NULL,'
+            ' kind TEXT NOT NULL,'
+            ' algorithm TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' mtime_ns INTEGER NOT NULL,'
+            ' digest TEXT NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (dev, ino, kind, algorithm))'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)')
+
+    def get(self, st: os.stat_result, algorithm: str, kind: str = 'full'):
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, digest FROM hashes WHERE dev=? AND ino=? AND kind=? AND algorithm=?',
+            (st.st_dev, st.st_ino, kind, algorithm)
+        ).fetchone()
+
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute(
+            'UPDATE hashes SET last_used=? WHERE dev=? AND ino=? AND kind=? AND algorithm=?',
+            (time.time(), st.st_dev, st.st_ino, kind, algorithm)
+        )
+        self._written()
+        return row[2]
+
+    def put(self, st: os.stat_result, algorithm: str, digest: str, kind: str = 'full'):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (st.st_dev, st.st_ino, kind, algorithm, st.st_size, st.st_mtime_ns, digest, time.time())
+        )
+        self._written()
+
+    def clear(self):
+        self.conn.execute('DELETE FROM hashes')
+        self.conn.commit()
+        logging.info(f'Hash cache cleared: {self.db_path}')
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        expired = self.conn.execute('DELETE FROM hashes WHERE last_used < ?', (cutoff,)).rowcount
+
+        total = self.conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+        evicted = 0
+        if total > self.max_entries:
+            evicted = self.conn.execute(
+                'DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)',
+                (total - self.max_entries,)
+            ).rowcount
+
+        self.conn.commit()
+        if expired or evicted:
+            logging.info(f'Hash cache pruned: {expired} expired, {evicted} evicted')
+
+    def close(self):
+        self.prune()
+        self.conn.close()
+        logging.info(f'Hash cache: {self.hits} hits, {self.misses} misses')
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.conn.commit()
+            self._pending = 0
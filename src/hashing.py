@@ -0,0 +1,161 @@
+import hashlib
+import mmap
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ALGORITHMS = ('md5', 'sha1', 'sha256', 'blake2b')
+DEFAULT_ALGORITHM = 'md5'
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Files at least this big are hashed straight from a read-only memory map
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+# Bytes read from each end of a file by the sample stage of duplicate detection
+SAMPLE_SIZE = 16 * 1024
+
+# Per-thread compare buffers, reused across files_equal calls
+_local = threading.local()
+
+
+# These are module-level functions so a process pool can pickle them.
+def file_digest(path, file_size=None, algorithm=DEFAULT_ALGORITHM, buffer_size=DEFAULT_BUFFER_SIZE):
+    hasher = hashlib.new(algorithm)
+
+    with open(path, 'rb', buffering=0) as f:
+        # Size from the open handle, the caller's may be stale by now
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mm)
+            return hasher.hexdigest()
+
+        # One buffer for the whole file: readinto fills it in place instead of allocating per chunk
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+
+    return hasher.hexdigest()
+
+
+def sample_digest(path, file_size, algorithm=DEFAULT_ALGORITHM, buffer_size=None):
+    # Hashes the first and last SAMPLE_SIZE bytes, which is enough to split most same-size files apart
+    hasher = hashlib.new(algorithm)
+
+    with open(path, 'rb') as f:
+        hasher.update(f.read(SAMPLE_SIZE))
+        if file_size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, file_size - SAMPLE_SIZE))
+            hasher.update(f.read(SAMPLE_SIZE))
+
+    return hasher.hexdigest()
+
+
+def files_equal(path, other, buffer_size=DEFAULT_BUFFER_SIZE) -> bool:
+    """Compare two files byte for byte, stopping at the first chunk that differs.
+
+    A file that cannot be read counts as different: nothing is proven equal.
+    """
+    try:
+        return _files_equal(path, other, buffer_size)
+    except OSError:
+        return False
+
+
+def _files_equal(path, other, buffer_size):
+    with open(path, 'rb', buffering=0) as f1, open(other, 'rb', buffering=0) as f2:
+        size = os.fstat(f1.fileno()).st_size
+        if size != os.fstat(f2.fileno()).st_size:
+            return False
+
+        buffer1, buffer2 = _compare_buffers(buffer_size)
+
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as m1, \
+                    mmap.mmap(f2.fileno(), 0, access=mmap.ACCESS_READ) as m2:
+                if hasattr(m1, 'madvise'):
+                    m1.madvise(mmap.MADV_SEQUENTIAL)
+                    m2.madvise(mmap.MADV_SEQUENTIAL)
+                return _maps_equal(m1, m2, size, buffer1, buffer2)
+
+        while True:
+            n1 = _read_full(f1, buffer1)
+            n2 = _read_full(f2, buffer2)
+            if n1 != n2:
+                return False
+            if n1 < buffer_size:
+                # Slicing copies, so only the short last chunk pays for it
+                return buffer1[:n1] == buffer2[:n2]
+            if buffer1 != buffer2:
+                return False
+
+
+def _maps_equal(m1, m2, size, buffer1, buffer2) -> bool:
+    # Slicing an mmap copies into a new bytes object; memoryview slices are copied into the
+    # reused compare buffers instead, which is a memcpy, and those are compared with a memcmp
+    buffer_size = len(buffer1)
+    with memoryview(m1) as view1, memoryview(m2) as view2, \
+            memoryview(buffer1) as target1, memoryview(buffer2) as target2:
+        for start in range(0, size, buffer_size):
+            n = min(buffer_size, size - start)
+            target1[:n] = view1[start:start + n]
+            target2[:n] = view2[start:start + n]
+            if n < buffer_size:
+                return buffer1[:n] == buffer2[:n]
+            if buffer1 != buffer2:
+                return False
+    return True
+
+
+def _read_full(f, buffer) -> int:
+    # An unbuffered read may come back short before the end of the file (network mounts)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(buffer):
+        n = f.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def _compare_buffers(buffer_size):
+    # bytearray == bytearray is a memcmp, comparing memoryviews goes item by item
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None or len(buffers[0]) != buffer_size:
+        buffers = _local.buffers = (bytearray(buffer_size), bytearray(buffer_size))
+    return buffers
+
+
+def map_bounded(func, jobs, workers=1, mode='thread'):
+    """Yield func(*job) for every job, in the same order as jobs.
+
+    With more than one worker the calls run on a thread or process pool, but
+    no more than a few jobs per worker are in flight at once, so memory stays
+    flat however many jobs there are and a slow file only holds up the results
+    queued behind it.
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield func(*job)
+        return
+
+    pool_class = ProcessPoolExecutor if mode == 'process' else ThreadPoolExecutor
+    max_in_flight = workers * 4
+
+    with pool_class(max_workers=workers) as pool:
+        in_flight = deque()
+
+        for job in jobs:
+            in_flight.append(pool.submit(func, *job))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,390 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime as dt
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# Records that close an operation: nothing of it is written after the first of them but more status
+STATUS_EVENTS = frozenset(("committed", "aborted", "undone"))
+
+
+class OperationJournal:
+    """Append-only log of operations, one JSON record per line.
+
+    An operation is a "begin" record, one "entry" record per path it touched,
+    written as the work happens, and a "committed" (or "aborted") record.
+    Undoing it appends an "undone" record; nothing is ever rewritten in place. Records are buffered
+    and fsynced every `batch_size` entries and on every commit.
+
+    Long operations also write their work ahead as "plan" records, flushed
+    before any of it runs. The entries then mark what is done, so an
+    operation that was interrupted can be resumed from its pending() work.
+
+    A small side index (one line per operation, holding its byte offset in the
+    journal) lets undo jump straight to the last operation. The index can
+    always be rebuilt from the journal, which is the source of truth.
+
+    Operation ids are never handed out twice, not even after compaction
+    dropped the operations that had them: the next id is kept in the index
+    and, across a compaction, in an "ids" record (id 0) at the head of the
+    journal.
+
+    Several processes may share a journal (watch runs alongside everything
+    else): writes happen under an flock on operations.lock, and begin()
+    first picks up whatever the others appended, so every id is handed out
+    once and every begin record sits at the offset the index says.
+    """
+
+    def __init__(self, base_dir: Path, batch_size: int = 1000, max_bytes: int = 256 * 1024**2, keep: int = 100):
+        self.path = Path(base_dir) / 'operations.jsonl'
+        self.index_path = Path(base_dir) / 'operations.idx'
+        self.lock_path = Path(base_dir) / 'operations.lock'
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.keep = keep
+
+        self._buffer = []
+        self._index_buffer = []
+        self._size = self.path.stat().st_size if self.path.exists() else 0
+        self._index = None
+        self._next_id = 1
+        # Set by flush when another process appended since this one last wrote
+        self._stale = False
+        self._lock_file = None
+        self._lock_depth = 0
+        self._thread_lock = threading.RLock()
+
+        if self._size > self.max_bytes:
+            self.compact()
+
+    # ---------- writing ----------
+
+    def begin(self, action: str, timestamp: str = None, **fields) -> int:
+        # Written at once: the id and the offset are only right while the lock is held
+        with self._locked():
+            self._catch_up()
+            ops = self._load_index()
+            op_id = self._next_id
+            self._next_id += 1
+            record = {"id": op_id, "event": "begin", "action": action,
+                      "timestamp": timestamp or dt.now().isoformat(timespec="seconds"), **fields}
+
+            offset = self._append(record)
+            info = {"id": op_id, "offset": offset, "action": action, "timestamp": record["timestamp"], "status": "open"}
+            ops[op_id] = info
+            self._index_buffer.append(info)
+            self.flush()
+        return op_id
+
+    def record(self, op_id: int, entry: dict):
+        self._append({"id": op_id, "event": "entry", "entry": entry})
+        ops = self._load_index()
+        ops[op_id]["count"] = ops[op_id].get("count", 0) + 1
+
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def plan(self, op_id: int, entry: dict):
+        # Work about to be done; record() the same entry once it is
+        self._append({"id": op_id, "event": "plan", "entry": entry})
+
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def commit(self, op_id: int):
+        self._set_status(op_id, "committed")
+
+    def mark_undone(self, op_id: int):
+        self._set_status(op_id, "undone")
+
+    def abort(self, op_id: int):
+        # For an operation cancelled before it changed anything
+        self._set_status(op_id, "aborted")
+
+    def flush(self):
+        if not self._buffer and not self._index_buffer:
+            return
+
+        with self._locked():
+            if self._buffer:
+                data = b''.join(self._buffer)
+                with open(self.path, 'ab') as f:
+                    if os.fstat(f.fileno()).st_size != self._size - len(data):
+                        self._stale = True
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._size = f.tell()
+                self._buffer.clear()
+
+            # The index is only written once the journal records it points at are durable.
+            # The closing "end" line lets a reader notice journal records the index never saw.
+            self._index_buffer.append({"end": self._size, "next_id": self._next_id})
+            with open(self.index_path, 'a') as f:
+                for info in self._index_buffer:
+                    f.write(json.dumps(info, separators=(',', ':')) + '\n')
+            self._index_buffer.clear()
+
+    # ---------- reading ----------
+
+    def operations(self) -> list[dict]:
+        # Index entries for every operation, oldest first
+        return [self._load_index()[op_id] for op_id in sorted(self._load_index())]
+
+    def get(self, op_id: int):
+        return self._load_index().get(op_id)
+
+    def last(self, status: str = "committed"):
+        latest = self.latest(1, status)
+        return latest[0] if latest else None
+
+    def latest(self, count: int, status: str = "committed") -> list[dict]:
+        # Index entries of the newest `count` operations with this status, newest first
+        ops = self._load_index()
+        found = []
+        for op_id in sorted(ops, reverse=True):
+            if len(found) >= count:
+                break
+            if ops[op_id]["status"] == status:
+                found.append(ops[op_id])
+        return found
+
+    def entries(self, op_id: int):
+        """Yield the path entries of one operation, in the order they were recorded."""
+        for record in self._records(op_id):
+            if record["event"] == "entry":
+                yield record["entry"]
+
+    def header(self, op_id: int) -> dict:
+        # The begin record, with the fields the operation was started with
+        return next(self._records(op_id))
+
+    def pending(self, op_id: int) -> list[dict]:
+        """Planned entries of an operation that were never recorded as done, in plan order."""
+        planned = []
+        done = set()
+
+        for record in self._records(op_id):
+            if record["event"] == "plan":
+                planned.append(record["entry"])
+            elif record["event"] == "entry":
+                done.add(_key(record["entry"]))
+
+        return [entry for entry in planned if _key(entry) not in done]
+
+    # ---------- maintenance ----------
+
+    def compact(self):
+        """Rewrite the journal with the last `keep` committed operations and any unfinished ones.
+
+        Everything else (undone and older operations) is moved to a single
+        rotated file, operations.jsonl.1, which replaces the previous one.
+        """
+        with self._locked():
+            self._catch_up()
+            self._compact()
+
+    def _compact(self):
+        ops = self._load_index()
+        committed = [op_id for op_id in sorted(ops) if ops[op_id]["status"] == "committed"]
+        keep_ids = set(committed[-self.keep:]) | {op_id for op_id in ops if ops[op_id]["status"] == "open"}
+
+        tmp_path = self.path.with_suffix('.jsonl.tmp')
+        rotated_path = self.path.with_suffix('.jsonl.1')
+
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as kept, open(rotated_path, 'wb') as rotated:
+            # The ids of the operations moved out stay used
+            kept.write((json.dumps({"id": 0, "event": "ids", "next_id": self._next_id}, separators=(',', ':')) + '\n').encode())
+            for line in src:
+                try:
+                    op_id = json.loads(line)["id"]
+                except ValueError:
+                    break
+                if op_id == 0:
+                    continue
+                (kept if op_id in keep_ids else rotated).write(line)
+            kept.flush()
+            os.fsync(kept.fileno())
+
+        os.replace(tmp_path, self.path)
+        self._size = self.path.stat().st_size
+        self._rebuild_index()
+        logging.info(f'Operation journal compacted: kept {len(keep_ids)} of {len(ops)} operations')
+
+    def migrate_legacy(self, legacy_path: Path):
+        """Import an old operations.json (newest operation first) into an empty journal."""
+        if not legacy_path.exists() or self._load_index():
+            return
+
+        with open(legacy_path, 'r') as f:
+            legacy = json.load(f).get("operations", [])
+
+        for operation in reversed(legacy):
+            op_id = self.begin(operation["action"], timestamp=operation.get("timestamp"))
+            # Legacy paths were stored newest first, the journal keeps them in execution order
+            for entry in reversed(operation.get("paths", [])):
+                self.record(op_id, entry)
+            self.commit(op_id)
+
+        legacy_path.rename(legacy_path.with_name(legacy_path.name + '.migrated'))
+        logging.info(f'Imported {len(legacy)} operations from {legacy_path}')
+
+    # ---------- internals ----------
+
+    def _append(self, record: dict) -> int:
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        offset = self._size
+        self._buffer.append(line)
+        self._size += len(line)
+        return offset
+
+    def _records(self, op_id: int):
+        # Every record of one operation up to its first status record, starting with its begin record
+        self.flush()
+        info = self._load_index()[op_id]
+
+        with open(self.path, 'rb') as f:
+            f.seek(info["offset"])
+            for _, _, record in _read_records(f):
+                if record["id"] != op_id:
+                    continue
+                if record["event"] in STATUS_EVENTS:
+                    return
+                yield record
+
+    def _set_status(self, op_id: int, status: str):
+        self._append({"id": op_id, "event": status})
+        info = self._load_index()[op_id]
+        info["status"] = status
+        self._index_buffer.append({"id": op_id, "status": status, "count": info.get("count", 0)})
+        self.flush()
+
+    @contextmanager
+    def _locked(self):
+        # Reentrant: begin and compact flush while they hold it
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_file is None:
+                    self._lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _catch_up(self):
+        # Under the lock: reload the index if another process appended since this one last looked
+        self.flush()
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if not self._stale and size == self._size:
+            return
+
+        counts = {op_id: info.get("count", 0) for op_id, info in (self._index or {}).items()}
+        self._size = size
+        self._stale = False
+        self._index = None
+        ops = self._load_index()
+        # Entries of this process's open operations are only counted in the index when they close
+        for op_id, count in counts.items():
+            if op_id in ops:
+                ops[op_id]["count"] = max(count, ops[op_id].get("count", 0))
+
+    def _load_index(self) -> dict:
+        if self._index is not None:
+            return self._index
+
+        with self._locked():
+            return self._read_index()
+
+    def _read_index(self) -> dict:
+        if not self._buffer:
+            self._size = self.path.stat().st_size if self.path.exists() else 0
+
+        self._index = {}
+        end = 0
+        next_id = 1
+        if self.index_path.exists():
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    try:
+                        info = json.loads(line)
+                    except ValueError:
+                        break
+                    if "end" in info:
+                        # Every writer ends its lines with one, the highest next_id wins
+                        end = info["end"]
+                        next_id = max(next_id, info.get("next_id", 1))
+                    elif "offset" in info:
+                        self._index[info["id"]] = info
+                    elif info["id"] in self._index:
+                        self._index[info["id"]].update(info)
+
+        # A crash between writing the journal and the index leaves the two disagreeing
+        if end != self._size:
+            self._rebuild_index()
+        else:
+            self._next_id = max(next_id, max(self._index, default=0) + 1)
+
+        return self._index
+
+    def _rebuild_index(self):
+        self._index = {}
+        good_end = 0
+        next_id = 1
+
+        if self.path.exists():
+            with open(self.path, 'rb') as f:
+                for offset, good_end, record in _read_records(f):
+                    op_id = record["id"]
+                    if record["event"] == "ids":
+                        next_id = max(next_id, record["next_id"])
+                    elif record["event"] == "begin":
+                        self._index[op_id] = {"id": op_id, "offset": offset, "action": record["action"],
+                                              "timestamp": record["timestamp"], "status": "open", "count": 0}
+                    elif op_id in self._index:
+                        if record["event"] == "entry":
+                            self._index[op_id]["count"] += 1
+                        elif record["event"] != "plan":
+                            self._index[op_id]["status"] = record["event"]
+
+        self._next_id = max(self._next_id, next_id, max(self._index, default=0) + 1)
+
+        # Drop a torn last record so the next append starts on a fresh line
+        if good_end < self._size and not self._buffer:
+            os.truncate(self.path, good_end)
+            self._size = good_end
+
+        tmp_path = self.index_path.with_suffix('.idx.tmp')
+        with open(tmp_path, 'w') as f:
+            for op_id in sorted(self._index):
+                f.write(json.dumps(self._index[op_id], separators=(',', ':')) + '\n')
+            f.write(json.dumps({"end": self._size, "next_id": self._next_id}) + '\n')
+        os.replace(tmp_path, self.index_path)
+
+
+def _key(entry: dict) -> str:
+    return json.dumps(entry, sort_keys=True)
+
+
+def _read_records(f):
+    # Yields (offset, end, record) from the current position, stopping at a line torn by a crash
+    offset = f.tell()
+    for line in f:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logging.warning(f'Operation journal ends with an incomplete record at byte {offset}')
+            return
+        yield offset, offset + len(line), record
+        offset += len(line)
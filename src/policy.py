@@ -0,0 +1,64 @@
+import json
+import re
+from pathlib import Path
+
+RULES = ('newest', 'oldest', 'shortest', 'prefix:PATH', 'regex:PATTERN')
+
+
+class KeepPolicy:
+    """Picks the file to keep in each duplicate group from an ordered list of rules.
+
+    Each rule only breaks the ties left by the ones before it:
+      newest / oldest   modification time
+      shortest          length of the full path
+      prefix:PATH       files under PATH win (several prefixes rank in the order given)
+      regex:PATTERN     files whose full path matches PATTERN win
+    When every rule ties, the first path in sorted order is kept, so a
+    policy always gives the same answer for the same group.
+    """
+
+    def __init__(self, rules: list[str]):
+        if not rules:
+            raise ValueError('a keep policy needs at least one rule')
+
+        self.rules = list(rules)
+        self._keys = [_compile(rule) for rule in self.rules]
+
+    @classmethod
+    def from_file(cls, path: Path):
+        # JSON config: {"keep": ["prefix:/srv/master", "newest"]}
+        with open(path, 'r') as f:
+            config = json.load(f)
+
+        rules = config.get("keep") if isinstance(config, dict) else None
+        if not isinstance(rules, list):
+            raise ValueError(f'{path} must hold a "keep" list of rules')
+        return cls(rules)
+
+    def choose(self, group: list[Path], mtimes: dict) -> Path:
+        # mtimes comes from the scan, so choosing never stats a file again
+        return min(group, key=lambda path: (*(key(path, mtimes) for key in self._keys), str(path)))
+
+
+def _compile(rule: str):
+    name, _, value = rule.partition(':')
+
+    if name == 'newest' and not value:
+        return lambda path, mtimes: -mtimes[path]
+    if name == 'oldest' and not value:
+        return lambda path, mtimes: mtimes[path]
+    if name == 'shortest' and not value:
+        return lambda path, mtimes: len(str(path))
+
+    if name == 'prefix' and value:
+        prefix = Path(value).expanduser().resolve()
+        return lambda path, mtimes: 0 if prefix in path.parents else 1
+
+    if name == 'regex' and value:
+        try:
+            pattern = re.compile(value)
+        except re.error as e:
+            raise ValueError(f'invalid regex in keep rule {rule!r}: {e}') from e
+        return lambda path, mtimes: 0 if pattern.search(str(path)) else 1
+
+    raise ValueError(f'unknown keep rule {rule!r}, expected one of: {", ".join(RULES)}')
@@ -0,0 +1,66 @@
+import sys
+import time
+
+
+class Progress:
+    """A single status line (files/s, MB/s, ETA) redrawn in place on stderr.
+
+    Redraws are throttled to one every `interval` seconds however often
+    update() is called, so a hot loop pays for a clock read, not for terminal
+    output. close() replaces the line with a final summary. A disabled
+    Progress does nothing at all.
+    """
+
+    def __init__(self, label: str, total: int = None, enabled: bool = True, interval: float = 0.25, stream=None):
+        self.label = label
+        self.total = total
+        self.enabled = enabled
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self._next_draw = self.start + interval
+
+    def update(self, files: int = 1, nbytes: int = 0):
+        self.files += files
+        self.bytes += nbytes
+
+        if self.enabled:
+            now = time.monotonic()
+            if now >= self._next_draw:
+                self._next_draw = now + self.interval
+                self._draw(self._status(now), end='')
+
+    def close(self):
+        if not self.enabled:
+            return
+
+        elapsed = time.monotonic() - self.start
+        self._draw(f'{self.label}: {self.files} files, {self.bytes / 1024**2:.1f} MB in {elapsed:.1f}s '
+                   f'({self.files / max(elapsed, 1e-9):.0f} files/s, {self.bytes / 1024**2 / max(elapsed, 1e-9):.1f} MB/s)',
+                   end='\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _status(self, now: float) -> str:
+        elapsed = max(now - self.start, 1e-9)
+        files_rate = self.files / elapsed
+        status = f'{self.label}: {self.files}'
+
+        if self.total:
+            status += f'/{self.total}'
+        status += f' files, {files_rate:.0f} files/s, {self.bytes / 1024**2 / elapsed:.1f} MB/s'
+
+        if self.total and files_rate:
+            status += f', ETA {(self.total - self.files) / files_rate:.0f}s'
+        return status
+
+    def _draw(self, text: str, end: str):
+        # \r and a clear-to-end-of-line escape rewrite the line in place
+        self.stream.write(f'\r{text}\x1b[K{end}')
+        self.stream.flush()
@@ -0,0 +1,81 @@
+import os
+
+
+def plan_renames(renames, listdir=os.listdir) -> tuple[list[tuple[str, str]], list[tuple[str, str, str]]]:
+    """Turn wanted (source, target) renames into an ordered list of steps that is safe to run.
+
+    Everything is worked out in memory: each directory involved is listed
+    once, instead of probing every target with exists(). A target may be the
+    current name of another file that is renamed too, in which case that
+    file moves first (a -> b, b -> c runs b -> c, then a -> b). Renames that
+    form a cycle (a -> b, b -> a) go through a temporary name. Returns
+    (steps, conflicts): steps are (source, target) pairs in the order to run
+    them, conflicts are (source, target, reason) for the renames left out.
+    """
+    moves = {}
+    claimed = {}
+    conflicts = []
+    names = {}
+
+    def taken(path):
+        directory, name = os.path.split(path)
+        if directory not in names:
+            names[directory] = set(listdir(directory))
+        return name in names[directory]
+
+    for src, dst in renames:
+        if src == dst:
+            continue
+        if dst in claimed:
+            conflicts.append((src, dst, f'{claimed[dst]} is renamed to the same name'))
+            continue
+        claimed[dst] = src
+        moves[src] = dst
+
+    # The rename waiting for each source's current name to become free
+    wants = {dst: src for src, dst in moves.items() if dst in moves}
+
+    # A target held by a file that is not moving (or cannot move) blocks its rename,
+    # and with it every rename queued behind it for that file's name
+    for src, dst in list(moves.items()):
+        if dst not in moves and src in moves and taken(dst):
+            blocked = src
+            reason = f'{dst} already exists'
+            while blocked in moves:
+                conflicts.append((blocked, moves.pop(blocked), reason))
+                reason = f'{blocked} is not renamed'
+                blocked = wants.pop(blocked, None)
+
+    steps = []
+    done = set()
+
+    for src in [src for src, dst in moves.items() if dst not in moves]:
+        # Once src has moved its old name is free for the rename that wants it, and so on down the chain
+        while src is not None:
+            steps.append((src, moves[src]))
+            done.add(src)
+            src = wants.get(src)
+
+    # What is left are cycles: park one member under a temporary name to open each of them
+    for src in list(moves):
+        if src in done:
+            continue
+
+        directory, name = os.path.split(src)
+        counter = 0
+        tmp = os.path.join(directory, f'.{name}.renaming')
+        while taken(tmp) or tmp in claimed:
+            counter += 1
+            tmp = os.path.join(directory, f'.{name}.renaming{counter}')
+        claimed[tmp] = src
+
+        steps.append((src, tmp))
+        done.add(src)
+        last = wants.get(src)
+        while last not in done:
+            steps.append((last, moves[last]))
+            done.add(last)
+            last = wants.get(last)
+        steps.append((tmp, moves[src]))
+
+    return steps, conflicts
@@ -0,0 +1,105 @@
+import os
+import string
+from datetime import datetime as dt
+
+import fileExtensions
+
+PLACEHOLDERS = ('name', 'count', 'doc_type', 'last_modified', 'size', 'parent', 'hash8', 'ctime')
+
+# Placeholders that need the file's stat; {hash8} needs its size to be hashed
+STAT_PLACEHOLDERS = {'last_modified', 'size', 'ctime', 'hash8'}
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# A new name is only ever a name: renames stay in the file's own folder
+SEPARATORS = tuple(sep for sep in (os.sep, os.altsep) if sep)
+
+# Labels for the {doc_type} placeholder; every other category is 'Other'
+DOC_TYPE_LABELS = {
+    'document': 'Document',
+    'image': 'Image',
+    'video': 'Video',
+    'audio': 'Audio',
+    'archive': 'Archive',
+    'code': 'Code',
+    'web': 'Web',
+    'font': 'Font',
+    'executable': 'Binary',
+    'database': 'Database',
+}
+
+
+class RenameTemplate:
+    """A --pattern compiled once into a str.format template and the getters it needs.
+
+    Placeholders accept format specs: {count:05} pads the counter, {size:,}
+    groups digits, and the dates ({last_modified}, {ctime}) take strftime
+    codes such as {ctime:%Y%m%d}, YYYY-MM-DD by default. {ctime} is the
+    creation time where the platform records one, else the inode change
+    time. Only the values the pattern uses are computed for each file, and
+    needs_stat / needs_hash tell the caller what to fetch up front.
+    Raises ValueError for unknown placeholders, malformed patterns, and
+    patterns that put a path separator into the name.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.fields = set()
+        parts = []
+
+        for literal, field, spec, conversion in string.Formatter().parse(pattern):
+            if has_separator(literal):
+                raise ValueError(f'invalid pattern {pattern!r}: a new name cannot contain {" or ".join(SEPARATORS)}')
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+
+            if field not in PLACEHOLDERS:
+                raise ValueError(f'invalid placeholder {{{field}}}, valid placeholders are: '
+                                 + ', '.join(f'{{{name}}}' for name in PLACEHOLDERS))
+
+            if field in ('last_modified', 'ctime') and not spec:
+                spec = DATE_FORMAT
+            parts.append('{' + field + (f'!{conversion}' if conversion else '') + (f':{spec}' if spec else '') + '}')
+            self.fields.add(field)
+
+        self._format = ''.join(parts)
+        self._getters = [(field, _GETTERS[field]) for field in PLACEHOLDERS if field in self.fields]
+        self.needs_stat = bool(self.fields & STAT_PLACEHOLDERS)
+        self.needs_hash = 'hash8' in self.fields
+
+        # A bad format spec ({count:x5}) should fail here, not on the first file
+        try:
+            sample = self._format.format_map({field: _SAMPLES[field] for field in self.fields})
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'invalid format in pattern {pattern!r}: {e}') from e
+
+        # Date formats such as {last_modified:%Y/%m} put one in through the spec
+        if has_separator(sample):
+            raise ValueError(f'invalid format in pattern {pattern!r}: it renders names like {sample!r}, '
+                             f'and a new name cannot contain {" or ".join(SEPARATORS)}')
+
+    def render(self, entry, count: int, digest: str = None) -> str:
+        # entry is a walker.Entry, stat'ed when needs_stat is set
+        return self._format.format_map({field: getter(entry, count, digest) for field, getter in self._getters})
+
+
+def has_separator(name: str) -> bool:
+    return any(sep in name for sep in SEPARATORS)
+
+
+_GETTERS = {
+    'name': lambda entry, count, digest: os.path.splitext(entry.name)[0],
+    'count': lambda entry, count, digest: count,
+    'doc_type': lambda entry, count, digest: DOC_TYPE_LABELS.get(fileExtensions.classify(entry.name), 'Other'),
+    'last_modified': lambda entry, count, digest: dt.fromtimestamp(entry.mtime),
+    'size': lambda entry, count, digest: entry.size,
+    'parent': lambda entry, count, digest: os.path.basename(os.path.dirname(entry.path)),
+    'hash8': lambda entry, count, digest: digest[:8],
+    'ctime': lambda entry, count, digest: dt.fromtimestamp(entry.ctime),
+}
+
+_SAMPLES = {
+    'name': 'name', 'count': 1, 'doc_type': 'Other', 'last_modified': dt(2000, 1, 1), 'size': 0,
+    'parent': 'parent', 'hash8': '00000000', 'ctime': dt(2000, 1, 1),
+}
@@ -0,0 +1,190 @@
+import logging
+import os
+from typing import Iterator, NamedTuple
+
+
+class Entry(NamedTuple):
+    path: str
+    name: str
+    is_dir: bool
+    is_file: bool
+    size: int
+    mtime: float
+    dev: int
+    ino: int
+    depth: int
+    # Creation time where the platform records one, else the inode change time
+    ctime: float = 0.0
+
+
+def walk(root, recursive=True, exclude=frozenset(), skip_hidden=False,
+         files=True, dirs=False, other=False, stat=True) -> Iterator[Entry]:
+    """Walk root with os.scandir and yield one Entry per matching item.
+
+    Directories named in exclude (or hidden ones, with skip_hidden) are pruned
+    before they are opened. Types come from the DirEntry, so the only syscall
+    per yielded item is the stat, and only when stat=True; it follows symlinks
+    for files, like Path.is_file() does. Symlinked directories are never
+    descended into. Unreadable directories are logged and skipped.
+    """
+    stack = [(os.fspath(root), 0)]
+
+    while stack:
+        current, depth = stack.pop()
+        subdirs = []
+
+        # The listing is consumed as it is read, never held whole: stopping after
+        # N entries of a huge directory reads about N of them
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    name = entry.name
+                    if skip_hidden and name.startswith('.'):
+                        continue
+
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        is_file = not is_dir and entry.is_file()
+
+                        if is_dir:
+                            if name in exclude:
+                                continue
+                            if recursive:
+                                subdirs.append(entry.path)
+                            if not dirs:
+                                continue
+                        elif (is_file and not files) or (not is_file and not other):
+                            continue
+
+                        if stat:
+                            st = entry.stat(follow_symlinks=is_file)
+                            item = Entry(entry.path, name, is_dir, is_file, st.st_size, st.st_mtime, st.st_dev,
+                                         st.st_ino, depth, getattr(st, 'st_birthtime', st.st_ctime))
+                        else:
+                            item = Entry(entry.path, name, is_dir, is_file, 0, 0.0, 0, 0, depth)
+
+                    except OSError as e:
+                        logging.warning(f'Could not read {entry.path}: {e}')
+                        continue
+
+                    yield item
+
+        except OSError as e:
+            logging.warning(f'Could not read directory {current}: {e}')
+
+        # Reversed so the stack hands directories back in listing order
+        stack.extend((path, depth + 1) for path in reversed(subdirs))
+
+
+def list_dir(path) -> list[Entry]:
+    # Every direct child of path, without stat calls. Unlike walk, errors reach the caller
+    with os.scandir(path) as it:
+        return [Entry(entry.path, entry.name, entry.is_dir(follow_symlinks=False), entry.is_file(), 0, 0.0, 0, 0, 0)
+                for entry in it]
+
+
+def disk_usage(root, max_depth=None) -> Iterator[tuple[str, int, int]]:
+    """Yield (path, depth, bytes) for each directory under root, children before parents.
+
+    Bytes is the space the subtree takes on disk (st_blocks, so sparse and
+    compressed files count for what they really use), with every hardlinked
+    file counted once. Each entry is stat'ed once and symlinks are not
+    followed. Directories deeper than max_depth still count towards their
+    ancestors but are not yielded. Memory grows with the depth of the tree and
+    the number of hardlinked files, not with the number of files.
+    """
+    root = os.fspath(root)
+    seen = set()
+    stack = [_usage_frame(root, 0, seen)]
+    stack[0][3] += _usage(os.stat(root, follow_symlinks=False))
+
+    while stack:
+        frame = stack[-1]
+        if frame[2]:
+            stack.append(_usage_frame(frame[2].pop(), frame[1] + 1, seen))
+            continue
+
+        path, depth, _, total = stack.pop()
+        if stack:
+            stack[-1][3] += total
+        if max_depth is None or depth <= max_depth:
+            yield path, depth, total
+
+
+def _usage_frame(path, depth, seen) -> list:
+    # [path, depth, subdirectories still to visit, bytes so far]; reads the directory once
+    subdirs = []
+    total = 0
+
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError as e:
+                    logging.warning(f'Could not read {entry.path}: {e}')
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif st.st_nlink > 1:
+                    if (st.st_dev, st.st_ino) in seen:
+                        continue
+                    seen.add((st.st_dev, st.st_ino))
+
+                total += _usage(st)
+    except OSError as e:
+        logging.warning(f'Could not read directory {path}: {e}')
+
+    return [path, depth, subdirs, total]
+
+
+def _usage(st) -> int:
+    # st_blocks is in 512-byte units; platforms without it only have the apparent size
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def empty_dirs(root, recursive=True) -> Iterator[str]:
+    """Yield every directory below root that holds nothing but empty directories, children first.
+
+    Each directory is read once, in post-order, so a folder that only contains
+    empty folders is found in the same pass as they are, and removing the
+    yielded paths in order empties it before its turn comes. Without recursive
+    only the direct children of root are considered, and a subfolder counts as
+    content. Unreadable directories are logged and never yielded.
+    """
+    stack = [_empty_frame(os.fspath(root), True)]
+
+    while stack:
+        frame = stack[-1]
+        if frame[1]:
+            stack.append(_empty_frame(frame[1].pop(), recursive))
+            continue
+
+        path, _, empty = stack.pop()
+        if not stack:
+            return
+        if empty:
+            yield path
+        else:
+            stack[-1][2] = False
+
+
+def _empty_frame(path, descend) -> list:
+    # [path, subdirectories still to visit, empty so far]
+    subdirs = []
+    empty = True
+
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if descend and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    empty = False
+    except OSError as e:
+        logging.warning(f'Could not read directory {path}: {e}')
+        empty = False
+
+    return [path, subdirs, empty]
@@ -1,8 +1,31 @@
+import errno
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
 import pytest
 from pathlib import Path
+from itertools import islice
 from unittest import mock
 from types import SimpleNamespace
+from src import file_organizer
 from src.file_organizer import FileOrganizer
+from progress import Progress
+import hashing
+import walker
+import fastcopy
+import fileExtensions
+import journal as journal_module
+from journal import OperationJournal
+import backup_store
+from backup_store import BackupStore
+from fs_index import FileIndex
+from policy import KeepPolicy
+from rename_plan import plan_renames
+from rename_template import RenameTemplate
+from file_filter import FileFilter
 
 
 @pytest.fixture
@@ -121,4 +144,1532 @@ class TestDeletePath:
         with mock.patch("builtins.input", return_value="C"):
             organizer._delete_path([f1], "files")
 
-        assert f1.exists()
\ No newline at end of file
+        assert f1.exists()
+
+class TestFindDuplicates:
+
+    def test_unique_sizes_are_never_hashed(self, organizer, tmp_path):
+        f1 = tmp_path / "a.bin"
+        f2 = tmp_path / "b.bin"
+        f1.write_bytes(b"x" * 10)
+        f2.write_bytes(b"x" * 20)
+
+        with mock.patch("hashing.sample_digest") as sample, mock.patch("hashing.file_digest") as full:
+            groups = organizer._find_duplicate_groups([(f1, 10), (f2, 20)])
+
+        assert groups == []
+        sample.assert_not_called()
+        full.assert_not_called()
+
+    def test_large_files_split_by_full_hash(self, organizer, tmp_path):
+        size = 100 * 1024
+        same_a = tmp_path / "same_a.bin"
+        same_b = tmp_path / "same_b.bin"
+        middle = tmp_path / "middle.bin"
+        same_a.write_bytes(b"a" * size)
+        same_b.write_bytes(b"a" * size)
+        # Same head and tail as the others, only the middle differs
+        middle.write_bytes(b"a" * (size // 2) + b"b" + b"a" * (size // 2 - 1))
+
+        groups = organizer._find_duplicate_groups([(same_a, size), (same_b, size), (middle, size)])
+
+        assert groups == [[same_a, same_b]]
+
+    def test_reports_duplicates_without_deleting(self, organizer, tmp_path, capsys):
+        (tmp_path / "one.txt").write_text("duplicate content")
+        (tmp_path / "two.txt").write_text("duplicate content")
+        (tmp_path / "other.txt").write_text("something else")
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False)
+
+        with mock.patch("builtins.input", return_value="3"):
+            organizer.manage_duplicates(args)
+
+        captured = capsys.readouterr()
+        assert "Found 1 duplicate files" in captured.out
+        assert (tmp_path / "one.txt").exists()
+        assert (tmp_path / "two.txt").exists()
+
+
+class TestHashCache:
+
+    def test_unchanged_file_is_not_read_again(self, organizer, tmp_path):
+        f1 = tmp_path / "data.bin"
+        f1.write_bytes(b"cached content")
+        first = organizer._get_file_hash(f1)
+
+        with mock.patch("builtins.open", side_effect=AssertionError("file was read")):
+            assert organizer._get_file_hash(f1) == first
+
+        assert organizer.hash_cache.hits == 1
+
+    def test_modified_file_is_rehashed(self, organizer, tmp_path):
+        f1 = tmp_path / "data.bin"
+        f1.write_bytes(b"old content")
+        first = organizer._get_file_hash(f1)
+
+        f1.write_bytes(b"new content!")
+        assert organizer._get_file_hash(f1) != first
+
+    def test_no_cache_option(self, organizer, tmp_path):
+        f1 = tmp_path / "data.bin"
+        f1.write_bytes(b"uncached")
+
+        organizer._configure_hash_cache(SimpleNamespace(no_cache=True))
+        organizer._get_file_hash(f1)
+
+        assert organizer.hash_cache is None
+
+    def test_cache_persists_between_runs(self, tmp_path):
+        f1 = tmp_path / "data.bin"
+        f1.write_bytes(b"persisted")
+
+        first_run = FileOrganizer(base_dir=tmp_path)
+        digest = first_run._get_file_hash(f1)
+        first_run.close()
+
+        second_run = FileOrganizer(base_dir=tmp_path)
+        assert second_run._get_file_hash(f1) == digest
+        assert second_run.hash_cache.hits == 1
+        second_run.close()
+
+
+class TestParallelHashing:
+
+    @pytest.mark.parametrize("mode", ["thread", "process"])
+    def test_groups_match_serial_run(self, organizer, tmp_path, mode):
+        size = 40 * 1024
+        candidates = []
+        for i in range(12):
+            f = tmp_path / f"file{i}.bin"
+            # Files come in pairs, differing only in the middle
+            f.write_bytes(b"a" * (size // 2) + bytes([i // 2]) + b"a" * (size // 2 - 1))
+            candidates.append((f, size))
+
+        serial = organizer._find_duplicate_groups(candidates)
+        organizer.hash_cache.clear()
+        organizer._configure_workers(SimpleNamespace(workers=4, worker_mode=mode))
+        parallel = organizer._find_duplicate_groups(candidates)
+
+        assert parallel == serial
+        assert len(parallel) == 6
+
+    def test_map_bounded_keeps_job_order(self):
+        results = list(hashing.map_bounded(pow, [(n, 2) for n in range(100)], workers=8))
+        assert results == [n ** 2 for n in range(100)]
+
+
+class TestHashAlgorithms:
+
+    @pytest.mark.parametrize("algorithm", hashing.ALGORITHMS)
+    def test_digest_matches_hashlib(self, tmp_path, algorithm):
+        data = bytes(range(256)) * 1000
+        f = tmp_path / "data.bin"
+        f.write_bytes(data)
+
+        expected = hashlib.new(algorithm, data).hexdigest()
+        assert hashing.file_digest(f, algorithm=algorithm, buffer_size=4096) == expected
+
+    def test_mmap_path_matches_readinto(self, tmp_path, monkeypatch):
+        f = tmp_path / "data.bin"
+        f.write_bytes(b"mapped" * 10000)
+        expected = hashing.file_digest(f)
+
+        monkeypatch.setattr(hashing, "MMAP_THRESHOLD", 1)
+        assert hashing.file_digest(f) == expected
+
+    def test_cache_is_per_algorithm(self, organizer, tmp_path):
+        f = tmp_path / "data.bin"
+        f.write_bytes(b"content")
+
+        md5 = organizer._get_file_hash(f)
+        organizer._configure_hashing(SimpleNamespace(hash="sha256"))
+
+        assert organizer._get_file_hash(f) != md5
+        assert len(organizer._get_file_hash(f)) == 64
+
+
+class TestWalker:
+
+    @pytest.fixture
+    def tree_dir(self, tmp_path):
+        (tmp_path / "src").mkdir()
+        (tmp_path / "src" / "main.py").write_text("print()")
+        (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+        (tmp_path / "node_modules" / "pkg" / "index.js").write_text("js")
+        (tmp_path / ".git").mkdir()
+        (tmp_path / ".git" / "HEAD").write_text("ref")
+        (tmp_path / "top.txt").write_text("top")
+        return tmp_path
+
+    def test_excluded_dirs_are_never_opened(self, tree_dir):
+        opened = []
+        real_scandir = walker.os.scandir
+
+        def tracking_scandir(path):
+            opened.append(Path(path).name)
+            return real_scandir(path)
+
+        with mock.patch.object(walker.os, "scandir", tracking_scandir):
+            names = sorted(e.name for e in walker.walk(tree_dir, exclude={"node_modules"}, skip_hidden=True))
+
+        assert names == ["main.py", "top.txt"]
+        assert "node_modules" not in opened
+        assert ".git" not in opened
+
+    def test_listing_is_read_as_it_is_consumed(self, tmp_path):
+        for i in range(100):
+            (tmp_path / f"{i}.txt").write_text("x")
+        read = []
+        real_scandir = walker.os.scandir
+
+        class TrackingScandir:
+            def __init__(self, path):
+                self.it = real_scandir(path)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                self.it.close()
+
+            def __iter__(self):
+                for entry in self.it:
+                    read.append(entry.name)
+                    yield entry
+
+        with mock.patch.object(walker.os, "scandir", TrackingScandir):
+            first = list(islice(walker.walk(tmp_path, stat=False), 3))
+
+        assert len(first) == 3
+        assert len(read) == 3
+
+    def test_entries_carry_stat_fields(self, tree_dir):
+        entry = next(e for e in walker.walk(tree_dir) if e.name == "top.txt")
+        st = (tree_dir / "top.txt").stat()
+
+        assert (entry.size, entry.ino, entry.depth) == (st.st_size, st.st_ino, 0)
+
+    def test_non_recursive_and_dirs(self, tree_dir):
+        files = {e.name for e in walker.walk(tree_dir, recursive=False)}
+        dirs = {e.name for e in walker.walk(tree_dir, files=False, dirs=True, stat=False)}
+
+        assert files == {"top.txt"}
+        assert dirs == {"src", "node_modules", "pkg", ".git"}
+
+    def test_tree_lists_dirs_first(self, organizer, tree_dir, capsys):
+        organizer.walk_tree(SimpleNamespace(directory=str(tree_dir), depth=0))
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[-1] == "└── top.txt"
+        assert "├── src" in lines
+
+
+class TestClassify:
+
+    @pytest.mark.parametrize("name, category", [
+        ("report.PDF", "document"),
+        ("photo.jpeg", "image"),
+        ("clip.ts", "video"),       # also a code extension, video has priority
+        ("book.epub", "document"),  # also an ebook extension, document has priority
+        ("setup.dmg", "archive"),   # also an executable extension, archive has priority
+        ("script.js", "code"),
+        ("model.stl", "model_3d"),
+        ("noextension", "other"),
+        (".bashrc", "other"),
+    ])
+    def test_classify(self, name, category):
+        assert fileExtensions.classify(Path("/some/dir") / name) == category
+
+    def test_index_matches_first_listing_category(self):
+        for ext, category in fileExtensions.CATEGORY_BY_SUFFIX.items():
+            first = next(c for c, extensions in fileExtensions.CATEGORY_PRIORITY if ext in extensions)
+            assert category == first
+
+    def test_rename_doc_type_uses_classify(self, organizer, tmp_path):
+        (tmp_path / "song.mp3").write_text("a")
+        (tmp_path / "font.ttf").write_text("b")
+        (tmp_path / "part.stl").write_text("c")
+        args = SimpleNamespace(directory=str(tmp_path), pattern="{doc_type}_{name}")
+        organizer.bulk_rename(args)
+
+        assert {p.name for p in tmp_path.iterdir() if p.is_file()} >= {"Audio_song.mp3", "Font_font.ttf", "Other_part.stl"}
+
+
+class TestOperationJournal:
+
+    @pytest.fixture
+    def journal(self, tmp_path):
+        return OperationJournal(tmp_path, batch_size=2)
+
+    def test_entries_come_back_in_order(self, journal):
+        op_id = journal.begin("rename paths")
+        for i in range(5):
+            journal.record(op_id, {"from": f"a{i}", "to": f"b{i}"})
+        journal.commit(op_id)
+
+        assert [e["from"] for e in journal.entries(op_id)] == [f"a{i}" for i in range(5)]
+        assert journal.last()["id"] == op_id
+
+    def test_entries_stop_at_the_status_record(self, journal):
+        ids = []
+        for i in range(4):
+            op_id = journal.begin("rename paths")
+            journal.record(op_id, {"from": f"a{i}", "to": f"b{i}"})
+            journal.commit(op_id)
+            ids.append(op_id)
+        journal.mark_undone(ids[0])
+
+        read = []
+        real = journal_module._read_records
+
+        def counting(f):
+            for item in real(f):
+                read.append(item)
+                yield item
+
+        with mock.patch.object(journal_module, "_read_records", counting):
+            assert list(journal.entries(ids[0])) == [{"from": "a0", "to": "b0"}]
+
+        assert len(read) == 3
+
+    def test_last_skips_undone_and_open_operations(self, journal):
+        first = journal.begin("organize directory")
+        journal.commit(first)
+        second = journal.begin("rename paths")
+        journal.commit(second)
+        journal.mark_undone(second)
+        journal.begin("delete paths")  # never committed
+
+        assert journal.last()["id"] == first
+
+    def test_index_is_rebuilt_from_journal(self, tmp_path, journal):
+        op_id = journal.begin("rename paths")
+        journal.record(op_id, {"from": "a", "to": "b"})
+        journal.commit(op_id)
+        journal.index_path.unlink()
+
+        reopened = OperationJournal(tmp_path)
+        assert reopened.last()["id"] == op_id
+        assert list(reopened.entries(op_id)) == [{"from": "a", "to": "b"}]
+
+    def test_torn_last_record_is_dropped(self, tmp_path, journal):
+        op_id = journal.begin("rename paths")
+        journal.commit(op_id)
+        with open(journal.path, "ab") as f:
+            f.write(b'{"id": 2, "event": "beg')
+
+        reopened = OperationJournal(tmp_path)
+        assert reopened.last()["id"] == op_id
+        next_id = reopened.begin("organize directory")
+        reopened.commit(next_id)
+
+        assert OperationJournal(tmp_path).last()["id"] == next_id
+
+    def test_compact_keeps_recent_operations(self, tmp_path):
+        journal = OperationJournal(tmp_path, keep=2)
+        ids = []
+        for i in range(4):
+            op_id = journal.begin("rename paths")
+            journal.record(op_id, {"from": str(i), "to": str(i + 1)})
+            journal.commit(op_id)
+            ids.append(op_id)
+
+        journal.compact()
+
+        assert [op["id"] for op in journal.operations()] == ids[-2:]
+        assert list(journal.entries(ids[-1])) == [{"from": "3", "to": "4"}]
+        assert (tmp_path / "operations.jsonl.1").exists()
+
+    def test_ids_are_not_reused_after_compaction(self, tmp_path):
+        journal = OperationJournal(tmp_path, keep=1)
+        for i in range(3):
+            op_id = journal.begin("delete paths")
+            journal.commit(op_id)
+        journal.mark_undone(op_id)
+        journal.compact()
+
+        assert journal.begin("delete paths") == 4
+        journal.flush()
+        journal.index_path.unlink()
+        assert OperationJournal(tmp_path).begin("delete paths") == 5
+
+    def test_two_processes_never_share_an_id(self, tmp_path):
+        watcher, command = OperationJournal(tmp_path), OperationJournal(tmp_path)
+
+        first = watcher.begin("organize directory")
+        watcher.record(first, {"from": "a", "to": "b"})
+        renamed = command.begin("rename paths")
+        command.record(renamed, {"from": "c", "to": "d"})
+        command.commit(renamed)
+        second = watcher.begin("organize directory")
+        watcher.commit(first)
+        watcher.commit(second)
+
+        assert (first, renamed, second) == (1, 2, 3)
+        assert [op["action"] for op in watcher.operations()] == ["organize directory", "rename paths", "organize directory"]
+        assert list(watcher.entries(renamed)) == [{"from": "c", "to": "d"}]
+        assert watcher.get(first)["count"] == 1
+        assert OperationJournal(tmp_path).last()["id"] == 3
+
+    def test_legacy_operations_are_imported(self, tmp_path):
+        legacy = {"operations": [
+            {"action": "rename paths", "timestamp": "2026-02-08T18:39:10",
+             "paths": [{"from": "b1", "to": "b2"}, {"from": "a1", "to": "a2"}]},
+        ]}
+        (tmp_path / "operations.json").write_text(json.dumps(legacy))
+
+        organizer = FileOrganizer(base_dir=tmp_path)
+
+        last = organizer.journal.last()
+        assert last["timestamp"] == "2026-02-08T18:39:10"
+        assert list(organizer.journal.entries(last["id"])) == [{"from": "a1", "to": "a2"}, {"from": "b1", "to": "b2"}]
+        assert not (tmp_path / "operations.json").exists()
+
+
+class TestUndo:
+
+    def test_undo_organize(self, organizer, populated_dir):
+        organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+        organizer.undo()
+
+        assert (populated_dir / "report.pdf").exists()
+        assert not (populated_dir / "Documents" / "report.pdf").exists()
+        assert organizer.journal.last() is None
+
+    def test_undo_with_empty_log(self, organizer, capsys):
+        assert organizer.undo() is False
+        assert "no operation to undo" in capsys.readouterr().out
+
+    def test_undo_steps(self, organizer, tmp_path):
+        folder = tmp_path / "files"
+        folder.mkdir()
+        (folder / "a.txt").write_text("a")
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder), add_prefix="x"))
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder), add_suffix="y"))
+        assert organizer.undo(SimpleNamespace(id=None, steps=2))
+
+        assert [p.name for p in folder.iterdir()] == ["a.txt"]
+        assert organizer.journal.last() is None
+
+    def test_undo_id_rolls_back_later_operations_on_the_same_paths(self, organizer, tmp_path, capsys):
+        folder, other = tmp_path / "files", tmp_path / "other"
+        folder.mkdir()
+        other.mkdir()
+        (folder / "report.pdf").write_text("pdf")
+        (other / "b.txt").write_text("b")
+
+        organizer.organize_dir(SimpleNamespace(directory=str(folder)))
+        first = organizer.journal.last()["id"]
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder / "Documents"), add_prefix="x"))
+        organizer.bulk_rename(SimpleNamespace(directory=str(other), add_prefix="z"))
+        unrelated = organizer.journal.last()["id"]
+
+        assert organizer.undo(SimpleNamespace(id=first, steps=1))
+
+        assert (folder / "report.pdf").read_text() == "pdf"
+        assert (other / "z_b.txt").exists()
+        assert organizer.journal.last()["id"] == unrelated
+        assert f"Operations {first + 1} changed the same paths" in capsys.readouterr().out
+        assert organizer.undo(SimpleNamespace(id=first, steps=1)) is False
+
+    def test_history(self, organizer, populated_dir, capsys):
+        organizer.show_history(SimpleNamespace(limit=20))
+        assert "No operations" in capsys.readouterr().out
+
+        organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+        organizer.undo()
+        capsys.readouterr()
+        organizer.show_history(SimpleNamespace(limit=20))
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == ["ID", "Date", "Status", "Paths", "Action"]
+        assert lines[1].split()[2:] == ["undone", str(organizer.journal.get(1)["count"]), "organize", "directory"]
+
+
+class TestBackup:
+
+    def test_same_device_backup_is_a_hardlink(self, organizer, tmp_path):
+        f1 = tmp_path / "old.log"
+        f1.write_text("old data")
+
+        assert organizer._backup_deleted_files([f1], op_id=1, link=True)
+
+        blob = next((organizer.BASE_DIR / ".backups" / "objects").glob("*/*"))
+        assert blob.stat().st_ino == f1.stat().st_ino
+        f1.unlink()
+        assert blob.read_text() == "old data"
+
+    def test_linked_backup_reads_nothing(self, organizer, tmp_path):
+        f1 = tmp_path / "old.log"
+        f1.write_text("old data")
+
+        with mock.patch("hashing.file_digest") as digest:
+            assert organizer._backup_deleted_files([f1], op_id=1, link=True)
+        f1.unlink()
+        organizer.backup_store.restore(organizer.backup_store.manifest(1)[str(f1)])
+
+        digest.assert_not_called()
+        assert f1.read_text() == "old data"
+
+    def test_duplicate_backup_reuses_the_pipeline_hashes(self, organizer, tmp_path):
+        for name in ("a.bin", "bb.bin"):
+            (tmp_path / name).write_bytes(b"x" * (3 * hashing.SAMPLE_SIZE))
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=["shortest"], no_cache=True)
+
+        with mock.patch("hashing.file_digest", wraps=hashing.file_digest) as digest, \
+             mock.patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device")):
+            organizer.manage_duplicates(args)
+
+        assert digest.call_count == 2
+        assert not (tmp_path / "bb.bin").exists()
+        assert len(organizer.backup_store.manifest(1)) == 1
+
+    def test_backup_never_shares_an_inode_with_a_surviving_file(self, organizer, tmp_path):
+        f1, other = tmp_path / "old.log", tmp_path / "other.log"
+        f1.write_text("original")
+        os.link(f1, other)
+        kept = tmp_path / "kept.log"
+        kept.write_text("kept")
+
+        assert organizer.backup_store.add(1, f1, "d1", link=True) == "copied"
+        assert organizer.backup_store.add(1, kept, "d2", link=True) == "linked"
+        f1.unlink()
+        other.write_text("edited later")
+        # kept.log was backed up but not deleted after all
+        organizer.backup_store.unshare(1)
+        kept.write_text("edited later")
+
+        for path in (f1, kept):
+            path.unlink(missing_ok=True)
+            organizer.backup_store.restore(organizer.backup_store.manifest(1)[str(path)])
+        assert f1.read_text() == "original"
+        assert kept.read_text() == "kept"
+
+    def test_identical_files_are_stored_once(self, organizer, tmp_path):
+        for name in ("a.txt", "b.txt", "c.txt"):
+            (tmp_path / name).write_text("same")
+
+        organizer._backup_deleted_files([tmp_path / n for n in ("a.txt", "b.txt", "c.txt")], op_id=1)
+
+        assert len(list((organizer.BASE_DIR / ".backups" / "objects").glob("*/*"))) == 1
+        assert len(organizer.backup_store.manifest(1)) == 3
+
+    def test_cross_device_backup_is_copied(self, tmp_path):
+        store = BackupStore(tmp_path / "store")
+        f1 = tmp_path / "old.log"
+        f1.write_text("old data")
+
+        with mock.patch.object(backup_store.os, "link", side_effect=OSError(errno.EXDEV, "cross-device")):
+            assert store.add(1, f1, "abc123", link=True) == "copied"
+
+        assert (tmp_path / "store" / "objects" / "ab" / "abc123").stat().st_ino != f1.stat().st_ino
+
+    def test_expired_backup_is_reported(self, organizer, tmp_path, capsys):
+        f1 = tmp_path / "old.log"
+        f1.write_text("old data")
+        op_id = organizer.journal.begin("delete paths", backup="store")
+        organizer._backup_deleted_files([f1], op_id)
+        organizer._journal_deleted(op_id, organizer._delete_path([f1], "files", assume_yes=True))
+        organizer.backup_store.drop(op_id)
+
+        with mock.patch.object(organizer, "_undo_legacy_delete", side_effect=AssertionError("legacy")):
+            assert organizer.undo() is False
+
+        assert "has expired" in capsys.readouterr().out
+        assert organizer.journal.get(op_id)["status"] == "committed"
+
+    def test_yes_never_prompts_when_the_backup_fails(self, organizer, tmp_path):
+        old = tmp_path / "logs"
+        old.mkdir()
+        (old / "a.log").write_text("a")
+        os.utime(old / "a.log", (0, 0))
+
+        with mock.patch.object(organizer, "_backup_deleted_files", return_value=None), \
+                mock.patch("builtins.input", side_effect=AssertionError("prompted")):
+            organizer.clean_up(SimpleNamespace(directory=str(old), older_than=30, empty_folder=None,
+                                               recursive=False, yes=True))
+
+        assert (old / "a.log").exists()
+        assert organizer.journal.last() is None
+
+    def test_interactive_clean_up_links_only_the_chosen_files(self, organizer, tmp_path):
+        logs = tmp_path / "logs"
+        logs.mkdir()
+        for name in ("a.log", "b.log", "c.log"):
+            (logs / name).write_text(name)
+            os.utime(logs / name, (0, 0))
+
+        def answer(prompt):
+            return "n" if "b.log" in prompt else "y" if "delete" in prompt and "?" in prompt else "B"
+
+        with mock.patch("builtins.input", side_effect=answer), \
+                mock.patch("hashing.file_digest") as digest, mock.patch("fastcopy.copy_file") as copy:
+            organizer.clean_up(SimpleNamespace(directory=str(logs), older_than=30, empty_folder=None, recursive=False))
+
+        digest.assert_not_called()
+        copy.assert_not_called()
+        assert sorted(p.name for p in logs.iterdir()) == ["b.log"]
+        assert sorted(Path(path).name for path in organizer.backup_store.manifest(1)) == ["a.log", "c.log"]
+        assert organizer.undo()
+        assert (logs / "a.log").read_text() == "a.log"
+
+    def test_failed_group_backup_keeps_earlier_groups_undoable(self, organizer, tmp_path):
+        for name, content, age in [("a1", "aa", 100), ("a2", "aa", 0), ("b1", "bbbb", 100), ("b2", "bbbb", 0)]:
+            (tmp_path / f"{name}.txt").write_text(content)
+            os.utime(tmp_path / f"{name}.txt", (time.time() - age, time.time() - age))
+        add = organizer.backup_store.add
+        calls = []
+
+        def fail_second_group(op_id, path, *args, **kwargs):
+            calls.append(path)
+            if len(calls) == 2:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return add(op_id, path, *args, **kwargs)
+
+        with mock.patch.object(organizer.backup_store, "add", side_effect=fail_second_group), \
+                mock.patch("builtins.input", side_effect=["1", "no"]):
+            organizer.manage_duplicates(SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False))
+
+        assert not calls[0].exists() and calls[1].exists()
+        assert organizer.undo()
+        assert calls[0].exists()
+
+    def test_undo_restores_without_rehashing(self, organizer, tmp_path):
+        f1 = tmp_path / "old.log"
+        f1.write_text("old data")
+        f1.chmod(0o640)
+        mtime = f1.stat().st_mtime_ns
+
+        op_id = organizer.journal.begin("delete paths")
+        organizer._backup_deleted_files([f1], op_id)
+        with mock.patch("builtins.input", return_value="A"):
+            organizer._journal_deleted(op_id, organizer._delete_path([f1], "files"))
+
+        assert not f1.exists()
+        with mock.patch.object(organizer, "_hash_paths", side_effect=AssertionError("rehashed")):
+            organizer.undo()
+
+        assert f1.read_text() == "old data"
+        assert f1.stat().st_mtime_ns == mtime
+        assert f1.stat().st_mode & 0o777 == 0o640
+
+    def test_undo_several_delete_operations(self, organizer, tmp_path):
+        files = []
+        for name in ("first.log", "second.log"):
+            f = tmp_path / name
+            f.write_text(name)
+            op_id = organizer.journal.begin("delete paths")
+            organizer._backup_deleted_files([f], op_id)
+            with mock.patch("builtins.input", return_value="A"):
+                organizer._journal_deleted(op_id, organizer._delete_path([f], "files"))
+            files.append(f)
+
+        organizer.undo()
+        organizer.undo()
+
+        assert [f.read_text() for f in files] == ["first.log", "second.log"]
+
+    def test_prune_keeps_recent_manifests(self, tmp_path):
+        store = BackupStore(tmp_path / "store", keep=1)
+        for op_id, content in ((1, "one"), (2, "two")):
+            f = tmp_path / f"{content}.txt"
+            f.write_text(content)
+            store.add(op_id, f, hashlib.md5(content.encode()).hexdigest())
+
+        store.prune()
+
+        assert store.manifest(1) is None
+        assert store.manifest(2) is not None
+        assert len(list(store.objects.glob("*/*"))) == 1
+
+
+class TestFastCopy:
+
+    @pytest.mark.parametrize("size", [0, 1, 5 * 1024 * 1024 + 3])
+    def test_copy_matches_source(self, tmp_path, size):
+        src = tmp_path / "src.bin"
+        src.write_bytes(bytes(range(256)) * (size // 256) + b"x" * (size % 256))
+
+        fastcopy.copy_file(src, tmp_path / "dest.bin", fsync=True)
+
+        assert (tmp_path / "dest.bin").read_bytes() == src.read_bytes()
+
+    def test_falls_back_when_copy_file_range_is_refused(self, tmp_path):
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"data" * 1000)
+
+        with mock.patch.object(fastcopy.os, "copy_file_range", side_effect=OSError(errno.EXDEV, "cross-device")):
+            fastcopy.copy_file(src, tmp_path / "dest.bin")
+
+        assert (tmp_path / "dest.bin").read_bytes() == src.read_bytes()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+class TestWatch:
+
+    def test_new_files_are_organized(self, organizer, tmp_path):
+        watched = tmp_path / "drop"
+        watched.mkdir()
+        thread = threading.Thread(target=organizer.watch_dir,
+                                  args=(SimpleNamespace(directory=str(watched), debounce=0.05),))
+        thread.start()
+
+        try:
+            time.sleep(0.2)
+            (watched / "report.pdf").write_text("pdf")
+            (watched / "photo.jpg").write_text("jpg")
+
+            deadline = time.monotonic() + 2
+            while time.monotonic() < deadline and not (watched / "Images" / "photo.jpg").exists():
+                time.sleep(0.05)
+        finally:
+            organizer.stop_watching.set()
+            thread.join(timeout=5)
+
+        assert (watched / "Documents" / "report.pdf").exists()
+        assert (watched / "Images" / "photo.jpg").exists()
+        assert organizer.journal.last()["action"] == "organize directory"
+
+    def test_batch_skips_files_that_are_gone(self, organizer, tmp_path):
+        (tmp_path / "song.mp3").write_text("mp3")
+
+        moved = organizer._organize_batch(tmp_path, ["song.mp3", "vanished.txt"])
+
+        assert moved == 1
+        assert (tmp_path / "Audios" / "song.mp3").exists()
+
+
+class TestFileIndex:
+
+    @pytest.fixture
+    def tree(self, tmp_path):
+        root = tmp_path / "data"
+        (root / "sub").mkdir(parents=True)
+        (root / "big.bin").write_bytes(b"x" * 4096)
+        (root / "sub" / "copy.bin").write_bytes(b"x" * 4096)
+        (root / "sub" / "small.txt").write_text("small")
+        return root
+
+    def test_second_refresh_skips_unchanged_directories(self, tmp_path, tree):
+        index = FileIndex(tmp_path / "index.db")
+
+        first = index.refresh(tree)
+        second = index.refresh(tree)
+
+        assert first["files"] == 3 and first["listed"] == 2
+        assert second["listed"] == 0 and second["skipped"] == 2
+        index.close()
+
+    def test_refresh_notices_removed_files_and_directories(self, tmp_path, tree):
+        index = FileIndex(tmp_path / "index.db")
+        index.refresh(tree)
+
+        (tree / "big.bin").unlink()
+        for child in (tree / "sub").iterdir():
+            child.unlink()
+        (tree / "sub").rmdir()
+        stats = index.refresh(tree)
+
+        assert stats["removed"] == 3
+        assert list(index.files(tree)) == []
+        index.close()
+
+    def test_queries(self, tmp_path, tree):
+        index = FileIndex(tmp_path / "index.db")
+        index.refresh(tree)
+
+        top_level = [Path(path).name for path, _, _ in index.files(tree, recursive=False)]
+        large = {Path(path).name for path, _, _ in index.files(tree, min_size=1000)}
+        candidates = {Path(path).name for path, *_ in index.duplicate_candidates(tree)}
+
+        assert top_level == ["big.bin"]
+        assert large == {"big.bin", "copy.bin"}
+        assert candidates == {"big.bin", "copy.bin"}
+        assert index.scanned_at(tree / "sub") is not None
+        assert index.scanned_at(tmp_path) is None
+        index.close()
+
+    def test_find_large_answers_from_index(self, organizer, tree, capsys):
+        organizer.scan_dir(SimpleNamespace(directory=str(tree), full=False, hash=False))
+        args = SimpleNamespace(directory=str(tree), min_size='1KB', recursive=True, index=True)
+
+        with mock.patch("walker.walk") as walk:
+            organizer.find_large_files(args)
+
+        walk.assert_not_called()
+        captured = capsys.readouterr()
+        assert "Answering from the index" in captured.out
+        assert "copy.bin" in captured.out
+
+    def test_unindexed_directory_falls_back_to_walking(self, organizer, tree, capsys):
+        args = SimpleNamespace(directory=str(tree), min_size='1KB', recursive=True, index=True)
+
+        organizer.find_large_files(args)
+
+        captured = capsys.readouterr()
+        assert "has not been indexed yet" in captured.out
+        assert "copy.bin" in captured.out
+
+    def test_clean_up_rechecks_indexed_mtimes(self, organizer, tmp_path):
+        logs = tmp_path / "logs"
+        logs.mkdir()
+        old = time.time() - 100 * 86400
+        for name in ("a.log", "b.log"):
+            (logs / name).write_text(name)
+            os.utime(logs / name, (old, old))
+        organizer.scan_dir(SimpleNamespace(directory=str(logs), full=False, hash=False))
+
+        # Edited in place today: the directory mtime does not change, so the index keeps the old mtime
+        (logs / "a.log").write_text("edited today")
+        organizer.scan_dir(SimpleNamespace(directory=str(logs), full=False, hash=False))
+        organizer.clean_up(SimpleNamespace(directory=str(logs), older_than=30, empty_folder=None,
+                                           recursive=False, index=True, yes=True))
+
+        assert (logs / "a.log").exists()
+        assert not (logs / "b.log").exists()
+
+    def test_duplicates_reuse_hashes_stored_by_scan(self, organizer, tree, capsys):
+        organizer.scan_dir(SimpleNamespace(directory=str(tree), full=False, hash=True))
+        args = SimpleNamespace(directory=str(tree), min_size='1B', all=False, keep=["shortest"],
+                               dry_run=True, index=True)
+
+        with mock.patch("hashing.sample_digest") as sample, mock.patch("hashing.file_digest") as full:
+            organizer.manage_duplicates(args)
+
+        sample.assert_not_called()
+        full.assert_not_called()
+        assert "copy.bin" in capsys.readouterr().out
+
+
+class TestFindLarge:
+
+    @pytest.fixture
+    def sized_dir(self, tmp_path):
+        for name, size in [("a.bin", 3000), ("b.bin", 1000), ("c.bin", 5000), ("tiny.txt", 10)]:
+            (tmp_path / name).write_bytes(b"x" * size)
+        return tmp_path
+
+    def test_top_lists_largest_first(self, organizer, sized_dir, capsys):
+        args = SimpleNamespace(directory=str(sized_dir), min_size='100B', recursive=False, top=2)
+
+        organizer.find_large_files(args)
+
+        out = capsys.readouterr().out
+        assert "Largest 2 files" in out
+        assert out.index("c.bin") < out.index("a.bin")
+        assert "b.bin" not in out
+
+    def test_stream_prints_every_match(self, organizer, sized_dir, capsys):
+        args = SimpleNamespace(directory=str(sized_dir), min_size='100B', recursive=False, stream=True)
+
+        organizer.find_large_files(args)
+
+        out = capsys.readouterr().out
+        assert "3 files larger than" in out
+        assert all(name in out for name in ("a.bin", "b.bin", "c.bin"))
+        assert "tiny.txt" not in out
+
+    def test_by_directory_reports_subtrees(self, organizer, tmp_path, capsys):
+        (tmp_path / "big" / "deeper").mkdir(parents=True)
+        (tmp_path / "big" / "deeper" / "data.bin").write_bytes(b"x" * 256 * 1024)
+        (tmp_path / "small").mkdir()
+        args = SimpleNamespace(directory=str(tmp_path), min_size='100KB', recursive=False,
+                               by_directory=True, depth=1)
+
+        organizer.find_large_files(args)
+
+        out = capsys.readouterr().out
+        assert f"{tmp_path / 'big'}:" in out
+        assert "deeper" not in out
+        assert f"{tmp_path / 'small'}:" not in out
+
+
+class TestDiskUsage:
+
+    def test_children_come_before_parents(self, tmp_path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+
+        order = [Path(path) for path, _, _ in walker.disk_usage(tmp_path)]
+
+        assert order == [tmp_path / "a" / "b", tmp_path / "a", tmp_path]
+
+    def test_hardlinks_are_counted_once(self, tmp_path):
+        (tmp_path / "one").mkdir()
+        (tmp_path / "two").mkdir()
+        (tmp_path / "one" / "data.bin").write_bytes(b"x" * 256 * 1024)
+        (tmp_path / "two" / "link.bin").hardlink_to(tmp_path / "one" / "data.bin")
+
+        usage = {Path(path).name: size for path, _, size in walker.disk_usage(tmp_path, max_depth=1)}
+
+        assert (usage["one"] >= 256 * 1024) != (usage["two"] >= 256 * 1024)
+        assert usage[tmp_path.name] < 2 * 256 * 1024
+
+
+class TestEmptyFolders:
+
+    def test_nested_empty_folders_go_in_one_pass(self, organizer, tmp_path):
+        (tmp_path / "outer" / "inner" / "deepest").mkdir(parents=True)
+        (tmp_path / "kept" / "empty").mkdir(parents=True)
+        (tmp_path / "kept" / "file.txt").write_text("data")
+        args = SimpleNamespace(directory=str(tmp_path), empty_folder=True, recursive=True)
+
+        with mock.patch("builtins.input", return_value="A"):
+            organizer.clean_up(args)
+
+        assert not (tmp_path / "outer").exists()
+        assert not (tmp_path / "kept" / "empty").exists()
+        assert (tmp_path / "kept" / "file.txt").exists()
+        assert not (organizer.BASE_DIR / ".backups" / "manifests").exists()
+
+    def test_each_folder_is_read_once(self, tmp_path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+        (tmp_path / "c").mkdir()
+
+        with mock.patch("os.scandir", wraps=walker.os.scandir) as scandir:
+            found = list(walker.empty_dirs(tmp_path))
+
+        assert found.index(str(tmp_path / "a" / "b")) < found.index(str(tmp_path / "a"))
+        assert len(found) == 3
+        assert scandir.call_count == 4
+
+    def test_undo_recreates_folders(self, organizer, tmp_path):
+        (tmp_path / "outer" / "inner").mkdir(parents=True)
+        args = SimpleNamespace(directory=str(tmp_path), empty_folder=True, recursive=True)
+
+        with mock.patch("builtins.input", return_value="A"):
+            organizer.clean_up(args)
+        organizer.undo()
+
+        assert (tmp_path / "outer" / "inner").is_dir()
+
+
+class TestKeepPolicy:
+
+    @pytest.fixture
+    def group(self, tmp_path):
+        paths = [tmp_path / "archive" / "old.txt", tmp_path / "master" / "copy.txt", tmp_path / "a.txt"]
+        mtimes = {paths[0]: 100.0, paths[1]: 200.0, paths[2]: 300.0}
+        return paths, mtimes
+
+    def test_rules(self, tmp_path, group):
+        paths, mtimes = group
+
+        assert KeepPolicy(["newest"]).choose(paths, mtimes) == paths[2]
+        assert KeepPolicy(["oldest"]).choose(paths, mtimes) == paths[0]
+        assert KeepPolicy(["shortest"]).choose(paths, mtimes) == paths[2]
+        assert KeepPolicy([f"prefix:{tmp_path / 'master'}", "newest"]).choose(paths, mtimes) == paths[1]
+        assert KeepPolicy(["regex:archive/", "newest"]).choose(paths, mtimes) == paths[0]
+
+    def test_invalid_rules_are_rejected(self, tmp_path):
+        with pytest.raises(ValueError):
+            KeepPolicy(["biggest"])
+        with pytest.raises(ValueError):
+            KeepPolicy(["regex:("])
+
+        config = tmp_path / "policy.json"
+        config.write_text(json.dumps({"keep": ["oldest"]}))
+        assert KeepPolicy.from_file(config).rules == ["oldest"]
+
+    def test_dry_run_prints_plan_and_keeps_files(self, organizer, tmp_path, capsys):
+        (tmp_path / "one.txt").write_text("duplicate content")
+        (tmp_path / "two.txt").write_text("duplicate content")
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=["shortest", "oldest"], dry_run=True)
+
+        with mock.patch("builtins.input") as prompt:
+            organizer.manage_duplicates(args)
+
+        prompt.assert_not_called()
+        plan = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+        assert len(plan) == 1 and plan[0]["action"] == "delete"
+        assert (tmp_path / "one.txt").exists() and (tmp_path / "two.txt").exists()
+
+    def test_policy_deletes_without_prompting(self, organizer, tmp_path):
+        master = tmp_path / "master"
+        master.mkdir()
+        (master / "keep.txt").write_text("duplicate content")
+        (tmp_path / "copy1.txt").write_text("duplicate content")
+        (tmp_path / "copy2.txt").write_text("duplicate content")
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=[f"prefix:{master}"])
+
+        with mock.patch("builtins.input") as prompt:
+            organizer.manage_duplicates(args)
+
+        prompt.assert_not_called()
+        assert (master / "keep.txt").exists()
+        assert not (tmp_path / "copy1.txt").exists() and not (tmp_path / "copy2.txt").exists()
+
+        organizer.undo()
+        assert (tmp_path / "copy1.txt").read_text() == "duplicate content"
+
+    def test_clean_up_yes_skips_the_prompt(self, organizer, tmp_path):
+        old = tmp_path / "old.log"
+        old.write_text("log")
+        long_ago = time.time() - 100 * 86400
+        os.utime(old, (long_ago, long_ago))
+        args = SimpleNamespace(directory=str(tmp_path), older_than=30, recursive=False, yes=True)
+
+        with mock.patch("builtins.input") as prompt:
+            organizer.clean_up(args)
+
+        prompt.assert_not_called()
+        assert not old.exists()
+
+
+class TestLinkDuplicates:
+
+    @pytest.fixture
+    def copies(self, tmp_path):
+        paths = [tmp_path / "one.bin", tmp_path / "two.bin", tmp_path / "three.bin"]
+        for p in paths:
+            p.write_bytes(b"same bytes" * 1000)
+        return paths
+
+    def test_hardlink_keeps_every_path(self, organizer, tmp_path, copies):
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, action='hardlink')
+
+        organizer.manage_duplicates(args)
+
+        assert len({p.stat().st_ino for p in copies}) == 1
+        assert all(p.read_bytes() == b"same bytes" * 1000 for p in copies)
+        assert not list(tmp_path.glob(".*.tmp"))
+
+    def test_undo_splits_hardlinks(self, organizer, tmp_path, copies):
+        organizer.manage_duplicates(SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, action='hardlink'))
+
+        organizer.undo()
+
+        assert len({p.stat().st_ino for p in copies}) == 3
+        assert all(p.read_bytes() == b"same bytes" * 1000 for p in copies)
+
+    def test_existing_hardlinks_are_not_duplicates(self, organizer, tmp_path, capsys):
+        (tmp_path / "a.bin").write_bytes(b"data" * 100)
+        (tmp_path / "b.bin").hardlink_to(tmp_path / "a.bin")
+
+        with mock.patch("hashing.sample_digest") as sample:
+            organizer.manage_duplicates(SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False))
+
+        sample.assert_not_called()
+        assert "You have no duplicate files." in capsys.readouterr().out
+
+    def test_failed_reflink_leaves_files_alone(self, organizer, tmp_path, copies, capsys):
+        unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+        with mock.patch("fastcopy.fcntl.ioctl", side_effect=unsupported):
+            organizer.manage_duplicates(SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, action='reflink'))
+
+        assert "0 duplicates replaced with reflinks" in capsys.readouterr().out
+        assert len({p.stat().st_ino for p in copies}) == 3
+        assert not list(tmp_path.glob(".*.tmp"))
+        assert organizer.journal.last() is None
+
+
+class TestVerify:
+
+    @pytest.fixture
+    def pair(self, tmp_path):
+        (tmp_path / "one.txt").write_text("duplicate content")
+        (tmp_path / "two.txt").write_text("duplicate content")
+        return tmp_path / "one.txt", tmp_path / "two.txt"
+
+    def test_files_equal(self, tmp_path, pair):
+        other = tmp_path / "other.txt"
+        other.write_text("duplicate contenT")
+
+        assert hashing.files_equal(*pair, buffer_size=4)
+        assert not hashing.files_equal(pair[0], other, buffer_size=4)
+        assert not hashing.files_equal(pair[0], tmp_path / "missing.txt")
+
+        with mock.patch("hashing.MMAP_THRESHOLD", 1):
+            assert hashing.files_equal(*pair)
+            assert not hashing.files_equal(pair[0], other)
+
+    def test_mapped_files_compare_their_short_last_chunk(self, tmp_path):
+        a, b = tmp_path / "a.bin", tmp_path / "b.bin"
+        a.write_bytes(b"x" * 10 + b"y")
+        b.write_bytes(b"x" * 10 + b"z")
+
+        with mock.patch("hashing.MMAP_THRESHOLD", 1):
+            assert hashing.files_equal(a, a, buffer_size=4)
+            assert not hashing.files_equal(a, b, buffer_size=4)
+
+    def test_verification_is_parallel_by_default(self, organizer, tmp_path, pair):
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=["shortest"])
+
+        with mock.patch("hashing.map_bounded", wraps=hashing.map_bounded) as pool:
+            organizer.manage_duplicates(args)
+
+        assert pool.call_args_list[-1].kwargs["workers"] >= file_organizer.VERIFY_WORKERS
+        assert [p.exists() for p in pair] == [True, False]
+
+    def test_collision_is_not_deleted(self, organizer, tmp_path, pair):
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=["newest"])
+
+        with mock.patch("hashing.files_equal", return_value=False):
+            organizer.manage_duplicates(args)
+
+        assert all(p.exists() for p in pair)
+
+    def test_file_modified_after_hashing_is_skipped(self, organizer, tmp_path, pair, capsys):
+        args = SimpleNamespace(directory=str(tmp_path), min_size='1B', all=False, keep=["shortest"])
+        find_groups = organizer._find_duplicate_groups
+
+        def modify_after_hashing(candidates, known=None):
+            groups = find_groups(candidates, known)
+            for p in pair:
+                p.write_text("changed since the scan")
+            return groups
+
+        with mock.patch.object(organizer, "_find_duplicate_groups", modify_after_hashing):
+            organizer.manage_duplicates(args)
+
+        assert "changed since the scan" in capsys.readouterr().out
+        assert all(p.exists() for p in pair)
+
+
+class TestOrganizePlan:
+
+    def test_recursive_organize_empties_subfolders(self, organizer, tmp_path):
+        (tmp_path / "inbox" / "deep").mkdir(parents=True)
+        (tmp_path / "inbox" / "deep" / "photo.jpg").write_text("jpg")
+        (tmp_path / "inbox" / "report.pdf").write_text("pdf")
+        (tmp_path / "Images").mkdir()
+        (tmp_path / "Images" / "already.jpg").write_text("jpg")
+
+        organizer.organize_dir(SimpleNamespace(directory=str(tmp_path), recursive=True))
+
+        assert (tmp_path / "Images" / "photo.jpg").exists()
+        assert (tmp_path / "Images" / "already.jpg").exists()
+        assert (tmp_path / "Documents" / "report.pdf").exists()
+        assert not (tmp_path / "inbox").exists()
+
+        organizer.undo()
+        assert (tmp_path / "inbox" / "deep" / "photo.jpg").exists()
+
+    def test_recursive_organize_skips_hidden_excluded_and_own_directories(self, tmp_path):
+        root = tmp_path / "home"
+        for folder in (".git", "node_modules", "tool", "inbox"):
+            (root / folder).mkdir(parents=True)
+            (root / folder / "report.pdf").write_text(folder)
+        organizer = FileOrganizer(base_dir=root / "tool")
+
+        organizer.organize_dir(SimpleNamespace(directory=str(root), recursive=True))
+
+        assert (root / "Documents" / "report.pdf").read_text() == "inbox"
+        assert all((root / folder / "report.pdf").exists() for folder in (".git", "node_modules", "tool"))
+
+    def test_recursive_organize_removes_only_the_folders_it_emptied(self, organizer, tmp_path):
+        root = tmp_path / "repo"
+        for folder in (".git/refs/heads", ".git/objects", "node_modules/pkg/empty", "was_empty", "inbox/deep"):
+            (root / folder).mkdir(parents=True)
+        (root / ".git" / "HEAD").write_text("ref: refs/heads/main")
+        (root / "inbox" / "deep" / "photo.jpg").write_text("jpg")
+
+        organizer.organize_dir(SimpleNamespace(directory=str(root), recursive=True))
+
+        assert (root / "Images" / "photo.jpg").exists()
+        assert not (root / "inbox").exists()
+        for folder in (".git/refs/heads", ".git/objects", "node_modules/pkg/empty", "was_empty"):
+            assert (root / folder).is_dir()
+
+    def test_destination_created_after_planning_is_kept(self, organizer, tmp_path):
+        (tmp_path / "report.pdf").write_text("pdf")
+        plan = organizer._plan_organize(tmp_path)
+        (tmp_path / "Documents").mkdir()
+        (tmp_path / "Documents" / "report.pdf").write_text("arrived later")
+
+        organizer._apply_organize_plan(plan, organizer.journal.begin("organize directory"))
+
+        assert (tmp_path / "Documents" / "report.pdf").read_text() == "arrived later"
+        assert (tmp_path / "report.pdf").read_text() == "pdf"
+
+    def test_collisions_are_named_without_probing(self, organizer, tmp_path):
+        (tmp_path / "a").mkdir()
+        (tmp_path / "a" / "photo.jpg").write_text("a")
+        (tmp_path / "photo.jpg").write_text("top")
+        (tmp_path / "Images").mkdir()
+        (tmp_path / "Images" / "photo.jpg").write_text("existing")
+
+        with mock.patch.object(Path, "exists", side_effect=AssertionError("probed")):
+            plan = organizer._plan_organize(tmp_path, recursive=True)
+
+        assert sorted(dest.name for _, dest, _ in plan) == ["photo_2.jpg", "photo_3.jpg"]
+
+    def test_dry_run_moves_nothing(self, organizer, populated_dir, capsys):
+        organizer.organize_dir(SimpleNamespace(directory=str(populated_dir), dry_run=True))
+
+        plan = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert {Path(step["from"]).name for step in plan} >= {"report.pdf", "photo.jpg"}
+        assert (populated_dir / "report.pdf").exists()
+        assert not (populated_dir / "Documents").exists()
+
+
+class TestCrossDeviceMoves:
+
+    @pytest.fixture
+    def other_device(self):
+        # Every rename or link out of its own folder fails as it would between two filesystems
+        def crossing(real):
+            def call(src, dst, **kwargs):
+                if Path(src).parent != Path(dst).parent:
+                    raise OSError(errno.EXDEV, "Invalid cross-device link")
+                return real(src, dst, **kwargs)
+            return call
+
+        with mock.patch("os.rename", side_effect=crossing(os.rename)), \
+             mock.patch("os.link", side_effect=crossing(os.link)):
+            yield
+
+    def test_destination_created_after_planning_is_kept(self, organizer, populated_dir, other_device):
+        plan = organizer._plan_organize(populated_dir)
+        (populated_dir / "Documents").mkdir()
+        (populated_dir / "Documents" / "report.pdf").write_text("arrived later")
+
+        organizer._apply_organize_plan(plan, organizer.journal.begin("organize directory"))
+
+        assert (populated_dir / "Documents" / "report.pdf").read_text() == "arrived later"
+        assert (populated_dir / "report.pdf").read_text() == "pdf content"
+        assert (populated_dir / "Images" / "photo.jpg").exists()
+        assert not list(populated_dir.rglob("*.part"))
+
+    def test_files_are_copied_then_removed(self, organizer, populated_dir, other_device):
+        with mock.patch("fastcopy.fsync_path", wraps=fastcopy.fsync_path) as fsync:
+            organizer.organize_dir(SimpleNamespace(directory=str(populated_dir), workers=3))
+
+        assert (populated_dir / "Documents" / "report.pdf").read_text() == "pdf content"
+        assert not (populated_dir / "report.pdf").exists()
+        assert not list(populated_dir.rglob("*.part"))
+        assert fsync.call_count >= 6
+        assert organizer.journal.last()["count"] == 6
+
+    def test_failed_copy_keeps_the_source(self, organizer, populated_dir, other_device):
+        real_copy = fastcopy.copy_file
+
+        def flaky_copy(src, dest, fsync=False):
+            if Path(src).name == "photo.jpg":
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return real_copy(src, dest, fsync)
+
+        with mock.patch("fastcopy.copy_file", side_effect=flaky_copy):
+            organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+
+        assert (populated_dir / "photo.jpg").read_text() == "image content"
+        assert not (populated_dir / "Images" / "photo.jpg").exists()
+        assert (populated_dir / "Audios" / "song.mp3").exists()
+        assert not list(populated_dir.rglob("*.part"))
+
+
+class TestOutputModes:
+
+    def test_quiet_organize_prints_only_the_summary(self, organizer, populated_dir, capsys):
+        organizer.set_output(quiet=True)
+
+        organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+
+        out = capsys.readouterr().out
+        assert "Organizing" not in out
+        assert "Organized 6 files" in out
+
+    def test_progress_line_is_throttled(self, organizer, populated_dir, capsys):
+        organizer.set_output(progress=True)
+
+        organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+
+        captured = capsys.readouterr()
+        assert "Organizing" not in captured.out
+        assert captured.err.count("\n") == 1
+        assert "Organizing: 6 files" in captured.err
+
+    def test_status_shows_rate_and_eta(self):
+        stream = mock.Mock()
+        progress = Progress("Hashing", total=10, interval=0, stream=stream)
+
+        progress.update(nbytes=1024**2)
+        progress.close()
+
+        status = stream.write.call_args_list[0].args[0]
+        assert "1/10 files" in status and "files/s" in status and "ETA" in status
+        assert stream.write.call_args_list[-1].args[0].endswith("\n")
+
+    def test_per_file_messages_go_to_the_log_file(self, organizer, populated_dir, tmp_path):
+        log_file = tmp_path.parent / f"{tmp_path.name}.log"
+        organizer.set_output(quiet=True)
+
+        # Leave the root logger (and pytest's handlers on it) alone
+        with mock.patch("logging.basicConfig"):
+            file_organizer.configure_logging(quiet=True, log_file=str(log_file))
+
+        try:
+            organizer.organize_dir(SimpleNamespace(directory=str(populated_dir)))
+        finally:
+            for handler in file_organizer.file_log.handlers:
+                handler.close()
+            file_organizer.file_log.handlers.clear()
+
+        assert "Organizing report.pdf" in log_file.read_text()
+
+
+class TestRenamePlan:
+
+    def test_chains_and_swaps_are_ordered(self, tmp_path):
+        names = {"a", "b", "c", "x", "y"}
+        p = lambda name: str(tmp_path / name)
+
+        steps, conflicts = plan_renames([(p("a"), p("b")), (p("b"), p("a")), (p("x"), p("y")), (p("y"), p("z"))],
+                                        listdir=lambda d: names)
+
+        assert conflicts == []
+        assert steps.index((p("y"), p("z"))) < steps.index((p("x"), p("y")))
+        assert len(steps) == 5
+        assert steps[-1][1] in (p("a"), p("b"))
+
+    def test_conflicts_block_the_whole_chain(self, tmp_path):
+        p = lambda name: str(tmp_path / name)
+
+        steps, conflicts = plan_renames([(p("a"), p("b")), (p("b"), p("c")), (p("d"), p("e")), (p("f"), p("e"))],
+                                        listdir=lambda d: {"a", "b", "c", "d", "f"})
+
+        assert steps == [(p("d"), p("e"))]
+        assert {src for src, _, _ in conflicts} == {p("a"), p("b"), p("f")}
+
+    def test_bulk_rename_swaps_names(self, organizer, tmp_path):
+        (tmp_path / "1.txt").write_text("one")
+        (tmp_path / "2.txt").write_text("two")
+        # Listed as 2.txt, 1.txt, the {count} pattern swaps the two names
+        listing = [walker.Entry(str(tmp_path / name), name, False, True, 0, 0.0, 0, 0, 0) for name in ("2.txt", "1.txt")]
+
+        with mock.patch("walker.walk", return_value=listing):
+            organizer.bulk_rename(SimpleNamespace(directory=str(tmp_path), pattern="{count}"))
+
+        assert (tmp_path / "1.txt").read_text() == "two"
+        assert (tmp_path / "2.txt").read_text() == "one"
+        assert not list(tmp_path.glob(".*renaming*"))
+
+        organizer.undo()
+        assert (tmp_path / "1.txt").read_text() == "one"
+
+
+    def test_failed_swap_puts_the_parked_file_back(self, organizer, tmp_path, capsys):
+        a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+        a.write_text("a")
+        b.write_text("b")
+        rename = os.rename
+
+        def refuse_b(src, dst):
+            if src == str(b):
+                raise PermissionError(errno.EACCES, "Permission denied")
+            rename(src, dst)
+
+        with mock.patch("os.rename", side_effect=refuse_b):
+            assert organizer._run_renames([(str(a), str(b)), (str(b), str(a))]) == 0
+
+        assert a.read_text() == "a" and b.read_text() == "b"
+        assert not list(tmp_path.glob(".*renaming*"))
+        assert "a.txt was moved back to its old name" in capsys.readouterr().out
+
+
+class TestRenameTemplate:
+
+    def entry(self, path, size=0, mtime=0.0, ctime=0.0):
+        return walker.Entry(str(path), Path(path).name, False, True, size, mtime, 0, 0, 0, ctime)
+
+    def test_format_specs_and_new_placeholders(self, tmp_path):
+        when = time.mktime((2024, 3, 5, 12, 0, 0, 0, 0, -1))
+        entry = self.entry(tmp_path / "photos" / "cat.jpg", size=1234567, mtime=when, ctime=when)
+
+        assert RenameTemplate("{count:05}_{name}").render(entry, 7) == "00007_cat"
+        assert RenameTemplate("{parent}-{size:,}-{doc_type}").render(entry, 1) == "photos-1,234,567-Image"
+        assert RenameTemplate("{ctime}_{last_modified:%Y%m}").render(entry, 1) == "2024-03-05_202403"
+        assert RenameTemplate("{{{hash8}}}").render(entry, 1, "deadbeefcafe") == "{deadbeef}"
+
+    def test_invalid_patterns_are_rejected(self):
+        with pytest.raises(ValueError, match="invalid placeholder"):
+            RenameTemplate("{name}_{owner}")
+        with pytest.raises(ValueError):
+            RenameTemplate("{count:x5}")
+
+    def test_separators_are_rejected(self, organizer, tmp_path, capsys):
+        with pytest.raises(ValueError, match="cannot contain"):
+            RenameTemplate("photos/{name}")
+
+        (tmp_path / "a.txt").write_text("a")
+        organizer.bulk_rename(SimpleNamespace(directory=str(tmp_path), pattern="{last_modified:%Y/%m}_{name}"))
+        assert "Invalid pattern" in capsys.readouterr().out
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(tmp_path), add_prefix="x/y"))
+        assert "a.txt cannot be renamed to x/y_a: the name contains a path separator" in capsys.readouterr().out
+        assert [p.name for p in tmp_path.iterdir() if p.is_file()] == ["a.txt"]
+
+    def test_stat_and_hash_only_when_needed(self):
+        assert not RenameTemplate("{doc_type}_{count}_{name}").needs_stat
+        assert RenameTemplate("{size}").needs_stat
+        assert RenameTemplate("{hash8}").needs_hash
+
+    def test_bulk_rename_with_template(self, organizer, tmp_path):
+        folder = tmp_path / "files"
+        (folder / "sub").mkdir(parents=True)
+        (folder / "a.txt").write_text("aaaa")
+        (folder / "b.txt").write_text("bb")
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder), pattern="{name}_{count:03}"))
+        renamed = sorted(p.name for p in folder.iterdir() if p.is_file())
+        assert [name[:2] for name in renamed] == ["a_", "b_"]
+        assert sorted(name[2:] for name in renamed) == ["001.txt", "002.txt"]
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder), pattern="{size}b_{hash8}"))
+        names = sorted(p.name for p in folder.iterdir())
+        assert names[0] == f"2b_{hashlib.md5(b'bb').hexdigest()[:8]}.txt"
+        assert names[1].startswith("4b_") and names[2] == "sub"
+
+    def test_bulk_rename_rejects_unknown_placeholder(self, organizer, tmp_path, capsys):
+        (tmp_path / "a.txt").write_text("a")
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(tmp_path), pattern="{name}_{owner}"))
+
+        assert "Invalid pattern" in capsys.readouterr().out
+        assert (tmp_path / "a.txt").exists()
+
+
+class TestFilteredRename:
+
+    def entry(self, path, size=0):
+        return walker.Entry(str(path), Path(path).name, False, True, size, 0.0, 0, 0, 0)
+
+    def test_filter_rules(self):
+        keep = FileFilter(["ext:JPG,heic", "IMG_*"], ["regex:/trash/", "size:<1KB"])
+
+        assert keep.needs_stat
+        assert keep.matches(self.entry("/photos/a.jpg", 2048))
+        assert keep.matches(self.entry("/photos/IMG_1.png", 2048))
+        assert not keep.matches(self.entry("/photos/a.png", 2048))
+        assert not keep.matches(self.entry("/photos/trash/a.jpg", 2048))
+        assert not keep.matches(self.entry("/photos/a.jpg", 100))
+        assert not FileFilter(["*.jpg"]).needs_stat
+
+        for rule in ("ext:", "regex:(", "size:10MB", "size:>10XB"):
+            with pytest.raises(ValueError):
+                FileFilter([rule])
+
+    def test_recursive_filtered_rename(self, organizer, tmp_path):
+        folder = tmp_path / "photos"
+        (folder / "2024").mkdir(parents=True)
+        (folder / "a.jpg").write_bytes(b"x" * 2048)
+        (folder / "2024" / "b.JPG").write_bytes(b"x" * 2048)
+        (folder / "2024" / "small.jpg").write_bytes(b"x")
+        (folder / "2024" / "notes.txt").write_text("keep")
+
+        organizer.bulk_rename(SimpleNamespace(directory=str(folder), add_prefix="trip", recursive=True,
+                                              include=["ext:jpg"], exclude=["size:<1KB"]))
+
+        assert sorted(str(p.relative_to(folder)) for p in folder.rglob("*") if p.is_file()) == \
+            ["2024/notes.txt", "2024/small.jpg", "2024/trip_b.JPG", "trip_a.jpg"]
+
+    def test_preview_reads_only_what_it_shows(self, organizer, tmp_path, capsys):
+        read = []
+
+        def listing(*args, **kwargs):
+            for i in range(100_000):
+                read.append(i)
+                yield self.entry(tmp_path / f"{i}.txt")
+
+        with mock.patch("walker.walk", side_effect=listing), mock.patch("os.rename") as rename:
+            organizer.bulk_rename(SimpleNamespace(directory=str(tmp_path), pattern="{count:03}", preview=3))
+
+        assert capsys.readouterr().out.splitlines() == ["0.txt -> 001.txt", "1.txt -> 002.txt", "2.txt -> 003.txt"]
+        assert len(read) <= file_organizer.RENAME_BATCH
+        rename.assert_not_called()
+
+
+class TestResume:
+
+    def test_pending_skips_done_entries(self, tmp_path):
+        journal = OperationJournal(tmp_path)
+        op_id = journal.begin("rename paths", directory="/x")
+        for i in range(3):
+            journal.plan(op_id, {"from": f"a{i}", "to": f"b{i}"})
+        journal.record(op_id, {"from": "a0", "to": "b0"})
+        journal.flush()
+        journal.index_path.unlink()
+
+        reopened = OperationJournal(tmp_path)
+        assert reopened.get(op_id)["status"] == "open"
+        assert reopened.header(op_id)["directory"] == "/x"
+        assert reopened.pending(op_id) == [{"from": "a1", "to": "b1"}, {"from": "a2", "to": "b2"}]
+        assert list(reopened.entries(op_id)) == [{"from": "a0", "to": "b0"}]
+
+    def test_resume_interrupted_organize(self, tmp_path, monkeypatch):
+        folder = tmp_path / "files"
+        folder.mkdir()
+        for name in ("a.pdf", "b.pdf", "c.jpg", "d.jpg", "e.mp3"):
+            (folder / name).write_text(name)
+        monkeypatch.setattr(file_organizer, "CHECKPOINT_FILES", 2)
+
+        organizer = FileOrganizer(base_dir=tmp_path)
+        apply_chunk = organizer._apply_organize_chunk
+        calls = []
+
+        def crash_on_second_chunk(chunk, *args):
+            calls.append(chunk)
+            if len(calls) == 2:
+                # The first move of the chunk lands, then the process dies before recording it
+                src, dest, _ = chunk[0]
+                dest.parent.mkdir(exist_ok=True)
+                os.rename(src, dest)
+                raise KeyboardInterrupt
+            apply_chunk(chunk, *args)
+
+        with mock.patch.object(organizer, "_apply_organize_chunk", side_effect=crash_on_second_chunk):
+            with pytest.raises(KeyboardInterrupt):
+                organizer.organize_dir(SimpleNamespace(directory=str(folder)))
+
+        restarted = FileOrganizer(base_dir=tmp_path)
+        op_id = restarted.journal.last("open")["id"]
+        assert len(list(restarted.journal.entries(op_id))) == 2
+
+        assert restarted.resume()
+        assert sorted(p.name for p in folder.iterdir() if p.is_file()) == []
+        assert restarted.journal.get(op_id)["status"] == "committed"
+        assert len(list(restarted.journal.entries(op_id))) == 5
+
+        restarted.undo()
+        assert sorted(p.name for p in folder.iterdir() if p.is_file()) == ["a.pdf", "b.pdf", "c.jpg", "d.jpg", "e.mp3"]
+
+    def test_resume_interrupted_rename(self, organizer, tmp_path):
+        folder = tmp_path / "files"
+        folder.mkdir()
+        (folder / "1.txt").write_text("one")
+        (folder / "2.txt").write_text("two")
+        rename = os.rename
+        done = []
+
+        def die_after_one(src, dst):
+            if done:
+                raise KeyboardInterrupt
+            rename(src, dst)
+            done.append(src)
+
+        # A swap goes through a temporary name: the run dies with one file parked under it
+        with mock.patch("os.rename", side_effect=die_after_one), pytest.raises(KeyboardInterrupt):
+            organizer._run_renames([(str(folder / "1.txt"), str(folder / "2.txt")),
+                                    (str(folder / "2.txt"), str(folder / "1.txt"))])
+
+        assert organizer.resume()
+        assert (folder / "1.txt").read_text() == "two"
+        assert (folder / "2.txt").read_text() == "one"
+        assert sorted(p.name for p in folder.iterdir()) == ["1.txt", "2.txt"]
+
+    def test_undo_interrupted_operation(self, organizer, tmp_path, capsys):
+        folder = tmp_path / "files"
+        folder.mkdir()
+        (folder / "a.txt").write_text("a")
+        op_id = organizer.journal.begin("rename paths")
+        organizer.journal.plan(op_id, {"from": str(folder / "a.txt"), "to": str(folder / "b.txt")})
+        organizer.journal.plan(op_id, {"from": str(folder / "x.txt"), "to": str(folder / "y.txt")})
+        os.rename(folder / "a.txt", folder / "b.txt")
+        organizer.journal.record(op_id, {"from": str(folder / "a.txt"), "to": str(folder / "b.txt")})
+
+        assert organizer.resume(SimpleNamespace(id=op_id + 1)) is False
+        assert organizer.undo(SimpleNamespace(id=op_id, steps=1))
+        assert [p.name for p in folder.iterdir()] == ["a.txt"]
+        assert organizer.resume() is False
+        assert "no interrupted operation" in capsys.readouterr().out